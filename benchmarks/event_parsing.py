@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks.symbol_index import generate_repo
+
+MODES = ('full', 'stream')
+
+# Only these frame fields reach the prompt and the fingerprint, the rest is dropped by the stream mode
+COMPARED_FRAME_FIELDS = ('filename', 'abs_path', 'module', 'function', 'lineno', 'context_line', 'in_app')
+
+
+def make_frames(rng, num_files, count, vars_size):
+    frames = []
+    for position in range(count):
+        index = rng.randrange(num_files)
+        in_app = position % 3 != 0
+        path = f"pkg{index // 100}/module{index}.py" if in_app else f"site-packages/lib{position}/core.py"
+        frames.append({
+            "filename": path,
+            "abs_path": f"/srv/app/{path}",
+            "module": path[:-3].replace('/', '.'),
+            "function": "fetch",
+            "lineno": 11,
+            "colno": 8,
+            "context_line": "        return self.client.get(key, default)",
+            "pre_context": [f"    line {line}" for line in range(5)],
+            "post_context": [f"    line {line}" for line in range(5)],
+            "in_app": in_app,
+            # Local variables are the largest part of real frames
+            "vars": {f"var_{name}": "x" * rng.randrange(vars_size) for name in range(20)}
+        })
+    return frames
+
+
+def make_event(api_format, size, num_files, seed):
+    rng = random.Random(seed)
+    frames = make_frames(rng, num_files, 40, max(1, size // 2000))
+    breadcrumbs = []
+    breadcrumb_size = 0
+    # Breadcrumbs and the request body fill the event up to the requested size
+    while breadcrumb_size < size * 0.6:
+        breadcrumb = {
+            "timestamp": 1700000000 + len(breadcrumbs), "category": "http", "level": "info",
+            "message": f"GET /items/{len(breadcrumbs)}", "data": {"status_code": 200, "body": "y" * rng.randrange(400)}
+        }
+        breadcrumbs.append(breadcrumb)
+        breadcrumb_size += len(json.dumps(breadcrumb))
+    request = {"url": "https://example.com/items", "method": "POST", "data": {"payload": "z" * int(size * 0.2)}}
+    exception = {"type": "KeyError", "value": "'item'", "module": frames[-1]['module'], "stacktrace": {"frames": frames}}
+
+    if api_format:
+        return {
+            "id": f"event-{seed}", "groupID": f"{seed}", "projectID": "1", "platform": "python", "release": "app@1.0.0",
+            "entries": [
+                {"type": "breadcrumbs", "data": {"values": breadcrumbs}},
+                {"type": "exception", "data": {"values": [exception]}},
+                {"type": "request", "data": request}
+            ],
+            "contexts": {"os": {"name": "Linux"}}, "tags": [["level", "error"]], "user": {"id": "1"},
+            "dateReceived": "2024-01-01T00:00:00Z"
+        }
+    return {
+        "event_id": f"event-{seed}", "issue_id": f"{seed}", "project": "1", "platform": "python", "release": "app@1.0.0",
+        "exception": {"values": [exception]}, "breadcrumbs": {"values": breadcrumbs}, "request": request,
+        "tags": [["level", "error"]], "user": {"id": "1"}, "extra": {}, "timestamp": 1700000000
+    }
+
+
+def digest(processed_data):
+    processed_data = {
+        **processed_data,
+        "stacktrace": [
+            {field: frame.get(field) for field in COMPARED_FRAME_FIELDS} for frame in processed_data['stacktrace']
+        ]
+    }
+    return hashlib.sha256(json.dumps(processed_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def parse(notifier, mode, event_path):
+    from exception_handler.notifiers.json_scanner import map_file
+
+    # The command line path before and after streaming was added
+    if mode == 'full':
+        with open(event_path, 'r') as event_file:
+            event = json.load(event_file)
+    else:
+        with open(event_path, 'rb') as event_file, map_file(event_file) as data:
+            event = notifier.load_event(data)
+    return notifier.process_exception(event)
+
+
+def measure(mode, event_path, repo_path, repeat):
+    # Runs in a fresh process, so the peak RSS of one mode isn't inflated by the other
+    os.environ['EVENT_PARSE_MODE'] = mode
+    from exception_handler.notifiers.sentry_notifier import SentryNotifier
+
+    notifier = SentryNotifier({'local_repo_path': repo_path})
+    notifier.path_index.refresh()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processed_data = parse(notifier, mode, event_path)
+        times.append(time.perf_counter() - start)
+    rss_increase = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024
+
+    tracemalloc.start()
+    parse(notifier, mode, event_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": statistics.median(times), "peak_traced": peak, "peak_rss_increase": rss_increase,
+        "digest": digest(processed_data)
+    }
+
+
+def run_measurement(mode, event_path, repo_path, repeat):
+    command = [
+        sys.executable, '-m', 'benchmarks.event_parsing', '--measure', mode, '--repo', repo_path,
+        '--repeat', str(repeat), event_path
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_results(results):
+    for name, result in results.items():
+        print(f"{name} ({result['size'] / 1024 / 1024:.1f} MB): "
+              f"{'identical' if result['identical'] else 'DIFFERENT'} processed events")
+        for mode in MODES:
+            stats = result['modes'][mode]
+            print(f"  {mode:<7} {stats['seconds'] * 1000:>9.1f}ms  peak traced {stats['peak_traced'] / 1024 / 1024:>8.1f} MB  "
+                  f"peak RSS +{stats['peak_rss_increase'] / 1024 / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the full and stream parse modes of Sentry events")
+    parser.add_argument('events', nargs='*', help="Recorded Sentry event JSON files (large events are generated if omitted)")
+    parser.add_argument('--repo', help="Repository the frames are resolved against (a synthetic one is generated if omitted)")
+    parser.add_argument('--sizes', default='1,10,50', help="Comma separated sizes in MB of the generated events")
+    parser.add_argument('--repeat', type=int, default=3, help="Parses per mode, the median time is reported")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--measure', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.events[0], args.repo, args.repeat)))
+        return
+
+    num_files = 200
+    with tempfile.TemporaryDirectory() as work_dir:
+        repo_path = args.repo
+        if not repo_path:
+            for variable, value in (('NAME', 'Benchmark'), ('EMAIL', 'benchmark@example.com')):
+                os.environ.setdefault(f'GIT_AUTHOR_{variable}', value)
+                os.environ.setdefault(f'GIT_COMMITTER_{variable}', value)
+            repo_path = os.path.join(work_dir, 'repo')
+            generate_repo(repo_path, num_files)
+
+        event_paths = list(args.events)
+        if not event_paths:
+            for size in (float(size) for size in args.sizes.split(',') if size.strip()):
+                for api_format in (False, True):
+                    event_path = os.path.join(work_dir, f"{'api' if api_format else 'webhook'}-{size:g}mb.json")
+                    with open(event_path, 'w') as event_file:
+                        json.dump(make_event(api_format, int(size * 1024 * 1024), num_files, len(event_paths)), event_file)
+                    event_paths.append(event_path)
+
+        results = {}
+        for event_path in event_paths:
+            modes = {mode: run_measurement(mode, event_path, repo_path, args.repeat) for mode in MODES}
+            results[os.path.basename(event_path)] = {
+                "size": os.path.getsize(event_path),
+                "identical": len({stats.pop('digest') for stats in modes.values()}) == 1,
+                "modes": modes
+            }
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {args.output}")
+    if not all(result['identical'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
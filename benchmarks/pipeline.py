@@ -0,0 +1,499 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import importlib
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from git import Repo
+from langchain_core.messages import AIMessage
+from benchmarks.symbol_index import generate_repo
+from exception_handler.ai.base_llm_service import BaseLLMService
+from exception_handler.cache.result_store import ResultStore
+from exception_handler.cache.single_flight import SingleFlight
+from exception_handler.metrics import STAGE_SECONDS
+from exception_handler.server import Server
+
+PATHS = ('cli', 'webhook', 'batch', 'server')
+# Line of `return self.client.get(key, default)` in the generated modules
+FETCH_LINENO = 11
+# Tagged on the generated repository, so the sources are read through the release-aware blob reader
+RELEASE = 'benchmark@1.0.0'
+
+
+class FakeChatModel:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def invoke(self, prompt_text):
+        time.sleep(self.latency)
+        return self._respond(prompt_text)
+
+    async def ainvoke(self, prompt_text):
+        await asyncio.sleep(self.latency)
+        return self._respond(prompt_text)
+
+    def _respond(self, prompt_text):
+        # Adds a new file named after the prompt, so every fix applies cleanly and identical prompts get identical fixes
+        name = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()[:16]
+        diff = (
+            f"diff --git a/fixes/fix_{name}.py b/fixes/fix_{name}.py\n"
+            "new file mode 100644\n"
+            "--- /dev/null\n"
+            f"+++ b/fixes/fix_{name}.py\n"
+            "@@ -0,0 +1 @@\n"
+            "+FIXED = True\n"
+        )
+        content = json.dumps({"diff": diff, "analysis": "Simulated analysis"})
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": len(prompt_text) // 4, "output_tokens": len(content) // 4, "total_tokens": 0
+        })
+
+
+class FakeLLMService(BaseLLMService):
+    model_name = "fake"
+
+    def __init__(self, config, latency):
+        self.latency = latency
+        super().__init__(config)
+
+    def _initialize_llm(self):
+        self.llm = FakeChatModel(self.latency)
+
+    def _generate_fix(self, prompt):
+        return self._parse_response(*self._invoke_llm(prompt.to_string()))
+
+    async def _generate_fix_async(self, prompt):
+        return self._parse_response(*await self._ainvoke_llm(prompt.to_string()))
+
+
+class FakePullRequest:
+    def __init__(self, url):
+        self.html_url = url
+
+
+class FakeGitHubRepo:
+    def __init__(self, full_name, default_branch, latency):
+        self.full_name = full_name
+        self.default_branch = default_branch
+        self.latency = latency
+        self.pull_count = 0
+
+    def create_pull(self, title, body, head, base):
+        time.sleep(self.latency)
+        self.pull_count += 1
+        return FakePullRequest(f"https://github.com/{self.full_name}/pull/{self.pull_count}")
+
+
+def setup_repository(work_dir, num_files):
+    for variable, value in (('NAME', 'Benchmark'), ('EMAIL', 'benchmark@example.com')):
+        os.environ.setdefault(f'GIT_AUTHOR_{variable}', value)
+        os.environ.setdefault(f'GIT_COMMITTER_{variable}', value)
+    repo = generate_repo(os.path.join(work_dir, 'repo'), num_files)
+    repo.create_tag(f"v{RELEASE.rpartition('@')[2]}")
+    origin_path = os.path.join(work_dir, 'origin.git')
+    Repo.init(origin_path, bare=True)
+    repo.create_remote('origin', origin_path)
+    default_branch = repo.active_branch.name
+    repo.git.push('origin', f'{default_branch}:refs/heads/{default_branch}')
+    repo.git.fetch('origin')
+    return repo, default_branch
+
+
+def make_frames(num_files, seed):
+    rng = random.Random(seed)
+    modules = rng.sample(range(num_files), min(3, num_files))
+    return [{
+        "filename": f"pkg{index // 100}/module{index}.py",
+        "abs_path": f"/srv/app/pkg{index // 100}/module{index}.py",
+        "module": f"pkg{index // 100}.module{index}",
+        "function": "fetch",
+        "lineno": FETCH_LINENO,
+        "context_line": "        return self.client.get(key, default)",
+        "in_app": True
+    } for index in modules]
+
+
+def make_webhook_event(event_id, issue_id, frames):
+    return {
+        "event_id": event_id,
+        "issue_id": issue_id,
+        "platform": "python",
+        "release": RELEASE,
+        "exception": {"values": [{
+            "type": "KeyError",
+            "value": f"'{frames[-1]['module']}'",
+            "module": frames[-1]['module'],
+            "stacktrace": {"frames": frames}
+        }]},
+        "request": {"url": "https://example.com/items", "method": "GET"}
+    }
+
+
+def make_api_event(event_id, issue_id, frames):
+    # The API format carries absolute paths from the server, the notifier resolves them against the repository
+    api_frames = [{**frame, "filename": frame['abs_path']} for frame in frames]
+    return {
+        "id": event_id,
+        "groupID": issue_id,
+        "platform": "python",
+        "release": RELEASE,
+        "entries": [
+            {"type": "exception", "data": {"values": [{
+                "type": "KeyError",
+                "value": f"'{frames[-1]['module']}'",
+                "module": frames[-1]['module'],
+                "stacktrace": {"frames": api_frames}
+            }]}},
+            {"type": "request", "data": {"url": "https://example.com/items", "method": "GET"}}
+        ]
+    }
+
+
+def generate_events(path_name, count, num_files, duplicate_ratio, seed):
+    # Duplicates repeat an earlier exception under a new issue, which exercises the result store and single flight
+    rng = random.Random(seed)
+    events = []
+    for index in range(count):
+        if events and rng.random() < duplicate_ratio:
+            frame_seed = rng.randrange(index)
+        else:
+            frame_seed = index
+        frames = make_frames(num_files, seed * 100003 + frame_seed)
+        event_id = f"{path_name}-{index}"
+        issue_id = f"{path_name}-{seed}-{index}"
+        make_event = make_api_event if index % 2 else make_webhook_event
+        events.append((make_event(event_id, issue_id, frames), issue_id))
+    return events
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))]
+
+
+def stage_breakdown(before, after):
+    stages = {}
+    for label_values, (count, total) in after.items():
+        old_count, old_total = before.get(label_values, (0, 0.0))
+        if count > old_count:
+            stages[label_values[0]] = {
+                "count": count - old_count,
+                "total": total - old_total,
+                "mean": (total - old_total) / (count - old_count)
+            }
+    return stages
+
+
+def run_cli(app_module, events, args, work_dir):
+    latencies, statuses = [], []
+    start = time.perf_counter()
+    for event, issue_id in events:
+        event_start = time.perf_counter()
+        _, status_code = app_module.process_event(event, issue_id)
+        latencies.append(time.perf_counter() - event_start)
+        statuses.append(status_code)
+    return {"latencies": latencies, "statuses": statuses, "elapsed": time.perf_counter() - start}
+
+
+def run_webhook(app_module, events, args, work_dir):
+    client = app_module.get_app().test_client()
+    job_ids = []
+    start = time.perf_counter()
+    for event, issue_id in events:
+        while True:
+            response = client.post('/', json={"data": {"event": event}, "github_issue_id": issue_id})
+            if response.status_code != 429:
+                break
+            # The queue is full, back off like a notifier would
+            time.sleep(0.05)
+        job_ids.append(response.get_json()['job_id'])
+
+    job_queue = app_module.get_job_queue()
+    jobs = []
+    for job_id in job_ids:
+        while True:
+            job = job_queue.get_job(job_id)
+            if job['status'] in ('finished', 'failed'):
+                jobs.append(job)
+                break
+            time.sleep(0.01)
+    return {
+        "latencies": [job['finished_at'] - job['created_at'] for job in jobs],
+        "statuses": [job['status_code'] for job in jobs],
+        "elapsed": time.perf_counter() - start
+    }
+
+
+def run_batch_path(app_module, events, args, work_dir):
+    latencies, statuses = [], []
+
+    def timed_process(event, github_issue_id):
+        start = time.perf_counter()
+        result, status_code = app_module.process_event(event, github_issue_id)
+        latencies.append(time.perf_counter() - start)
+        statuses.append(status_code)
+        return result, status_code
+
+    with tempfile.TemporaryDirectory() as batch_dir:
+        source = os.path.join(batch_dir, 'events.jsonl')
+        with open(source, 'w') as source_file:
+            for event, issue_id in events:
+                source_file.write(json.dumps({"github_issue_id": issue_id, "event": event}) + "\n")
+        start = time.perf_counter()
+        app_module.run_batch(timed_process, source, os.path.join(batch_dir, 'results.jsonl'), concurrency=args.concurrency)
+        elapsed = time.perf_counter() - start
+    return {"latencies": latencies, "statuses": statuses, "elapsed": elapsed}
+
+
+def http_request(url, payload=None):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    http_request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(http_request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+
+def run_server_path(app_module, events, args, work_dir):
+    # Load-tests the production server: a separate process with --server-workers forked workers, driven over HTTP
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        'JOB_STORE_PATH': os.path.join(work_dir, 'jobs.db'),
+        'RESULT_STORE_PATH': os.path.join(work_dir, 'results-server.db')
+    }
+    command = [
+        sys.executable, '-m', 'benchmarks.pipeline', '--serve', str(port),
+        '--server-workers', str(args.server_workers),
+        '--llm-latency', str(args.llm_latency), '--github-latency', str(args.github_latency)
+    ]
+    output = None if args.verbose else subprocess.DEVNULL
+    started_at = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=output, stderr=output)
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                if http_request(f"{base_url}/readyz")[0] == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline or process.poll() is not None:
+                raise RuntimeError("The benchmark server did not become ready")
+            time.sleep(0.1)
+        startup = time.perf_counter() - started_at
+
+        def submit(item):
+            event, issue_id = item
+            while True:
+                status_code, body = http_request(f"{base_url}/", {"data": {"event": event}, "github_issue_id": issue_id})
+                if status_code != 429:
+                    return body['job_id']
+                time.sleep(0.05)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            job_ids = list(executor.map(submit, events))
+
+        jobs = []
+        for job_id in job_ids:
+            while True:
+                status_code, job = http_request(f"{base_url}/jobs/{job_id}")
+                if status_code == 200 and job['status'] in ('finished', 'failed'):
+                    jobs.append(job)
+                    break
+                time.sleep(0.02)
+        elapsed = time.perf_counter() - start
+    finally:
+        # Measures the graceful drain triggered by SIGTERM
+        stopped_at = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=300)
+    return {
+        "latencies": [job['finished_at'] - job['created_at'] for job in jobs],
+        "statuses": [job['status_code'] for job in jobs],
+        "elapsed": elapsed,
+        "startup": startup,
+        "shutdown": time.perf_counter() - stopped_at
+    }
+
+
+RUNNERS = {'cli': run_cli, 'webhook': run_webhook, 'batch': run_batch_path, 'server': run_server_path}
+
+
+def run_path(app_module, path_name, args, work_dir):
+    events = generate_events(path_name, args.events, args.files, args.duplicates, args.seed)
+    # Every path starts from an empty result store, so earlier paths don't turn its events into cache hits
+    app_module.get_exception_handler().result_store = ResultStore(os.path.join(work_dir, f'results-{path_name}.db'))
+    app_module.get_exception_handler().single_flight = SingleFlight()
+
+    stages_before = STAGE_SECONDS.totals()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+        measurements = RUNNERS[path_name](app_module, events, args, work_dir)
+    latencies, statuses, elapsed = measurements.pop('latencies'), measurements.pop('statuses'), measurements.pop('elapsed')
+
+    # The stages of the server path run in its worker processes and are not collected here
+    return {
+        **measurements,
+        "events": len(events),
+        "elapsed": elapsed,
+        "throughput": len(events) / elapsed,
+        "latency": {
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99)
+        },
+        "status_codes": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+        "stages": stage_breakdown(stages_before, STAGE_SECONDS.totals())
+    }
+
+
+def configure_environment(repo, args, work_dir):
+    os.environ.update({
+        'LOCAL_REPO_PATH': repo.working_tree_dir,
+        'REPO_NAME': 'benchmark/repo',
+        'LLM_MODEL': 'gemini',
+        'LLM_CACHE_MODE': 'off',
+        'RESULT_STORE_PATH': os.path.join(work_dir, 'results.db'),
+        'SYMBOL_INDEX_PATH': os.path.join(work_dir, 'symbols.db'),
+        'WORKTREE_PATH': os.path.join(work_dir, 'worktrees'),
+        'JOB_WORKER_MODE': args.worker_mode,
+        'WEBHOOK_MODE': 'queued'
+    })
+    # The configured provider is replaced by the fake service, its key is never used
+    os.environ.setdefault('GEMINI_API_KEY', 'offline-benchmark')
+
+
+def install_fakes(app_module, args):
+    handler = app_module.get_exception_handler()
+    handler.ai_service = FakeLLMService(app_module.config, args.llm_latency)
+    default_branch = Repo(os.environ['LOCAL_REPO_PATH']).active_branch.name
+    github_repo = FakeGitHubRepo('benchmark/repo', default_branch, args.github_latency)
+    handler.vcs_service.get_repo = lambda repo_name: github_repo
+
+
+def load_app(repo, args, work_dir):
+    configure_environment(repo, args, work_dir)
+    app_module = importlib.import_module('exception_handler.__main__')
+    install_fakes(app_module, args)
+    return app_module
+
+
+def serve(args):
+    # Entry point of the server process started by the server path, the environment comes from the parent
+    app_module = importlib.import_module('exception_handler.__main__')
+
+    def init_worker():
+        app_module.init_worker()
+        install_fakes(app_module, args)
+
+    app_module.server = Server(
+        app_module.get_app(), host='127.0.0.1', port=args.serve, workers=args.server_workers,
+        init_worker=init_worker, drain_worker=app_module.drain_worker
+    )
+    app_module.server.run()
+
+
+def print_results(results):
+    for path_name, result in results['paths'].items():
+        latency = result['latency']
+        print(f"{path_name}: {result['events']} events in {result['elapsed']:.2f}s, {result['throughput']:.2f} events/s, "
+              f"latency p50 {latency['p50'] * 1000:.0f}ms p95 {latency['p95'] * 1000:.0f}ms p99 {latency['p99'] * 1000:.0f}ms, "
+              f"status codes {result['status_codes']}")
+        if 'startup' in result:
+            print(f"  server ready after {result['startup']:.2f}s, drained and stopped {result['shutdown']:.2f}s after SIGTERM")
+        for stage, stats in sorted(result['stages'].items(), key=lambda item: -item[1]['total']):
+            print(f"  {stage:<18} {stats['count']:>6} calls  {stats['mean'] * 1000:>9.1f}ms mean  {stats['total']:>8.2f}s total")
+
+
+def compare(results, baseline, tolerance):
+    # A path regresses when its throughput drops or its p95 latency grows by more than the tolerance
+    regressions = []
+    for path_name, result in results['paths'].items():
+        old = baseline.get('paths', {}).get(path_name)
+        if not old:
+            continue
+        if result['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append(f"{path_name}: throughput {old['throughput']:.2f} -> {result['throughput']:.2f} events/s")
+        if result['latency']['p95'] > old['latency']['p95'] * (1 + tolerance):
+            regressions.append(
+                f"{path_name}: p95 latency {old['latency']['p95'] * 1000:.0f} -> {result['latency']['p95'] * 1000:.0f}ms"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the whole pipeline offline with a fake LLM and GitHub API")
+    parser.add_argument('--files', type=int, default=500, help="Number of files in the generated repository")
+    parser.add_argument('--events', type=int, default=50, help="Number of events sent through each path")
+    parser.add_argument('--paths', default=','.join(PATHS), help="Comma separated paths to measure: cli, webhook, batch, server")
+    parser.add_argument('--duplicates', type=float, default=0.2, help="Fraction of events repeating an earlier exception")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Simulated LLM latency in seconds")
+    parser.add_argument('--github-latency', type=float, default=0.1, help="Simulated GitHub API latency in seconds")
+    parser.add_argument('--concurrency', type=int, default=4, help="Concurrency of the batch path")
+    parser.add_argument('--worker-mode', default='thread', choices=('thread', 'async'), help="JOB_WORKER_MODE of the webhook path")
+    parser.add_argument('--seed', type=int, default=1, help="Seed of the generated events")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Compare with the results of an earlier run and fail on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative regression when comparing")
+    parser.add_argument('--server-workers', type=int, default=2, help="Worker processes of the server path")
+    parser.add_argument('--verbose', action='store_true', help="Show the output of the handler")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    path_names = [name.strip() for name in args.paths.split(',') if name.strip()]
+    unknown = [name for name in path_names if name not in RUNNERS]
+    if unknown:
+        parser.error(f"Unknown paths: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"Generating a repository with {args.files} files...")
+        repo, _ = setup_repository(work_dir, args.files)
+        app_module = load_app(repo, args, work_dir)
+
+        results = {"config": {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}, "paths": {}}
+        for path_name in path_names:
+            results['paths'][path_name] = run_path(app_module, path_name, args, work_dir)
+        app_module.get_exception_handler().vcs_service.worktree_pool.close()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from git import Repo
+from benchmarks.pipeline import FakeChatModel, FakeLLMService, setup_repository
+
+PR_NUMBER = 1
+HEAD_BRANCH = 'fix/benchmark'
+AFFECTED_FILES = ['pkg0/module0.py', 'pkg0/module1.py', 'pkg0/module2.py']
+
+
+class RecordingChatModel(FakeChatModel):
+    def __init__(self, latency):
+        super().__init__(latency)
+        self.prompt_sizes = []
+
+    def _respond(self, prompt_text):
+        self.prompt_sizes.append(len(prompt_text))
+        return super()._respond(prompt_text)
+
+
+class RecordingLLMService(FakeLLMService):
+    def _initialize_llm(self):
+        self.llm = RecordingChatModel(self.latency)
+
+
+class FakeComment:
+    html_url = f"https://github.com/benchmark/repo/pull/{PR_NUMBER}#issuecomment-1"
+
+
+class FakeIssue:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create_comment(self, body):
+        time.sleep(self.latency)
+        return FakeComment()
+
+
+class FakeRequester:
+    def __init__(self, origin, base_branch, latency):
+        self.origin = origin
+        self.base_branch = base_branch
+        self.latency = latency
+
+    def graphql_query(self, query, variables):
+        time.sleep(self.latency)
+        # GitHub moves the pull ref along with the branch, the bare origin has to be told
+        head_sha = self.origin.git.rev_parse(f'refs/heads/{HEAD_BRANCH}')
+        self.origin.git.update_ref(f'refs/pull/{PR_NUMBER}/head', head_sha)
+        body = (
+            "Fixes the KeyError raised when an item is missing from the cache.\n\n"
+            f"Affected Files:\n{', '.join(AFFECTED_FILES)}\n\n"
+            f"Analysis and Proposed Fix:\n{'The cache returns None for missing keys. ' * 40}"
+        )
+        return {}, {"data": {"repository": {"pullRequest": {
+            "title": "Fix KeyError in the cache client", "body": body,
+            "url": f"https://github.com/benchmark/repo/pull/{PR_NUMBER}",
+            "headRefName": HEAD_BRANCH, "headRefOid": head_sha, "baseRefName": self.base_branch,
+            "files": {"pageInfo": {"hasNextPage": False}, "nodes": [{"path": path} for path in AFFECTED_FILES]}
+        }}}}
+
+
+class FakeGitHub:
+    def __init__(self, requester, latency):
+        self.requester = requester
+        self.latency = latency
+
+    def get_repo(self, repo_name, lazy=False):
+        return self
+
+    def get_issue(self, number):
+        return FakeIssue(self.latency)
+
+
+def open_pull_request(repo, default_branch):
+    # The PR changes a few lines in each affected file, so the prompt has excerpts to show
+    repo.git.checkout('-b', HEAD_BRANCH)
+    for path in AFFECTED_FILES:
+        with open(os.path.join(repo.working_tree_dir, path), 'a') as module_file:
+            module_file.write('\n\ndef get_or_default(client, key, default=None):\n    return client.get(key) or default\n')
+    repo.git.commit('-am', 'Fix KeyError in the cache client', '--no-verify')
+    repo.git.push('origin', f'{HEAD_BRANCH}:refs/heads/{HEAD_BRANCH}')
+    repo.git.checkout(default_branch)
+
+
+def push_review_change(repo, round_number):
+    # A reviewer pushes a small change to one of the files between rounds
+    repo.git.checkout(HEAD_BRANCH)
+    repo.git.pull('--ff-only', 'origin', HEAD_BRANCH)
+    path = AFFECTED_FILES[round_number % len(AFFECTED_FILES)]
+    with open(os.path.join(repo.working_tree_dir, path), 'a') as module_file:
+        module_file.write(f'\nREVIEWED_{round_number} = True\n')
+    repo.git.commit('-am', f'Review change {round_number}', '--no-verify')
+    repo.git.push('origin', f'{HEAD_BRANCH}:refs/heads/{HEAD_BRANCH}')
+    repo.git.checkout('-')
+
+
+def run(args, work_dir):
+    repo, default_branch = setup_repository(work_dir, args.files)
+    open_pull_request(repo, default_branch)
+    origin = Repo(os.path.join(work_dir, 'origin.git'))
+    reviewer = Repo.clone_from(origin.git_dir, os.path.join(work_dir, 'reviewer'))
+    os.environ.update({
+        'CONVERSATION_STORE_PATH': os.path.join(work_dir, 'conversations.db'),
+        'RESULT_STORE_PATH': os.path.join(work_dir, 'results.db'),
+        'WORKTREE_PATH': os.path.join(work_dir, 'worktrees'),
+        'LLM_CACHE_MODE': 'off'
+    })
+    from exception_handler.handler import ExceptionHandler
+
+    config = {'repo': 'benchmark/repo', 'local_repo_path': repo.working_tree_dir, 'llm_model': 'gemini'}
+    handler = ExceptionHandler(config)
+    handler.vcs_service.github = FakeGitHub(FakeRequester(origin, default_branch, args.github_latency), args.github_latency)
+    handler.ai_service = RecordingLLMService(config, args.llm_latency)
+
+    rounds = []
+    try:
+        for round_number in range(1, args.rounds + 1):
+            if args.review_pushes:
+                push_review_change(reviewer, round_number)
+            start = time.perf_counter()
+            result = handler.handle_pr_comment({
+                'pr_number': PR_NUMBER, 'comment': f"Round {round_number}: please also handle the empty string key."
+            })
+            seconds = time.perf_counter() - start
+            if result.get('status') != 'success' or result['vcs_response'].get('status') != 'success':
+                raise RuntimeError(f"Round {round_number} failed: {result}")
+            rounds.append({"round": round_number, "prompt_chars": handler.ai_service.llm.prompt_sizes[-1], "seconds": seconds})
+    finally:
+        handler.close()
+    return rounds
+
+
+def print_results(rounds, llm_latency):
+    for result in rounds:
+        print(f"round {result['round']:>3}: prompt {result['prompt_chars']:>7} chars  {result['seconds'] * 1000:>8.1f}ms")
+    # The rounds after the history is full should be about as large as the last one
+    settled = rounds[len(rounds) // 2:]
+    sizes = [result['prompt_chars'] for result in settled]
+    print(f"prompt size over the last {len(settled)} rounds: {min(sizes)}-{max(sizes)} chars, "
+          f"median latency {statistics.median(result['seconds'] for result in settled) * 1000:.1f}ms "
+          f"(LLM latency {llm_latency * 1000:.0f}ms)")
+    return max(sizes) / min(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the prompt size and latency of each round of a PR review")
+    parser.add_argument('--rounds', type=int, default=20, help="Comments answered on the same PR")
+    parser.add_argument('--files', type=int, default=200, help="Files in the generated repository")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="Seconds the fake LLM takes per call")
+    parser.add_argument('--github-latency', type=float, default=0.0, help="Seconds the fake GitHub API takes per call")
+    parser.add_argument('--no-review-pushes', dest='review_pushes', action='store_false',
+                        help="Don't push a reviewer change to the branch before each round")
+    parser.add_argument('--max-growth', type=float, default=1.1,
+                        help="Fail when the prompt of the later rounds grows by more than this factor")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rounds = run(args, work_dir)
+
+    growth = print_results(rounds, args.llm_latency)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(rounds, output_file, indent=2)
+        print(f"Results written to {args.output}")
+    if growth > args.max_growth:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
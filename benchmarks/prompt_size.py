@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+from dotenv import load_dotenv
+from exception_handler.ai.base_llm_service import BaseLLMService
+from exception_handler.notifiers.sentry_notifier import SentryNotifier
+
+load_dotenv()
+
+
+class PromptOnlyService(BaseLLMService):
+    def _initialize_llm(self):
+        self.llm = None
+
+
+def read_trace_files(repo_path, stacktrace):
+    trace_files = {}
+    for frame in stacktrace:
+        file_path = frame['filename']
+        if file_path in trace_files:
+            continue
+        try:
+            with open(os.path.join(repo_path, file_path), 'r', encoding='utf-8') as file:
+                trace_files[file_path] = file.read()
+        except OSError:
+            pass
+    return trace_files
+
+
+def measure(service, prompt):
+    return {"chars": len(prompt), "estimated_tokens": service.prompt_packer.estimate_tokens(prompt)}
+
+
+def full_prompt(service, exception_data, trace_files):
+    # The prompt as built before excerpts and packing: raw frames and whole files
+    template_only = service._prepare_prompt({**exception_data, "stacktrace": []}, {}).to_string()
+    file_contents = "\n\n".join([f"File: {file_path}\n```python\n{content}\n```" for file_path, content in trace_files.items()])
+    return (template_only + json.dumps(exception_data['stacktrace'], indent=2) + file_contents
+            + str(exception_data['context']['request']))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python -m benchmarks.prompt_size <event.json> [<event.json> ...]")
+        sys.exit(1)
+
+    config = {"local_repo_path": os.getenv('LOCAL_REPO_PATH')}
+    notifier = SentryNotifier(config)
+    service = PromptOnlyService(config)
+
+    results = []
+    for event_path in sys.argv[1:]:
+        with open(event_path, 'r') as event_file:
+            exception_data = notifier.process_exception(json.load(event_file))
+        trace_files = read_trace_files(config['local_repo_path'], exception_data['stacktrace'])
+
+        before = measure(service, full_prompt(service, exception_data, trace_files))
+        after = measure(service, service._prepare_prompt(exception_data, trace_files).to_string())
+
+        results.append({"event": event_path, "files": len(trace_files), "before": before, "after": after})
+        print(f"{event_path}: {before['estimated_tokens']} -> {after['estimated_tokens']} estimated tokens "
+              f"({len(trace_files)} files)")
+
+    total_before = sum(result['before']['estimated_tokens'] for result in results)
+    total_after = sum(result['after']['estimated_tokens'] for result in results)
+    if total_before:
+        print(f"Total: {total_before} -> {total_after} estimated tokens ({100 * total_after / total_before:.1f}%)")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
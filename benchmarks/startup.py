@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LOAD_EVENT_BACKENDS = (
+    "from exception_handler.plugins import load; "
+    "load('notifier', m.config['notifier']); load('vcs', m.config['vcs_type'])"
+)
+LOAD_LLM_BACKEND = "load('llm', m.config['llm_model'])"
+
+# What each entry point imports before it can do any work. Every event needs the notifier and the VCS backend,
+# the LLM backend is only loaded once an event has to be analyzed and the provider SDK on the first LLM call
+SCENARIOS = {
+    'import': "import exception_handler.__main__ as m",
+    'cli': f"import exception_handler.__main__ as m; {LOAD_EVENT_BACKENDS}",
+    'analysis': f"import exception_handler.__main__ as m; {LOAD_EVENT_BACKENDS}; {LOAD_LLM_BACKEND}",
+    'server': f"import exception_handler.__main__ as m; {LOAD_EVENT_BACKENDS}; {LOAD_LLM_BACKEND}; "
+              "m.get_app(); import exception_handler.server"
+}
+
+PROVIDER_SDKS = ('langchain_google_genai', 'langchain_openai')
+
+# Top-level packages an entry point must not import
+FORBIDDEN = {
+    'import': ('flask', 'werkzeug', 'github', 'git', 'langchain_core') + PROVIDER_SDKS,
+    'cli': ('flask', 'werkzeug', 'langchain_core') + PROVIDER_SDKS,
+    'analysis': ('flask', 'werkzeug') + PROVIDER_SDKS,
+    'server': PROVIDER_SDKS
+}
+
+
+def run_scenario(code, env):
+    # -X importtime reports self and cumulative microseconds for every imported module on stderr
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed")
+    return elapsed, parse_importtime(process.stderr)
+
+
+def parse_importtime(output):
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|', 2)
+        # Each level of nesting is indented by two more spaces after the single separating space
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        modules.append({
+            "name": name.strip(), "depth": depth,
+            "self": int(self_us) / 1e6, "cumulative": int(cumulative_us) / 1e6
+        })
+    return modules
+
+
+def measure(name, code, env, repeat, top):
+    runs = [run_scenario(code, env) for _ in range(repeat)]
+    wall_times = [elapsed for elapsed, _ in runs]
+    modules = runs[-1][1]
+    imported = {module['name'].split('.')[0] for module in modules}
+    # Top-level imports nest everything they pull in, so their cumulative times add up to the total
+    roots = [module for module in modules if module['depth'] == 0]
+    packages = {}
+    for module in modules:
+        package = module['name'].split('.')[0]
+        packages[package] = packages.get(package, 0) + module['self']
+    return {
+        "wall": statistics.median(wall_times),
+        "import": sum(module['cumulative'] for module in roots),
+        "modules": len(modules),
+        "slowest": [
+            {"name": package, "self": seconds}
+            for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        ],
+        "forbidden": sorted(imported.intersection(FORBIDDEN[name]))
+    }
+
+
+def print_results(results):
+    for name, result in results['scenarios'].items():
+        print(f"{name}: {result['wall'] * 1000:.0f}ms wall (median), {result['import'] * 1000:.0f}ms importing "
+              f"{result['modules']} modules")
+        for package in result['slowest']:
+            print(f"  {package['name']:<30} {package['self'] * 1000:>8.1f}ms")
+        if result['forbidden']:
+            print(f"  unexpected imports: {', '.join(result['forbidden'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the command line and server entry points")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma separated scenarios: import, cli, analysis, server")
+    parser.add_argument('--repeat', type=int, default=5, help="Interpreter starts per scenario, the median is reported")
+    parser.add_argument('--top', type=int, default=10, help="Number of slowest packages shown per scenario")
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help="Fail when the median wall time of the cli scenario exceeds this many seconds")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    results = {"config": {"repeat": args.repeat, "budget": args.budget, "python": sys.version.split()[0]}, "scenarios": {}}
+    for name in names:
+        results['scenarios'][name] = measure(name, SCENARIOS[name], env, args.repeat, args.top)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {args.output}")
+
+    failures = [
+        f"{name} imported {', '.join(result['forbidden'])}"
+        for name, result in results['scenarios'].items() if result['forbidden']
+    ]
+    cli = results['scenarios'].get('cli')
+    if cli and cli['wall'] > args.budget:
+        failures.append(f"cli startup {cli['wall'] * 1000:.0f}ms is over the {args.budget * 1000:.0f}ms budget")
+    for failure in failures:
+        print(f"Failed: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
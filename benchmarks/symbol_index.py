@@ -0,0 +1,90 @@
+import argparse
+import os
+import tempfile
+import time
+from git import Repo
+from exception_handler.index.symbol_index import SymbolIndex
+
+MODULE_TEMPLATE = '''import os
+from pkg{other_package}.module{other_module} import Service{other_module}
+
+
+class Service{index}(Service{other_module}):
+    def __init__(self, client, timeout=30):
+        self.client = client
+        self.timeout = timeout
+
+    def fetch(self, key, default=None):
+        return self.client.get(key, default)
+
+    async def refresh(self, keys: list) -> dict:
+        return {{key: self.fetch(key) for key in keys}}
+
+
+def helper_{index}(value, *args, **kwargs):
+    return Service{index}(value).fetch(os.sep)
+'''
+
+
+def generate_repo(path, num_files, files_per_package=100):
+    repo = Repo.init(path)
+    for index in range(num_files):
+        package = index // files_per_package
+        package_path = os.path.join(path, f'pkg{package}')
+        os.makedirs(package_path, exist_ok=True)
+        other = (index * 7 + 3) % num_files
+        with open(os.path.join(package_path, f'module{index}.py'), 'w') as module_file:
+            module_file.write(MODULE_TEMPLATE.format(
+                index=index, other_package=other // files_per_package, other_module=other
+            ))
+    repo.git.add(A=True)
+    repo.git.commit('-m', 'Generate benchmark repository', '--no-verify')
+    return repo
+
+
+def change_files(repo, num_changes):
+    for index in range(num_changes):
+        module_path = os.path.join(repo.working_tree_dir, f'pkg0/module{index}.py')
+        with open(module_path, 'a') as module_file:
+            module_file.write(f'\n\ndef added_{index}(value):\n    return value\n')
+    repo.git.commit('-am', 'Change benchmark files', '--no-verify')
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure symbol index build, update and query times")
+    parser.add_argument('--repo', help="Existing repository to index (a synthetic one is generated if omitted)")
+    parser.add_argument('--files', type=int, default=10000, help="Number of files in the synthetic repository")
+    parser.add_argument('--changes', type=int, default=20, help="Number of files changed before the incremental update")
+    parser.add_argument('--queries', type=int, default=1000, help="Number of symbol queries to run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.repo:
+            repo = Repo(args.repo)
+        else:
+            print(f"Generating a repository with {args.files} files...")
+            repo = generate_repo(os.path.join(work_dir, 'repo'), args.files)
+
+        index = SymbolIndex(repo, os.path.join(work_dir, 'symbols.db'))
+        indexed, build_time = timed(lambda: index.update('HEAD'))
+        print(f"Full build: {indexed} files in {build_time:.2f}s")
+
+        if not args.repo:
+            change_files(repo, args.changes)
+            updated, update_time = timed(lambda: index.update('HEAD'))
+            print(f"Incremental update: {updated} files in {update_time * 1000:.1f}ms")
+
+        names = ['fetch', 'refresh', 'Service1', 'helper_42', 'missing_name']
+        trace_paths = ['pkg0/module1.py', 'pkg0/module2.py']
+        _, query_time = timed(lambda: [index.find_symbols(names, exclude_paths=trace_paths) for _ in range(args.queries)])
+        print(f"Query latency: {query_time / args.queries * 1000:.2f}ms per query")
+
+
+if __name__ == '__main__':
+    main()
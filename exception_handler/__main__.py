@@ -1,15 +1,20 @@
-from flask import Flask, request, jsonify
 from exception_handler.notifiers.notifier_factory import get_notifier
-from exception_handler.handler import ExceptionHandler
+from exception_handler.ai.ai_analysis_service import get_shared_ai_service
+from exception_handler.projects import ProjectRegistry, event_environment, load_projects
+from exception_handler.job_queue import AsyncJobQueue, CoalescingJobQueue, JobQueue, JobStore, QueueFullError
+from exception_handler.batch import run_batch
+from exception_handler.metrics import REGISTRY, span
+from exception_handler.notifiers.json_scanner import decode, find, map_file, object_spans
+import argparse
 import json
 from dotenv import load_dotenv
 import os
 import sys
+import tempfile
+import time
 
 load_dotenv()
 
-app = Flask(__name__)
-
 # Remove config file loading
 config = {
     "llm_model": os.getenv('LLM_MODEL', 'gemini'),
@@ -19,59 +24,348 @@ config = {
     "notifier": os.getenv('NOTIFIER_TYPE', 'sentry')
 }
 
-exception_handler = ExceptionHandler(config)
+# With a projects file one process serves several repositories, each event goes to the project of its Sentry project ID
+projects = None
+if os.getenv('PROJECTS_CONFIG'):
+    settings, projects = load_projects(os.getenv('PROJECTS_CONFIG'))
+    config.update(settings)
 
-def process_event(event, github_issue_id):
+# Built on first use, so a forking server creates one per worker instead of sharing git processes and HTTP sessions
+project_registry = None
+
+job_queue = None
+
+comment_queue = None
+
+# Flask is only imported when serving, the command line never needs it
+app = None
+
+server = None
+
+def get_project_registry():
+    global project_registry
+    if project_registry is None:
+        project_registry = ProjectRegistry(
+            config,
+            projects,
+            max_handlers=int(os.getenv('PROJECT_HANDLERS_MAX', 8)),
+            # The handler of a single project is kept for the life of the process
+            idle_timeout=int(os.getenv('PROJECT_HANDLER_IDLE_TIMEOUT', 900)) if projects else None
+        )
+    return project_registry
+
+def get_exception_handler():
+    # The handler of the only project when no projects file is configured
+    return get_project_registry().get_handler()
+
+def get_job_queue():
+    global job_queue
+    if job_queue is None:
+        store = JobStore(os.getenv('JOB_STORE_PATH')) if os.getenv('JOB_STORE_PATH') else None
+        if os.getenv('JOB_WORKER_MODE', 'thread').lower() == 'async':
+            job_queue = AsyncJobQueue(
+                process_event_async,
+                max_size=int(os.getenv('JOB_QUEUE_SIZE', 100)),
+                num_workers=int(os.getenv('JOB_WORKERS', 32)),
+                store=store
+            )
+        else:
+            job_queue = JobQueue(
+                process_event,
+                max_size=int(os.getenv('JOB_QUEUE_SIZE', 100)),
+                num_workers=int(os.getenv('JOB_WORKERS', 4)),
+                store=store
+            )
+    return job_queue
+
+def get_comment_queue():
+    global comment_queue
+    if comment_queue is None:
+        comment_queue = CoalescingJobQueue(
+            process_pr_comments,
+            debounce=float(os.getenv('PR_COMMENT_DEBOUNCE', 20)),
+            max_size=int(os.getenv('JOB_QUEUE_SIZE', 100)),
+            num_workers=int(os.getenv('PR_COMMENT_WORKERS', 2)),
+            store=JobStore(os.getenv('JOB_STORE_PATH')) if os.getenv('JOB_STORE_PATH') else None
+        )
+    return comment_queue
+
+def init_worker():
+    # A server worker loads everything up front, so its first event doesn't pay for the imports. The registry is
+    # built in every case, as /readyz waits for it, but with several projects their handlers are only built once
+    # they receive an event
+    registry = get_project_registry()
+    if not projects:
+        registry.get_handler()
+    get_shared_ai_service(config)
+    get_job_queue()
+
+def drain_worker(timeout):
+    deadline = time.monotonic() + timeout
+    drained = job_queue.drain(timeout) if job_queue else True
+    # Comments still in their debounce window are handled once it closes
+    if comment_queue:
+        drained = comment_queue.drain(max(0, deadline - time.monotonic())) and drained
+    return drained
+
+def is_draining():
+    return server is not None and server.draining.is_set()
+
+def parse_event(event):
+    # Returns (project, processed_data, error response)
+    registry = get_project_registry()
     try:
-        notifier = get_notifier(config)
-        processed_data = notifier.process_exception(event)
+        project = registry.find_project(event)
+        if not registry.handles_environment(project, event):
+            reason = f"Environment {event_environment(event)} is not handled for project {project}"
+            return project, None, ({"status": "skipped", "reason": reason}, 200)
+        notifier = get_notifier(registry.project_config(project))
+        with span('parse_event'):
+            return project, notifier.process_exception(event), None
     except ValueError as e:
-        return {"error": str(e)}, 400
+        return None, None, ({"error": str(e)}, 400)
     except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
-    
+        return None, None, ({"error": f"An unexpected error occurred: {str(e)}"}, 500)
+
+def process_event(event, github_issue_id):
+    project, processed_data, error = parse_event(event)
+    if error:
+        return error
+
     try:
-        result = exception_handler.handle_exception(processed_data, github_issue_id)
+        with get_project_registry().lease(project) as handler:
+            result = handler.handle_exception(processed_data, github_issue_id)
     except Exception as e:
         return {"error": f"Error handling exception: {str(e)}"}, 500
     
     return result, 200
 
+async def process_event_async(event, github_issue_id):
+    project, processed_data, error = parse_event(event)
+    if error:
+        return error
+
+    try:
+        with get_project_registry().lease(project) as handler:
+            result = await handler.handle_exception_async(processed_data, github_issue_id)
+    except Exception as e:
+        return {"error": f"Error handling exception: {str(e)}"}, 500
+
+    return result, 200
+
 def process_pr_comment(payload):
+    return process_pr_comments([payload])
+
+def process_pr_comments(payloads):
+    # Comments on the same PR, with several projects the payloads name the repository of the pull request
+    try:
+        project = get_project_registry().find_project_by_repo(payloads[0].get('repo'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
     try:
-        result = exception_handler.handle_pr_comment(payload)
+        with get_project_registry().lease(project) as handler:
+            result = handler.handle_pr_comments(payloads)
     except Exception as e:
         return {"error": f"Error handling PR comment: {str(e)}"}, 500
     
     return result, 200
 
-def extract_event(payload):
-    event = payload.get('data', {}).get('event', {})
-    return event
+def process_push(payload):
+    # A push to a branch the handler of the repository keeps in sync starts its next fetch right away
+    registry = get_project_registry()
+    try:
+        project = registry.find_project_by_repo((payload.get('repository') or {}).get('full_name'))
+    except ValueError as e:
+        return {"status": "ignored", "reason": str(e)}, 200
+
+    ref = payload.get('ref') or ''
+    handler = registry.built_handler(project)
+    if not ref.startswith('refs/heads/') or handler is None or not handler.vcs_service.notify_push(ref[len('refs/heads/'):]):
+        return {"status": "ignored", "reason": f"{ref} is not kept in sync"}, 200
+    return {"status": "syncing"}, 202
+
+def load_webhook_payload(body):
+    # Returns (event, github_issue_id)
+    notifier = get_notifier(config)
+    if not notifier.streams(len(body)):
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError("The payload is not a JSON object")
+        data = payload.get('data')
+        return data.get('event') if isinstance(data, dict) else None, payload.get('github_issue_id')
+
+    # A large payload is scanned for the event instead, and besides the issue ID only the fields of the event the
+    # notifier needs are decoded
+    spans = object_spans(body)
+    event_span = find(body, 'event', pos=spans['data'][0]) if 'data' in spans else None
+    event = notifier.load_event(body, event_span) if event_span else None
+    return event, decode(body, spans.get('github_issue_id'))
+
+def get_app():
+    global app
+    if app is None:
+        app = create_app()
+    return app
+
+def create_app():
+    from flask import Flask, Response, request, jsonify
+
+    flask_app = Flask(__name__)
+
+    @flask_app.route('/', methods=['POST'])
+    def webhook():
+        if is_draining():
+            return jsonify({"error": "Server is shutting down, try again later"}), 503
+        try:
+            event, github_issue_id = load_webhook_payload(request.get_data(cache=False))
+        except ValueError:
+            return jsonify({"error": "Invalid JSON payload"}), 400
+        if not event:
+            return jsonify({"error": "No event found in payload"}), 400
+        github_issue_id = github_issue_id or event.get('issue_id')
+
+        if os.getenv('WEBHOOK_MODE', 'queued').lower() == 'sync':
+            result, status_code = process_event(event, github_issue_id)
+            return jsonify(result), status_code
+
+        try:
+            job_id = get_job_queue().submit(event, github_issue_id)
+        except QueueFullError as e:
+            return jsonify({"error": str(e)}), 429
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+
+    @flask_app.route('/pr_comments', methods=['POST'])
+    def pr_comment():
+        if is_draining():
+            return jsonify({"error": "Server is shutting down, try again later"}), 503
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not payload.get('pr_number') or not payload.get('comment'):
+            return jsonify({"error": "Expected a JSON payload with pr_number and comment"}), 400
+
+        if os.getenv('WEBHOOK_MODE', 'queued').lower() == 'sync':
+            result, status_code = process_pr_comment(payload)
+            return jsonify(result), status_code
 
-@app.route('/', methods=['POST'])
-def webhook():
-    payload = request.json
-    event = extract_event(payload)
-    result, status_code = process_event(event)
-    return jsonify(result), status_code
+        # Comments on the same PR are collected for PR_COMMENT_DEBOUNCE seconds and answered with one fix
+        try:
+            job_id = get_comment_queue().submit((payload.get('repo'), payload['pr_number']), payload)
+        except QueueFullError as e:
+            return jsonify({"error": str(e)}), 429
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+
+    @flask_app.route('/github', methods=['POST'])
+    def github_webhook():
+        # GitHub push events, other events such as the ping sent when the webhook is added are acknowledged
+        if request.headers.get('X-GitHub-Event') != 'push':
+            return jsonify({"status": "ignored"}), 200
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"error": "Invalid JSON payload"}), 400
+        result, status_code = process_push(payload)
+        return jsonify(result), status_code
+
+    @flask_app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        job = get_job_queue().get_job(job_id) or (comment_queue.get_job(job_id) if comment_queue else None)
+        if not job:
+            return jsonify({"error": f"Job not found: {job_id}"}), 404
+        return jsonify(job), 200
+
+    @flask_app.route('/healthz', methods=['GET'])
+    def healthz():
+        return jsonify({"status": "ok"}), 200
+
+    @flask_app.route('/readyz', methods=['GET'])
+    def readyz():
+        if is_draining():
+            return jsonify({"status": "draining"}), 503
+        # The worker is ready once init_worker has built the project registry
+        if project_registry is None:
+            return jsonify({"status": "starting"}), 503
+        return jsonify({"status": "ready"}), 200
+
+    @flask_app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    return flask_app
+
+def run_batch_command(args):
+    parser = argparse.ArgumentParser(prog='python -m exception_handler batch',
+                                     description="Process many Sentry events with one handler")
+    parser.add_argument('source', help="Directory of JSON event files, a JSONL file, or '-' for JSONL on stdin")
+    parser.add_argument('--output', default='results.jsonl', help="JSONL file the results are appended to")
+    parser.add_argument('--checkpoint', help="File recording finished events, so an interrupted run can resume")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('BATCH_CONCURRENCY', 4)),
+                        help="Number of events processed at the same time")
+    options = parser.parse_args(args)
+
+    try:
+        counts = run_batch(process_event, options.source, options.output,
+                           checkpoint_path=options.checkpoint, concurrency=options.concurrency)
+    except OSError as e:
+        # The source or the output can't be opened, or reading the source failed part way
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+    print(json.dumps(counts, indent=2))
+    sys.exit(0 if counts['failed'] == 0 else 1)
+
+def run_server():
+    global server
+    port = int(os.getenv('EXCEPTION_HANDLER_PORT', 5001))
+    host = os.getenv('EXCEPTION_HANDLER_HOST', '0.0.0.0')
+    if os.getenv('SERVER_MODE', 'production').lower() == 'development':
+        # Flask's single process server with the debugger and reloader
+        get_app().run(debug=True, host=host, port=port)
+        return
+
+    workers = int(os.getenv('SERVER_WORKERS', 1))
+    job_store_path = None
+    if workers > 1 and not os.getenv('JOB_STORE_PATH'):
+        # A job is queued by the worker that received its webhook, the shared store lets any worker report it
+        job_store_path = os.path.join(tempfile.gettempdir(), f"exception-handler-jobs-{os.getpid()}.db")
+        os.environ['JOB_STORE_PATH'] = job_store_path
+
+    from exception_handler.server import Server
+
+    server = Server(
+        get_app(),
+        host=host,
+        port=port,
+        workers=workers,
+        request_timeout=int(os.getenv('SERVER_REQUEST_TIMEOUT', 30)),
+        drain_timeout=int(os.getenv('SERVER_DRAIN_TIMEOUT', 120)),
+        init_worker=init_worker,
+        drain_worker=drain_worker
+    )
+    try:
+        server.run()
+    finally:
+        if job_store_path and os.path.exists(job_store_path):
+            os.remove(job_store_path)
 
 def main():
-    if len(sys.argv) > 2:
-        # Command-line execution for PR comment
-        action_type = sys.argv[1]
-        json_file_path = sys.argv[2]
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        run_batch_command(sys.argv[2:])
+    elif len(sys.argv) > 1:
+        # Command-line execution: a single JSON file is an event, `pr_comment <file>` is a PR comment
+        action_type = sys.argv[1] if len(sys.argv) > 2 else 'event'
+        json_file_path = sys.argv[2] if len(sys.argv) > 2 else sys.argv[1]
         try:
-            with open(json_file_path, 'r') as json_file:
-                payload = json.load(json_file)
             if action_type == 'pr_comment':
+                with open(json_file_path, 'r') as json_file:
+                    payload = json.load(json_file)
                 result, status_code = process_pr_comment(payload)
             else:
+                # The event file is memory-mapped and only the fields the handler needs are decoded
+                with open(json_file_path, 'rb') as json_file, map_file(json_file) as data:
+                    event = get_notifier(config).load_event(data)
                 github_issue_id = os.environ.get('GITHUB_ISSUE_NUMBER')
                 if not github_issue_id:
                     print("Error: GITHUB_ISSUE_NUMBER environment variable not set")
                     sys.exit(1)
-                result, status_code = process_event(payload, github_issue_id)
+                result, status_code = process_event(event, github_issue_id)
             print(json.dumps(result, indent=2))
             sys.exit(0 if status_code == 200 else 1)
         except FileNotFoundError:
@@ -81,9 +375,7 @@ def main():
             print(f"Error: Invalid JSON in file - {json_file_path}")
             sys.exit(1)
     else:
-        # Start Flask server
-        port = int(os.getenv('EXCEPTION_HANDLER_PORT', 5001))
-        app.run(debug=True, host='0.0.0.0', port=port)
+        run_server()
 
 if __name__ == '__main__':
     main()
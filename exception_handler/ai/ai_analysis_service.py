@@ -1,32 +1,36 @@
-import json
-from abc import ABC, abstractmethod
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
+import threading
+from abc import abstractmethod
 from dotenv import load_dotenv
+from exception_handler.plugins import load
 
 load_dotenv()
 
+_shared_services = {}
+_shared_services_lock = threading.Lock()
+
 class AIAnalysisService:
     def __init__(self, config):
         self.config = config
 
     @abstractmethod
-    def analyze_exception(self, exception_data, trace_files):
+    def analyze_exception(self, exception_data, trace_files, related_symbols=None):
         pass
 
 def get_ai_service(config):
-    from exception_handler.ai.gemini_analysis_service import GeminiAnalysisService
-    from exception_handler.ai.openai_analysis_service import OpenAIAnalysisService
-
     llm_model = config.get('llm_model', 'gemini').lower()
-    if llm_model == 'gemini':
-        return GeminiAnalysisService(config)
-    elif llm_model == 'openai':
-        return OpenAIAnalysisService(config)
-    else:
+    service_class = load('llm', llm_model)
+    if service_class is None:
         raise ValueError(f"Unsupported LLM model: {llm_model}")
+    return service_class(config)
+
+def get_shared_ai_service(config):
+    # One service per model, so the handlers of all projects share its LLM client and response cache
+    llm_model = config.get('llm_model', 'gemini').lower()
+    with _shared_services_lock:
+        if llm_model not in _shared_services:
+            _shared_services[llm_model] = get_ai_service(config)
+        return _shared_services[llm_model]
 
-def analyze_exception(config, exception_data, trace_files):
+def analyze_exception(config, exception_data, trace_files, related_symbols=None):
     ai_service = get_ai_service(config)
-    return ai_service.analyze_exception(exception_data, trace_files)
+    return ai_service.analyze_exception(exception_data, trace_files, related_symbols)
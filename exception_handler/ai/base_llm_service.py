@@ -1,8 +1,14 @@
-import json
+import asyncio
+import os
+import threading
 from abc import abstractmethod
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
+from exception_handler.ai.context_extractor import ContextExtractor
+from exception_handler.ai.prompt_packer import PromptPacker, truncate
+from exception_handler.cache.response_cache import CACHE_MODES, LLMCacheMissError, ResponseCache
+from exception_handler.metrics import record_llm_tokens, span, timed
 
 
 class AnalysisResult(BaseModel):
@@ -10,20 +16,115 @@ class AnalysisResult(BaseModel):
     analysis: str = Field(..., description="Explanation of the issue and the updated fix")
 
 class BaseLLMService:
+    # Rough characters per token of the model's tokenizer, used to keep prompts within budget
+    chars_per_token = 4.0
+    model_name = None
+    temperature = 0
+
     def __init__(self, config):
         self.config = config
         self.parser = PydanticOutputParser(pydantic_object=AnalysisResult)
-        self._initialize_llm()
+        self.cache_mode = os.getenv('LLM_CACHE_MODE', 'off').lower()
+        if self.cache_mode not in CACHE_MODES:
+            raise ValueError(f"Unsupported LLM cache mode: {self.cache_mode}")
+        self.response_cache = None
+        if self.cache_mode != 'off':
+            self.response_cache = ResponseCache(
+                os.getenv('LLM_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'exception-handler', 'llm-responses')),
+                max_bytes=int(os.getenv('LLM_CACHE_MAX_BYTES', 100 * 1024 * 1024))
+            )
+        self.context_extractor = ContextExtractor(
+            max_full_file_lines=int(os.getenv('CONTEXT_FULL_FILE_MAX_LINES', 200)),
+            context_lines=int(os.getenv('CONTEXT_LINES', 20)),
+            max_function_lines=int(os.getenv('CONTEXT_MAX_FUNCTION_LINES', 300))
+        )
+        self.prompt_packer = PromptPacker(
+            self.context_extractor,
+            token_budget=int(os.getenv('PROMPT_TOKEN_BUDGET', 30000)),
+            chars_per_token=self.chars_per_token
+        )
+        self.history_rounds = int(os.getenv('CONVERSATION_HISTORY_ROUNDS', 3))
+        # The provider SDKs are slow to import, so the client is only created by the first call that needs it.
+        # Skipped, cached and replayed events never do, which also lets replay run offline without API keys
+        self.llm = None
+        self.llm_lock = threading.Lock()
 
     @abstractmethod
     def _initialize_llm(self):
         raise NotImplementedError("Subclasses must implement _initialize_llm method")
 
+    def _get_llm(self):
+        with self.llm_lock:
+            if self.llm is None:
+                self._initialize_llm()
+        return self.llm
+
     def _generate_fix(self, prompt):
         raise NotImplementedError("Subclasses must implement _generate_fix method")
 
-    def analyze_exception(self, exception_data, trace_files):
-        prompt = self._prepare_prompt(exception_data, trace_files)
+    async def _generate_fix_async(self, prompt):
+        # Services without native async support run their blocking call in a thread
+        return await asyncio.to_thread(self._generate_fix, prompt)
+
+    def _invoke_llm(self, prompt_text):
+        # Returns the response and the key to cache it under once it parses, None for a response read from the cache
+        key, content = self._lookup_cached_response(prompt_text)
+        if content is not None:
+            return content, None
+        with span('llm_call'):
+            message = self._get_llm().invoke(prompt_text)
+        self._record_usage(prompt_text, message)
+        return message.content, key
+
+    async def _ainvoke_llm(self, prompt_text):
+        key, content = self._lookup_cached_response(prompt_text)
+        if content is not None:
+            return content, None
+        with span('llm_call'):
+            message = await self._get_llm().ainvoke(prompt_text)
+        self._record_usage(prompt_text, message)
+        return message.content, key
+
+    def _parse_response(self, content, key):
+        # A malformed response raises before it is cached, so the next attempt asks the LLM again instead of
+        # replaying it
+        result = self.parser.parse(content)
+        self._store_cached_response(key, content)
+        return result
+
+    def _record_usage(self, prompt_text, message):
+        # Providers that don't report usage are counted with the same estimate used to pack the prompt
+        usage = getattr(message, 'usage_metadata', None) or {}
+        record_llm_tokens(
+            self.model_name,
+            usage.get('input_tokens') or self.prompt_packer.estimate_tokens(prompt_text),
+            usage.get('output_tokens') or self.prompt_packer.estimate_tokens(message.content)
+        )
+
+    def _lookup_cached_response(self, prompt_text):
+        if not self.response_cache:
+            return None, None
+
+        key = ResponseCache.make_key(self.model_name, self.temperature, prompt_text)
+        if self.cache_mode in ('cache', 'replay'):
+            entry = self.response_cache.get(key)
+            if entry is not None:
+                return key, entry['content']
+            if self.cache_mode == 'replay':
+                raise LLMCacheMissError(f"No recorded response for prompt {key} of model {self.model_name}")
+        return key, None
+
+    def _store_cached_response(self, key, content):
+        if not self.response_cache or key is None:
+            return
+        self.response_cache.set(key, {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "content": content
+        })
+
+    def analyze_exception(self, exception_data, trace_files, related_symbols=None):
+        prompt = self._prepare_prompt(exception_data, trace_files, related_symbols)
         proposed_fix = self._generate_fix(prompt)
 
         return {
@@ -32,18 +133,35 @@ class BaseLLMService:
             "affected_files": list(trace_files.keys())
         }
 
-    def _prepare_prompt(self, exception_data, trace_files):
+    async def analyze_exception_async(self, exception_data, trace_files, related_symbols=None):
+        prompt = await asyncio.to_thread(self._prepare_prompt, exception_data, trace_files, related_symbols)
+        proposed_fix = await self._generate_fix_async(prompt)
+
+        return {
+            "analysis": proposed_fix.model_dump(),
+            "original_exception": exception_data,
+            "affected_files": list(trace_files.keys())
+        }
+
+    @timed('build_prompt')
+    def _prepare_prompt(self, exception_data, trace_files, related_symbols=None):
         template = """You are an AI assistant which is a developer working on fixing a bug in a codebase. Analyze this exception and suggest a fix. Here's the context:
 
         Exception Data type: {exception_type}, value: {exception_value}, module: {exception_module}
         Request context: {request_context}
-        Stacktrace:
+        Stacktrace (file:line in function: code, innermost frame last):
         {stacktrace}
 
         Content of the files involved in the exception trace:
 
         {file_contents}
 
+        Large files are shown as excerpts. Each excerpt is preceded by the range of line numbers it covers in the real file, use these line numbers in the hunk headers of your diff.
+
+        Signatures of other functions and classes called from the code above:
+
+        {related_symbols}
+
         Provide a detailed explanation of the issue, including how it propagates through the different files. 
         Then, suggest a comprehensive fix that addresses the root cause of the problem. 
         Make sure your fix is consistent with the existing code style and structure across all affected files. 
@@ -92,21 +210,31 @@ class BaseLLMService:
             ("human", "{query}")
         ])
 
-        file_contents = "\n\n".join([f"File: {file_path}\n```python\n{content}\n```" for file_path, content in trace_files.items()])
+        packed = self.prompt_packer.pack(exception_data, trace_files, self._format_related_symbols(related_symbols))
 
         return prompt.format_prompt(
             exception_type=exception_data['exception']['type'],
             exception_value=exception_data['exception']['value'],
             exception_module=exception_data['exception']['module'],
-            request_context=exception_data['context']['request'],
-            stacktrace=json.dumps(exception_data['stacktrace'], indent=2),
-            file_contents=file_contents,
+            request_context=packed['request_context'],
+            stacktrace=packed['stacktrace'],
+            file_contents=packed['file_contents'],
+            related_symbols=packed['related_symbols'] or "None",
             format_instructions=self.parser.get_format_instructions(),
             query="Analyze the exception and provide a fix."
         )
 
-    def process_comment(self, comment, pr_details, file_contents, original_analysis):
-        prompt = self._prepare_comment_prompt(comment, pr_details, file_contents, original_analysis)
+    def _format_related_symbols(self, related_symbols):
+        if not related_symbols:
+            return ""
+        stubs = "\n\n".join([
+            f"# {symbol['path']}:{symbol['lineno']} {symbol['qualname']}\n{symbol['stub']}"
+            for symbol in related_symbols
+        ])
+        return f"```python\n{stubs}\n```"
+
+    def process_comment(self, comment, pr_details, file_contents, conversation, changed_hunks="", changed_lines=None):
+        prompt = self._prepare_comment_prompt(comment, pr_details, file_contents, conversation, changed_hunks, changed_lines)
         updated_fix = self._generate_fix(prompt)
 
         return {
@@ -114,33 +242,42 @@ class BaseLLMService:
             "pr_details": pr_details
         }
 
-    def _prepare_comment_prompt(self, comment, pr_details, file_contents, original_analysis):
+    @timed('build_prompt')
+    def _prepare_comment_prompt(self, comment, pr_details, file_contents, conversation, changed_hunks="", changed_lines=None):
         template = """You are an AI assistant helping to update a pull request based on a user's comment. Here's the context:
 
-        Original PR Title: {pr_title}
-        Original PR Description: {pr_description}
+        Pull Request: {pr_title}
+        {pr_summary}
         Files changed: {files_changed}
 
         Original Analysis and Proposed Fix:
         {original_analysis}
 
+        Earlier review rounds, oldest first:
+        {history}
+
+        Changes pushed to the branch since the last round:
+        {changed_hunks}
+
         User's comment: {comment}
 
-        Content of the affected files and their stacktraces:
+        Current content of the affected files on the pull request branch:
 
         {file_contents}
 
-        Based on the user's comment, the original analysis, and the provided file contents and stacktraces, suggest updates to the pull request. 
+        Large files are shown as excerpts around the lines the pull request changed. Each excerpt is preceded by the range of line numbers it covers in the real file, use these line numbers in the hunk headers of your diff. Your diff is applied on top of the current branch, so do not repeat changes that are already in the files.
+
+        Based on the user's comment, the earlier rounds, the original analysis, and the provided file contents, suggest updates to the pull request. 
         Consider the following:
         1. The original fix might have missed some aspects or introduced new issues.
         2. The user's comment might point out problems or suggest improvements.
         3. You may need to modify multiple files to address the comment comprehensively.
-        4. Use the stacktrace information to understand the flow of execution and potential problem areas.
+        4. Earlier rounds show what was already asked for and changed, don't undo those changes unless the comment asks for it.
 
         Provide a detailed explanation of the changes, including:
         1. Why the changes are necessary
         2. How they address the user's comment
-        3. How the changes relate to the stacktrace information
+        3. How the changes relate to the original exception
         4. Any potential side effects or considerations
 
         Then, provide an updated diff that incorporates these changes.
@@ -153,19 +290,39 @@ class BaseLLMService:
             ("human", "{query}")
         ])
 
-        file_contents = "\n\n".join([
-            f"File: {file_path}\n"
-            f"Content:\n```python\n{content}\n```"
-            for file_path, content in file_contents.items()
-        ])
+        packed = self.prompt_packer.pack_comment(
+            comment, changed_hunks, file_contents, changed_lines or {},
+            self._format_history(conversation), conversation['original_analysis']
+        )
 
         return prompt.format_prompt(
             pr_title=pr_details['title'],
-            pr_description=pr_details['body'],
+            pr_summary=conversation['pr_summary'],
             files_changed=", ".join(pr_details['files_changed']),
-            original_analysis=original_analysis,
-            comment=comment,
-            file_contents=file_contents,
+            original_analysis=packed['original_analysis'] or "None",
+            history=packed['history'],
+            changed_hunks=f"```diff\n{packed['changed_hunks']}\n```" if packed['changed_hunks'] else "None",
+            comment=packed['comment'],
+            file_contents=packed['file_contents'],
             format_instructions=self.parser.get_format_instructions(),
             query="Process the comment and suggest updates to the pull request."
         )
+
+    def _format_history(self, conversation):
+        # Only the latest rounds are shown in full, older ones by the files they touched, so the prompt stays the
+        # same size however long the review goes on
+        turns = conversation['turns'][-self.history_rounds:] if self.history_rounds > 0 else []
+        hidden_turns = conversation['turns'][:len(conversation['turns']) - len(turns)]
+        omitted = conversation['earlier_turns'] + len(hidden_turns)
+        rounds = []
+        if omitted:
+            files = set(conversation['earlier_files']).union(*(turn['files'] for turn in hidden_turns))
+            rounds.append(f"Rounds 1-{omitted} changed: {', '.join(sorted(files)) or 'no files'}")
+        for number, turn in enumerate(turns, omitted + 1):
+            status = "applied" if turn['applied'] else "could not be applied"
+            rounds.append(
+                f"Round {number} comment: {truncate(turn['comment'], 1000)}\n"
+                f"Answer: {truncate(turn['analysis'], 1500)}\n"
+                f"Diff to {', '.join(turn['files']) or 'no files'}: {status}"
+            )
+        return "\n\n".join(rounds) or "None, this is the first round"
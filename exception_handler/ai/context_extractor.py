@@ -0,0 +1,130 @@
+import ast
+import re
+
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+
+class ContextExtractor:
+    def __init__(self, max_full_file_lines=200, context_lines=20, max_function_lines=300):
+        self.max_full_file_lines = max_full_file_lines
+        self.context_lines = context_lines
+        self.max_function_lines = max_function_lines
+
+    def render(self, file_path, content, frames):
+        lines = content.splitlines()
+        windows = self.extract_windows(content, frames)
+        if windows == [(1, len(lines))]:
+            return f"File: {file_path}\n```python\n{content}\n```"
+
+        # Each excerpt is labelled with its real line numbers so hunk headers in the diff match the file
+        excerpts = "\n".join([
+            f"Lines {start}-{end}:\n```python\n" + "\n".join(lines[start - 1:end]) + "\n```"
+            for start, end in windows
+        ])
+        return f"File: {file_path} (excerpts of {len(lines)} lines)\n{excerpts}"
+
+    def extract_windows(self, content, frames):
+        lines = content.splitlines()
+        total_lines = len(lines)
+        if total_lines <= self.max_full_file_lines:
+            return [(1, total_lines)]
+
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            tree = None
+
+        windows = []
+        for frame in frames:
+            windows.extend(self._frame_windows(tree, frame, total_lines))
+        if not windows:
+            return [(1, total_lines)]
+
+        if tree is not None:
+            windows.extend(self._import_windows(tree, lines, windows))
+        return merge_windows(windows)
+
+    def _frame_windows(self, tree, frame, total_lines):
+        lineno = frame.get('lineno')
+        if tree is None:
+            return [self._line_window(lineno, 1, total_lines)] if lineno else []
+
+        if lineno:
+            chain = self._enclosing_scopes(tree, lineno)
+        else:
+            chain = self._scopes_by_name(tree, frame.get('function'))
+            if not chain:
+                return []
+
+        windows = [self._header_window(node) for node in chain if isinstance(node, ast.ClassDef)]
+        functions = [node for node in chain if isinstance(node, FUNCTION_NODES)]
+        if functions:
+            function = functions[-1]
+            start, end = node_start(function), function.end_lineno
+            if end - start + 1 <= self.max_function_lines or not lineno:
+                windows.append((start, end))
+            else:
+                windows.append(self._header_window(function))
+                windows.append(self._line_window(lineno, start, end))
+        elif chain:
+            windows.append(self._line_window(lineno, node_start(chain[-1]), chain[-1].end_lineno))
+        else:
+            windows.append(self._line_window(lineno, 1, total_lines))
+        return windows
+
+    def _enclosing_scopes(self, tree, lineno):
+        chain = []
+        parent = tree
+        while True:
+            for node in ast.iter_child_nodes(parent):
+                if hasattr(node, 'end_lineno') and node_start(node) <= lineno <= node.end_lineno:
+                    if isinstance(node, SCOPE_NODES):
+                        chain.append(node)
+                    parent = node
+                    break
+            else:
+                return chain
+
+    def _scopes_by_name(self, tree, function_name):
+        if not function_name:
+            return []
+        name = function_name.split('.')[-1]
+        for node in ast.walk(tree):
+            if isinstance(node, FUNCTION_NODES) and node.name == name:
+                return self._enclosing_scopes(tree, node.lineno)
+        return []
+
+    def _header_window(self, node):
+        body_start = node.body[0].lineno if node.body else node.lineno
+        return (node_start(node), max(node.lineno, body_start - 1))
+
+    def _line_window(self, lineno, lower, upper):
+        return (max(lower, lineno - self.context_lines), min(upper, lineno + self.context_lines))
+
+    def _import_windows(self, tree, lines, windows):
+        window_text = "\n".join("\n".join(lines[start - 1:end]) for start, end in windows)
+        identifiers = set(re.findall(r'\b\w+\b', window_text))
+        import_windows = []
+        for node in tree.body:
+            if not isinstance(node, (ast.Import, ast.ImportFrom)):
+                continue
+            names = [(alias.asname or alias.name).split('.')[0] for alias in node.names]
+            if any(name in identifiers or name == '*' for name in names):
+                import_windows.append((node.lineno, node.end_lineno))
+        return import_windows
+
+
+def node_start(node):
+    decorators = getattr(node, 'decorator_list', [])
+    return min([node.lineno] + [decorator.lineno for decorator in decorators])
+
+
+def merge_windows(windows):
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -1,15 +1,20 @@
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
 from exception_handler.ai.base_llm_service import BaseLLMService
 
 class GeminiAnalysisService(BaseLLMService):
+    model_name = "gemini-1.5-pro-exp-0827"
+
     def _initialize_llm(self):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
         self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-pro-exp-0827",
+            model=self.model_name,
             google_api_key=os.getenv('GEMINI_API_KEY'),
-            temperature=0
+            temperature=self.temperature
         )
 
     def _generate_fix(self, prompt):
-        response = self.llm.invoke(prompt.to_string())
-        return self.parser.parse(response.content)
\ No newline at end of file
+        return self._parse_response(*self._invoke_llm(prompt.to_string()))
+
+    async def _generate_fix_async(self, prompt):
+        return self._parse_response(*await self._ainvoke_llm(prompt.to_string()))
\ No newline at end of file
@@ -1,15 +1,21 @@
 import os
-from langchain_openai import ChatOpenAI
 from exception_handler.ai.base_llm_service import BaseLLMService
 
 class OpenAIAnalysisService(BaseLLMService):
+    chars_per_token = 3.5
+    model_name = "gpt-4"
+
     def _initialize_llm(self):
+        from langchain_openai import ChatOpenAI
+
         self.llm = ChatOpenAI(
-            model_name="gpt-4",
+            model_name=self.model_name,
             openai_api_key=os.getenv('OPENAI_API_KEY'),
-            temperature=0
+            temperature=self.temperature
         )
 
     def _generate_fix(self, prompt):
-        response = self.llm.invoke(prompt.to_string())
-        return self.parser.parse(response.content)
\ No newline at end of file
+        return self._parse_response(*self._invoke_llm(prompt.to_string()))
+
+    async def _generate_fix_async(self, prompt):
+        return self._parse_response(*await self._ainvoke_llm(prompt.to_string()))
\ No newline at end of file
@@ -0,0 +1,132 @@
+import json
+import math
+
+FRAME_FIELDS = ('filename', 'function', 'lineno', 'context_line')
+REQUEST_FIELDS = ('method', 'url', 'query_string', 'data')
+TRUNCATION_MARKER = "... (truncated)"
+
+
+def compact_frame(frame):
+    location = f"{frame.get('filename')}:{frame.get('lineno')} in {frame.get('function')}"
+    context_line = (frame.get('context_line') or '').strip()
+    return f"{location}: {context_line}" if context_line else location
+
+
+def truncate(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars] + TRUNCATION_MARKER
+
+
+def compact_request(request_context):
+    if not isinstance(request_context, dict):
+        return json.dumps(request_context, separators=(',', ':'), default=str)
+    compact = {field: request_context[field] for field in REQUEST_FIELDS if request_context.get(field)}
+    return json.dumps(compact, separators=(',', ':'), default=str)
+
+
+class PromptPacker:
+    def __init__(self, context_extractor, token_budget=30000, chars_per_token=4.0, head_frames=5):
+        self.context_extractor = context_extractor
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.head_frames = head_frames
+
+    def estimate_tokens(self, text):
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def pack(self, exception_data, trace_files, related_symbols_text=""):
+        stacktrace = exception_data['stacktrace']
+        remaining = self.token_budget
+
+        # Sentry orders frames outermost first, so the innermost frames are at the end
+        innermost_first = list(reversed(stacktrace))
+        frame_lines = [compact_frame(frame) for frame in innermost_first]
+        included_frames = 0
+
+        def take_frames(count):
+            nonlocal remaining, included_frames
+            while included_frames < min(count, len(frame_lines)):
+                cost = self.estimate_tokens(frame_lines[included_frames]) + 1
+                if cost > remaining:
+                    break
+                remaining -= cost
+                included_frames += 1
+
+        take_frames(self.head_frames)
+
+        frames_by_file = {}
+        for frame in stacktrace:
+            frames_by_file.setdefault(frame.get('filename'), []).append(frame)
+        file_order = []
+        for frame in innermost_first:
+            file_path = frame.get('filename')
+            if file_path in trace_files and file_path not in file_order:
+                file_order.append(file_path)
+        file_order += [file_path for file_path in trace_files if file_path not in file_order]
+
+        # The file that raised the exception goes first, then files further up the stack
+        rendered_files = []
+        for file_path in file_order:
+            rendered = self.context_extractor.render(file_path, trace_files[file_path], frames_by_file.get(file_path, []))
+            rendered, remaining = self._fit(rendered, remaining)
+            if rendered:
+                rendered_files.append(rendered)
+
+        take_frames(len(frame_lines))
+
+        request_context, remaining = self._fit(compact_request(exception_data['context']['request']), remaining)
+        related_symbols, remaining = self._fit(related_symbols_text, remaining)
+
+        stacktrace_lines = list(reversed(frame_lines[:included_frames]))
+        omitted_frames = len(frame_lines) - included_frames
+        if omitted_frames:
+            stacktrace_lines.insert(0, f"... {omitted_frames} outer frames omitted")
+
+        return {
+            "stacktrace": "\n".join(stacktrace_lines),
+            "file_contents": "\n\n".join(rendered_files),
+            "request_context": request_context or "{}",
+            "related_symbols": related_symbols
+        }
+
+    def pack_comment(self, comment, changed_hunks, trace_files, changed_lines, history, original_analysis):
+        # The new comment goes first, then the changes since the last round, the code around the lines the PR
+        # changed, the earlier rounds and the original analysis. Whatever doesn't fit is truncated or left out
+        remaining = self.token_budget
+        comment, remaining = self._fit(comment, remaining)
+        changed_hunks, remaining = self._fit(changed_hunks, remaining)
+
+        rendered_files = []
+        for file_path, content in trace_files.items():
+            frames = [{'lineno': lineno} for lineno in changed_lines.get(file_path, [])]
+            rendered, remaining = self._fit(self.context_extractor.render(file_path, content, frames), remaining)
+            if rendered:
+                rendered_files.append(rendered)
+
+        history, remaining = self._fit(history, remaining)
+        original_analysis, remaining = self._fit(original_analysis, remaining)
+        return {
+            "comment": comment,
+            "changed_hunks": changed_hunks,
+            "file_contents": "\n\n".join(rendered_files),
+            "history": history,
+            "original_analysis": original_analysis
+        }
+
+    def _fit(self, text, remaining):
+        if not text:
+            return "", remaining
+        cost = self.estimate_tokens(text)
+        if cost <= remaining:
+            return text, remaining - cost
+
+        max_chars = int((remaining - self.estimate_tokens(TRUNCATION_MARKER) - 2) * self.chars_per_token)
+        if max_chars <= 0:
+            return "", remaining
+        truncated = text[:max_chars]
+        if '\n' in truncated:
+            truncated = truncated[:truncated.rindex('\n')]
+        truncated += f"\n{TRUNCATION_MARKER}"
+        # Close a code block cut in half so the rest of the prompt is not read as code
+        if truncated.count("```") % 2:
+            truncated += "\n```"
+        return truncated, remaining - self.estimate_tokens(truncated)
@@ -0,0 +1,233 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from langchain_core.exceptions import OutputParserException
+from exception_handler.ai.base_llm_service import BaseLLMService
+from exception_handler import event_loop
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1, rate_per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _try_take(self):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait_time = self._try_take()
+            if not wait_time:
+                return
+            await asyncio.sleep(wait_time)
+
+
+class ProviderStats:
+    def __init__(self, window=200):
+        self.latencies = deque(maxlen=window)
+        # Recent outcomes, so a provider recovers from an outage once it succeeds again
+        self.outcomes = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.parse_errors = 0
+        self.hedges = 0
+        self.cancelled = 0
+        self.in_flight = 0
+
+    def increment(self, counter, amount=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def record_success(self, latency):
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+
+    def record_error(self, parse_error=False):
+        with self.lock:
+            self.calls += 1
+            self.errors += 1
+            self.outcomes.append(False)
+            if parse_error:
+                self.parse_errors += 1
+
+    def percentile(self, percent):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(percent / 100.0 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def error_rate(self):
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "parse_errors": self.parse_errors,
+            "hedges": self.hedges,
+            "cancelled": self.cancelled,
+            "in_flight": self.in_flight,
+            "p50_latency": self.percentile(50),
+            "p95_latency": self.percentile(95),
+            "error_rate": self.error_rate()
+        }
+
+
+class Provider:
+    def __init__(self, name, service, max_concurrency, rate_per_minute):
+        self.name = name
+        self.service = service
+        # A thread semaphore, because jobs may run on different event loops
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.rate_limiter = TokenBucket(rate_per_minute)
+        self.stats = ProviderStats()
+
+    async def _acquire_slot(self):
+        if self.semaphore.acquire(blocking=False):
+            return
+        waiter = asyncio.ensure_future(asyncio.to_thread(self.semaphore.acquire))
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # Give the slot back once the thread eventually gets it
+            waiter.add_done_callback(lambda _: self.semaphore.release())
+            raise
+
+    async def generate_fix(self, prompt):
+        await self._acquire_slot()
+        try:
+            await self.rate_limiter.acquire()
+            self.stats.increment('in_flight')
+            start = time.monotonic()
+            try:
+                result = await self.service._generate_fix_async(prompt)
+            except asyncio.CancelledError:
+                self.stats.increment('cancelled')
+                raise
+            except Exception as e:
+                self.stats.record_error(parse_error=isinstance(e, OutputParserException))
+                raise
+            finally:
+                self.stats.increment('in_flight', -1)
+            self.stats.record_success(time.monotonic() - start)
+            return result
+        finally:
+            self.semaphore.release()
+
+
+class RouterService(BaseLLMService):
+    model_name = "router"
+
+    def __init__(self, config):
+        from exception_handler.ai.ai_analysis_service import get_ai_service
+
+        provider_names = [
+            name.strip().lower() for name in os.getenv('ROUTER_PROVIDERS', 'gemini,openai').split(',') if name.strip()
+        ]
+        if 'router' in provider_names:
+            raise ValueError("The router cannot route to itself")
+        self.providers = []
+        for name in provider_names:
+            prefix = f"ROUTER_{name.upper()}_"
+            self.providers.append(Provider(
+                name,
+                get_ai_service({**config, 'llm_model': name}),
+                max_concurrency=int(os.getenv(prefix + 'MAX_CONCURRENCY', os.getenv('ROUTER_MAX_CONCURRENCY', 4))),
+                rate_per_minute=float(os.getenv(prefix + 'RATE_LIMIT', os.getenv('ROUTER_RATE_LIMIT', 60)))
+            ))
+        if not self.providers:
+            raise ValueError("ROUTER_PROVIDERS must list at least one LLM provider")
+
+        self.hedge_percentile = float(os.getenv('ROUTER_HEDGE_PERCENTILE', 95))
+        self.hedge_min_samples = int(os.getenv('ROUTER_HEDGE_MIN_SAMPLES', 10))
+        self.hedge_default_delay = float(os.getenv('ROUTER_HEDGE_DELAY', 60))
+        # Prompts are packed for the provider with the densest tokenizer so they fit every backend
+        self.chars_per_token = min(provider.service.chars_per_token for provider in self.providers)
+        super().__init__(config)
+        # Each provider caches its own responses
+        self.response_cache = None
+
+    def _initialize_llm(self):
+        self.llm = None
+
+    def get_stats(self):
+        return {provider.name: provider.stats.snapshot() for provider in self.providers}
+
+    def _ranked_providers(self):
+        # Providers with a fast median and few errors are tried first, the configured order breaks ties
+        def score(indexed_provider):
+            index, provider = indexed_provider
+            median = provider.stats.percentile(50)
+            if median is None:
+                # Untried providers come first, providers that only ever failed come last
+                return (0 if not provider.stats.outcomes else float('inf'), index)
+            return (median * (1 + 4 * provider.stats.error_rate()), index)
+        return [provider for _, provider in sorted(enumerate(self.providers), key=score)]
+
+    def _hedge_delay(self, provider):
+        if len(provider.stats.latencies) < self.hedge_min_samples:
+            return self.hedge_default_delay
+        return provider.stats.percentile(self.hedge_percentile)
+
+    def _generate_fix(self, prompt):
+        return event_loop.run(self._generate_fix_async(prompt))
+
+    async def _generate_fix_async(self, prompt):
+        remaining = self._ranked_providers()
+        running = {}
+        hedged = False
+        last_error = None
+
+        def start_next():
+            provider = remaining.pop(0)
+            running[asyncio.ensure_future(provider.generate_fix(prompt))] = provider
+            return provider
+
+        primary = start_next()
+        try:
+            while running:
+                timeout = self._hedge_delay(primary) if remaining and not hedged else None
+                done, _ = await asyncio.wait(running.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The primary is slower than its usual tail latency, race it against the next provider
+                    hedged = True
+                    primary.stats.increment('hedges')
+                    start_next()
+                    continue
+
+                for task in done:
+                    provider = running.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                    print(f"LLM provider {provider.name} failed: {last_error}")
+
+                # Fail over to the next provider when nothing is left running
+                if not running and remaining:
+                    primary = start_next()
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise last_error
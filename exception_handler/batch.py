@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def iter_events(source):
+    # Yields (key, event, github_issue_id, error) from a directory of JSON files, a JSONL file or stdin ('-').
+    # A record that can't be read has no event and the reason in error, so the rest of the batch still runs
+    if source != '-' and os.path.isdir(source):
+        for file_name in sorted(os.listdir(source)):
+            if not file_name.endswith('.json'):
+                continue
+            yield _read_record(lambda: _load_file(os.path.join(source, file_name)), file_name)
+        return
+
+    stream = sys.stdin if source == '-' else open(source, 'r')
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if line:
+                yield _read_record(lambda: json.loads(line), f"line-{line_number}")
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _load_file(path):
+    with open(path, 'r') as event_file:
+        return json.load(event_file)
+
+
+def _read_record(load, fallback_key):
+    try:
+        return (*_parse_record(load(), fallback_key), None)
+    except (OSError, ValueError) as e:
+        # JSONDecodeError and UnicodeDecodeError are ValueErrors
+        return fallback_key, None, None, f"Invalid record {fallback_key}: {str(e)}"
+
+
+def _parse_record(record, fallback_key):
+    # Records are either bare Sentry events or {"github_issue_id": ..., "event": {...}}
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object")
+    if 'event' in record:
+        event = record['event']
+        github_issue_id = record.get('github_issue_id')
+    else:
+        event = record
+        github_issue_id = None
+    if not isinstance(event, dict):
+        raise ValueError("expected the event to be a JSON object")
+    github_issue_id = github_issue_id or event.get('issue_id') or event.get('groupID')
+    key = event.get('event_id') or event.get('id')
+    if not key:
+        key = f"{fallback_key}-{hashlib.sha256(json.dumps(event, sort_keys=True).encode('utf-8')).hexdigest()[:12]}"
+    return str(key), event, github_issue_id
+
+
+def load_checkpoint(checkpoint_path):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r') as checkpoint_file:
+        return {line.strip() for line in checkpoint_file if line.strip()}
+
+
+def run_batch(process_fn, source, output_path, checkpoint_path=None, concurrency=4):
+    finished_keys = load_checkpoint(checkpoint_path)
+    lock = threading.Lock()
+    # Bounds the number of events read ahead of the workers
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    counts = {"processed": 0, "failed": 0, "skipped": 0}
+
+    output_file = open(output_path, 'a')
+    checkpoint_file = open(checkpoint_path, 'a') if checkpoint_path else None
+
+    def process(key, event, github_issue_id):
+        try:
+            result, status_code = process_fn(event, github_issue_id)
+        except Exception as e:
+            result, status_code = {"error": f"An unexpected error occurred: {str(e)}"}, 500
+        finally:
+            slots.release()
+        write_result(key, result, status_code)
+
+    def write_result(key, result, status_code):
+        with lock:
+            output_file.write(json.dumps({"key": key, "status_code": status_code, "result": result}) + "\n")
+            output_file.flush()
+            if status_code == 200:
+                counts["processed"] += 1
+                if checkpoint_file:
+                    checkpoint_file.write(key + "\n")
+                    checkpoint_file.flush()
+            else:
+                counts["failed"] += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for key, event, github_issue_id, error in iter_events(source):
+                if key in finished_keys:
+                    counts["skipped"] += 1
+                    continue
+                if error:
+                    print(error)
+                    write_result(key, {"error": error}, 400)
+                    continue
+                slots.acquire()
+                executor.submit(process, key, event, github_issue_id)
+    finally:
+        output_file.close()
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    return counts
@@ -0,0 +1,29 @@
+import hashlib
+import json
+import os
+
+
+def normalize_frame(frame):
+    filename = frame.get('filename') or ''
+    return {
+        "filename": os.path.normpath(filename).lstrip('/') if filename else '',
+        "function": frame.get('function'),
+        "lineno": frame.get('lineno')
+    }
+
+
+def compute_fingerprint(exception_data, trace_files, repo_name=None):
+    exception = exception_data.get('exception', {})
+    fingerprint_data = {
+        # Projects share the result store, the same code in two repositories needs a fix in each
+        "repo": repo_name,
+        "type": exception.get('type'),
+        "module": exception.get('module'),
+        "frames": [normalize_frame(frame) for frame in exception_data.get('stacktrace', [])],
+        "files": {
+            file_path: hashlib.sha256(content.encode('utf-8')).hexdigest()
+            for file_path, content in sorted(trace_files.items())
+        }
+    }
+    serialized = json.dumps(fingerprint_data, sort_keys=True)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+CACHE_MODES = ('off', 'cache', 'record', 'replay')
+
+
+class LLMCacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def make_key(model_name, temperature, prompt_text):
+        prompt_hash = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+        key_data = json.dumps({"model": model_name, "temperature": temperature, "prompt": prompt_hash}, sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        # Touch the entry so eviction removes the least recently used ones first
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return entry
+
+    def set(self, key, entry):
+        path = self._path(key)
+        data = json.dumps(entry, indent=2).encode('utf-8')
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            # Write to a temporary file first so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+            self.total_bytes += len(data) - old_size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, file_name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, file_name, stat.st_size))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self.total_bytes = sum(size for _, _, size in entries)
+        for _, file_name, size in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+                self.total_bytes -= size
+            except OSError:
+                pass
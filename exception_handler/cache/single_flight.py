@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        # Returns (result, shared) where shared is True when the result came from another caller's run
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self.calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key, coro_fn):
+        # Same as do() for coroutines; waiting happens in a thread so callers on other event loops can share a result
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self.calls[key] = call
+
+        if not is_leader:
+            await asyncio.to_thread(call.done.wait)
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = await coro_fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
@@ -0,0 +1,33 @@
+import asyncio
+import os
+import threading
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    # One long-lived loop per process runs every coroutine. The LLM clients are shared by all jobs, and the async
+    # HTTP connections of a client belong to the loop they were opened on, so a loop per call would break them
+    global _loop, _loop_pid
+    with _loop_lock:
+        # A forked server worker doesn't inherit the thread running its parent's loop
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="event-loop", daemon=True).start()
+        return _loop
+
+
+def run(coroutine):
+    # Runs the coroutine on the shared loop and waits for its result, for callers in worker threads
+    loop = get_event_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coroutine.close()
+        raise RuntimeError("Can't wait for a coroutine on the event loop it runs on")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
@@ -1,36 +1,117 @@
-from exception_handler.ai.ai_analysis_service import get_ai_service
+from exception_handler.ai.ai_analysis_service import get_shared_ai_service
 from exception_handler.vcs.vcs_factory import get_vcs_service
+from exception_handler.cache.fingerprint import compute_fingerprint
+from exception_handler.cache.result_store import ResultStore
+from exception_handler.cache.single_flight import SingleFlight
+from exception_handler.index.symbol_index import referenced_names
+from exception_handler.metrics import timed
+from exception_handler import event_loop
+import asyncio
+import hashlib
 import os
 import re
+import threading
 import json
 
+# Kept per round of a PR conversation, the prompt only shows the latest rounds
+MAX_STORED_TURNS = 20
+MAX_STORED_TURN_CHARS = 8000
+
 class ExceptionHandler:
     def __init__(self, config):
         self.config = config
-        self.ai_service = get_ai_service(config)
+        # The LLM backend imports LangChain, events that are skipped or answered from the result store never need it
+        self.ai_service = None
+        self.ai_service_lock = threading.Lock()
         self.vcs_service = get_vcs_service(config)
+        self.result_store = ResultStore(
+            os.getenv('RESULT_STORE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'exception-handler', 'results.db')),
+            ttl=int(os.getenv('RESULT_STORE_TTL', 604800)),
+            max_entries=int(os.getenv('RESULT_STORE_MAX_ENTRIES', 1000))
+        )
+        self.single_flight = SingleFlight()
+        # Earlier review rounds of each PR, so a follow-up prompt only carries what changed since the last one
+        self.conversation_store = ResultStore(
+            os.getenv('CONVERSATION_STORE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'exception-handler', 'conversations.db')),
+            ttl=int(os.getenv('CONVERSATION_STORE_TTL', 2592000)),
+            max_entries=int(os.getenv('CONVERSATION_STORE_MAX_ENTRIES', 1000))
+        )
+
+    def get_ai_service(self):
+        with self.ai_service_lock:
+            if self.ai_service is None:
+                self.ai_service = get_shared_ai_service(self.config)
+        return self.ai_service
+
+    def close(self):
+        # Called when the project is evicted, the LLM service is shared and stays open
+        self.vcs_service.close()
 
     def handle_exception(self, processed_data, github_issue_id):
+        # Thread workers and batch runs share the process's event loop, the LLM clients can't move between loops
+        return event_loop.run(self.handle_exception_async(processed_data, github_issue_id))
+
+    @timed('handle_exception')
+    async def handle_exception_async(self, processed_data, github_issue_id):
+        with self.vcs_service.track_api_calls() as api_calls:
+            result = await self._handle_exception_async(processed_data, github_issue_id)
+        return {**result, "api_calls": dict(api_calls)} if api_calls else result
+
+    async def _handle_exception_async(self, processed_data, github_issue_id):
         repo_name = self.config['repo']
         
         if not github_issue_id:
             return {"error": "No GitHub issue ID provided"}
-        
-        if self.vcs_service.pull_request_exists(repo_name, github_issue_id):
+
+        # The PR check runs while the repo metadata is fetched and the trace files are read
+        pr_exists, (repo, trace_files) = await asyncio.gather(
+            asyncio.to_thread(self.vcs_service.pull_request_exists, repo_name, github_issue_id),
+            self._get_repo_and_trace_files_async(repo_name, processed_data['stacktrace'], processed_data.get('release'))
+        )
+        if pr_exists:
             return {"status": "skipped", "reason": "Pull request already exists"}
-        
-        repo = self.vcs_service.get_repo(repo_name)
 
-        trace_files = self._get_trace_files(repo, processed_data['stacktrace'])
         if not trace_files:
             return {"error": "Could not fetch any file content from the repository"}
 
-        analysis_result = self.ai_service.analyze_exception(processed_data, trace_files)
+        fingerprint = compute_fingerprint(processed_data, trace_files, repo_name)
+        cached_result = self.result_store.get(fingerprint)
+        if cached_result:
+            return {**cached_result, "cached": True}
+
+        # Duplicate events wait for the analysis already in flight instead of starting their own
+        result, shared = await self.single_flight.do_async(
+            fingerprint,
+            lambda: self._analyze_and_create_pr_async(processed_data, trace_files, github_issue_id, fingerprint)
+        )
+        if shared:
+            return {**result, "coalesced": True}
+        return result
+
+    @timed('collect_files')
+    async def _get_repo_and_trace_files_async(self, repo_name, stacktrace, release):
+        repo = await asyncio.to_thread(self.vcs_service.get_repo, repo_name)
+        file_paths = list(dict.fromkeys(frame['filename'] for frame in stacktrace))
+        # All files of the trace are read in one call, at the release the exception was raised in
+        trace_files = await asyncio.to_thread(self.vcs_service.get_file_contents, repo, file_paths, release)
+        return repo, {file_path: content for file_path, content in trace_files.items() if content}
+
+    async def _analyze_and_create_pr_async(self, processed_data, trace_files, github_issue_id, fingerprint):
+        repo_name = self.config['repo']
+        related_symbols = await asyncio.to_thread(
+            self._get_related_symbols, repo_name, processed_data['stacktrace'], trace_files, processed_data.get('release')
+        )
+
+        # The local repository is brought up to date while the LLM works on the fix
+        analysis_result, _ = await asyncio.gather(
+            self.get_ai_service().analyze_exception_async(processed_data, trace_files, related_symbols),
+            asyncio.to_thread(self.vcs_service.prefetch, repo_name)
+        )
 
         # Get the Sentry URL from environment variables
         sentry_url = os.environ.get('SENTRY_URL', 'N/A')
 
-        vcs_response = self.vcs_service.create_pull_request({
+        vcs_response = await asyncio.to_thread(self.vcs_service.create_pull_request, {
             'proposed_fix': analysis_result['analysis'].get('diff', ''),
             'exception_type': processed_data['exception']['type'],
             'exception_value': processed_data['exception']['value'],
@@ -41,42 +122,86 @@ class ExceptionHandler:
             'affected_files': analysis_result['affected_files']
         }, repo_name)
 
-        return {
+        result = {
             "status": "success",
+            "fingerprint": fingerprint,
             "analysis": analysis_result,
             "vcs_response": vcs_response
         }
+        # Only a created pull request is kept, a fix that didn't apply or wasn't opened is analyzed again
+        if vcs_response.get('status') == 'success' and vcs_response.get('pr_url'):
+            self.result_store.set(fingerprint, result)
+        return result
 
-    def _get_trace_files(self, repo, stacktrace):
-        trace_files = {}
+    @timed('related_symbols')
+    def _get_related_symbols(self, repo_name, stacktrace, trace_files, release=None):
+        frames_by_file = {}
         for frame in stacktrace:
-            file_path = frame['filename']
-            if file_path not in trace_files:
-                file_content = self.vcs_service.get_file_content(repo, file_path)
-                if file_content:
-                    trace_files[file_path] = file_content
-        return trace_files
+            frames_by_file.setdefault(frame['filename'], []).append(frame)
 
+        names = set()
+        for file_path, content in trace_files.items():
+            windows = self.get_ai_service().context_extractor.extract_windows(content, frames_by_file.get(file_path, []))
+            names |= referenced_names(content, windows)
+
+        return self.vcs_service.get_symbol_stubs(
+            self.vcs_service.get_repo(repo_name), names, exclude_paths=list(trace_files),
+            limit=int(os.getenv('SYMBOL_STUBS_MAX', 30)), release=release
+        )
+
+    @timed('handle_pr_comment')
     def handle_pr_comment(self, comment_data):
+        with self.vcs_service.track_api_calls() as api_calls:
+            result = self._handle_pr_comment(comment_data)
+        return {**result, "api_calls": dict(api_calls)} if api_calls else result
+
+    def handle_pr_comments(self, comments_data):
+        # Comments on one PR that arrived together are answered with one analysis and a single push
+        if len(comments_data) == 1:
+            return self.handle_pr_comment(comments_data[0])
+        comment = "\n\n".join(
+            f"Comment {number}: {comment_data['comment']}" for number, comment_data in enumerate(comments_data, 1)
+        )
+        result = self.handle_pr_comment({**comments_data[-1], 'comment': comment})
+        return {**result, "comments": len(comments_data)}
+
+    def _handle_pr_comment(self, comment_data):
         repo_name = self.config['repo']
         pr_number = comment_data['pr_number']
         comment = comment_data['comment']
 
-        pr_details = self.vcs_service.get_pull_request(repo_name, pr_number)
-        
-        affected_files = self._extract_affected_files(pr_details['body'])
+        # Fetched once and reused until the comment has been posted
+        pr_details = self.vcs_service.get_pull_request_context(repo_name, pr_number)
+        conversation_key = f"{repo_name}#{pr_number}"
+        conversation = self.conversation_store.get(conversation_key) or self._start_conversation(pr_details)
 
-        file_contents = {}
-        for file_path in affected_files:
-            content = self.vcs_service.get_file_content(self.vcs_service.get_repo(repo_name), file_path)
-            if content:
-                file_contents[file_path] = content
+        affected_files = conversation['affected_files']
+        head_sha = pr_details['head_sha']
+        file_contents = self.vcs_service.get_files_at_revision(head_sha, affected_files)
+        file_hashes = self._hash_files(file_contents)
 
-        original_analysis = self._extract_original_analysis(pr_details['body'])
+        # Only the files that changed since the last round, for example by a reviewer's push, are diffed
+        changed_hunks = ""
+        changed_files = [path for path, file_hash in file_hashes.items() if conversation['file_hashes'].get(path) != file_hash]
+        if conversation['head_sha'] and conversation['head_sha'] != head_sha and changed_files:
+            changed_hunks = self.vcs_service.get_diff(conversation['head_sha'], head_sha, changed_files)
+        changed_lines = self.vcs_service.get_changed_lines(f"origin/{pr_details['base_branch']}", head_sha, affected_files)
 
-        analysis_result = self.ai_service.process_comment(comment, pr_details, file_contents, original_analysis)
+        analysis_result = self.get_ai_service().process_comment(
+            comment, pr_details, file_contents, conversation, changed_hunks=changed_hunks, changed_lines=changed_lines
+        )
         comment_body = self.vcs_service._create_comment_body(analysis_result['analysis'])
-        vcs_response = self.vcs_service.add_pr_comment(repo_name, pr_number, comment_body, analysis_result['analysis'])
+        vcs_response = self.vcs_service.add_pr_comment(
+            repo_name, pr_number, comment_body, analysis_result['analysis'], pr_context=pr_details
+        )
+
+        # The next round starts from the commit pushed here, so it doesn't see this round's own diff as new changes
+        if vcs_response.get('head_sha'):
+            head_sha = vcs_response['head_sha']
+            file_hashes = self._hash_files(self.vcs_service.get_files_at_revision(head_sha, affected_files))
+        self.conversation_store.set(conversation_key, self._add_turn(
+            conversation, comment, analysis_result['analysis'], bool(vcs_response.get('head_sha')), head_sha, file_hashes
+        ))
 
         return {
             "status": "success",
@@ -84,6 +209,49 @@ class ExceptionHandler:
             "vcs_response": vcs_response
         }
 
+    def _start_conversation(self, pr_details):
+        # The PR body is only read on the first round, later updates of the body are not sent again
+        body = pr_details['body'] or ""
+        return {
+            "pr_summary": self._extract_pr_summary(body),
+            "original_analysis": self._extract_original_analysis(body),
+            "affected_files": self._extract_affected_files(body),
+            "turns": [],
+            "earlier_turns": 0,
+            "earlier_files": [],
+            "head_sha": None,
+            "file_hashes": {}
+        }
+
+    def _add_turn(self, conversation, comment, analysis, applied, head_sha, file_hashes):
+        diff = analysis.get('diff', '')
+        turns = conversation['turns'] + [{
+            "comment": comment[:MAX_STORED_TURN_CHARS],
+            "analysis": analysis.get('analysis', '')[:MAX_STORED_TURN_CHARS],
+            "diff": diff[:MAX_STORED_TURN_CHARS],
+            "files": re.findall(r'^diff --git a/\S+ b/(\S+)', diff, re.MULTILINE),
+            "applied": applied
+        }]
+        # Older rounds are only counted with the files they touched
+        dropped_turns = turns[:-MAX_STORED_TURNS]
+        earlier_files = set(conversation['earlier_files']).union(*(turn['files'] for turn in dropped_turns))
+        return {
+            **conversation,
+            "turns": turns[-MAX_STORED_TURNS:],
+            "earlier_turns": conversation['earlier_turns'] + len(dropped_turns),
+            "earlier_files": sorted(earlier_files),
+            "head_sha": head_sha,
+            "file_hashes": file_hashes
+        }
+
+    def _hash_files(self, file_contents):
+        return {path: hashlib.sha256(content.encode('utf-8')).hexdigest() for path, content in file_contents.items()}
+
+    def _extract_pr_summary(self, pr_body):
+        # The part of the body before the affected files: the linked issues and the exception
+        summary_end = pr_body.find("Affected Files:")
+        return (pr_body[:summary_end] if summary_end != -1 else pr_body).strip()
+
     def _extract_affected_files(self, pr_body):
         affected_files = []
         
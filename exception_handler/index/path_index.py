@@ -0,0 +1,80 @@
+import os
+import threading
+from git import Repo
+
+_path_indexes = {}
+_path_indexes_lock = threading.Lock()
+
+
+def get_path_index(repo_path):
+    # Notifiers are created per event, so the index is shared per repository
+    with _path_indexes_lock:
+        if repo_path not in _path_indexes:
+            _path_indexes[repo_path] = PathIndex(repo_path)
+        return _path_indexes[repo_path]
+
+
+def release_path_index(repo_path):
+    # Called when a project's handler is evicted, the index is built again on its next event
+    with _path_indexes_lock:
+        path_index = _path_indexes.pop(repo_path, None)
+    if path_index and path_index.repo is not None:
+        path_index.repo.close()
+
+
+class PathIndex:
+    def __init__(self, repo_path, min_suffix_components=2):
+        self.repo_path = repo_path
+        self.min_suffix_components = min_suffix_components
+        self.lock = threading.Lock()
+        self.repo = None
+        self.rev = None
+        self.paths = None
+        try:
+            self.repo = Repo(repo_path)
+        except Exception as e:
+            print(f"Error opening repository for path index {repo_path}: {e}")
+
+    def refresh(self):
+        if self.repo is None:
+            return
+        with self.lock:
+            rev = self._resolve_rev()
+            if self.paths is not None and rev == self.rev:
+                return
+            if rev is None:
+                # A repository without commits, only its git index lists files
+                output = self.repo.git.ls_files('-z')
+            else:
+                output = self.repo.git.ls_tree('-r', '--name-only', '-z', rev)
+            self.paths = frozenset(path for path in output.split('\0') if path)
+            self.rev = rev
+
+    def _resolve_rev(self):
+        # Paths are listed at origin's default branch as of the last fetch, as the working tree and HEAD of
+        # LOCAL_REPO_PATH are never updated. HEAD is only used when the clone has no origin/HEAD. rev-parse runs its
+        # own process, the Repo's persistent cat-file process is not safe to share across jobs
+        for rev in ('refs/remotes/origin/HEAD', 'HEAD'):
+            try:
+                return self.repo.git.rev_parse('--verify', '--quiet', f'{rev}^{{commit}}')
+            except Exception:
+                continue
+        return None
+
+    def resolve(self, file_path):
+        if self.paths is None:
+            # Without a git index fall back to checking the filesystem
+            full_path = os.path.join(self.repo_path, file_path)
+            return file_path if os.path.isfile(full_path) else None
+
+        relative_path = os.path.normpath(file_path).lstrip('/')
+        if relative_path in self.paths:
+            return relative_path
+
+        # Deploy paths such as /app/src/module.py are matched on their longest suffix present in the repository
+        parts = relative_path.split('/')
+        for start in range(1, len(parts) - self.min_suffix_components + 1):
+            suffix = '/'.join(parts[start:])
+            if suffix in self.paths:
+                return suffix
+        return None
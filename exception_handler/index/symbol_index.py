@@ -0,0 +1,246 @@
+import ast
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from exception_handler.vcs.blob_reader import BlobReader
+
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+# Files read from git per round trip while the index is built
+READ_CHUNK_SIZE = 500
+
+
+class SymbolIndex:
+    def __init__(self, repo, path):
+        self.repo = repo
+        self.path = path
+        # Serializes updates. They run git in processes of their own rather than through the Repo's persistent
+        # cat-file process, so they never wait for or hold up the lock guarding it
+        self.lock = threading.Lock()
+        self.blob_reader = BlobReader(repo.working_tree_dir or repo.git_dir, max_bytes=0)
+        self.state_lock = threading.Lock()
+        self.requested = None
+        self.thread = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            # Queries read the last committed index while an update rewrites it
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS symbols ("
+                "path TEXT, module TEXT, name TEXT, qualname TEXT, kind TEXT, lineno INTEGER, stub TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name, kind, path, lineno)")
+            conn.execute("CREATE INDEX IF NOT EXISTS symbols_module ON symbols (module, name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path)")
+            conn.execute("CREATE TABLE IF NOT EXISTS imports (path TEXT, module TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS imports_path ON imports (path)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def indexed_commit(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'commit'").fetchone()
+        return row[0] if row else None
+
+    def update(self, rev='HEAD'):
+        with self.lock:
+            commit = self.repo.git.rev_parse('--verify', f'{rev}^{{commit}}')
+            old_commit = self.indexed_commit()
+            if old_commit == commit:
+                return 0
+
+            if old_commit and self._has_commit(old_commit):
+                changed_paths = self._changed_paths(old_commit, commit)
+            else:
+                changed_paths = None
+            if changed_paths is None:
+                output = self.repo.git.ls_tree('-r', '--name-only', '-z', commit)
+                paths = [path for path in output.split('\0') if path.endswith('.py')]
+            else:
+                paths = changed_paths
+
+            with self._connect() as conn:
+                if changed_paths is None:
+                    conn.execute("DELETE FROM symbols")
+                    conn.execute("DELETE FROM imports")
+                else:
+                    for path in changed_paths:
+                        conn.execute("DELETE FROM symbols WHERE path = ?", (path,))
+                        conn.execute("DELETE FROM imports WHERE path = ?", (path,))
+                for start in range(0, len(paths), READ_CHUNK_SIZE):
+                    # Deleted files are missing at the commit, so their rows are only removed
+                    contents = self.blob_reader.read(commit, paths[start:start + READ_CHUNK_SIZE])
+                    for path, content in contents.items():
+                        self._index_file(conn, path, content.decode('utf-8', errors='replace'))
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('commit', ?)", (commit,))
+            return len(paths)
+
+    def update_in_background(self, rev):
+        # Returns right away, one thread at a time brings the index to the latest commit asked for
+        with self.state_lock:
+            self.requested = rev
+            if self.thread:
+                return
+            self.thread = threading.Thread(target=self._run_updates, name='symbol-index', daemon=True)
+            self.thread.start()
+
+    def wait(self, timeout=None):
+        # Waits for the background updates, returns False if they are still running after the timeout
+        with self.state_lock:
+            thread = self.thread
+        if thread:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def close(self):
+        self.wait(timeout=10)
+        self.blob_reader.close()
+
+    def _run_updates(self):
+        while True:
+            with self.state_lock:
+                rev, self.requested = self.requested, None
+                if rev is None:
+                    self.thread = None
+                    return
+            try:
+                self.update(rev)
+            except Exception as e:
+                print(f"Error updating symbol index to {rev}: {str(e)}")
+
+    def _has_commit(self, sha):
+        try:
+            self.repo.git.cat_file('-e', f'{sha}^{{commit}}')
+            return True
+        except Exception:
+            return False
+
+    def _changed_paths(self, old_commit, new_commit):
+        output = self.repo.git.diff('--name-only', '--no-renames', '-z', old_commit, new_commit, '--', '*.py')
+        return [path for path in output.split('\0') if path]
+
+    def _index_file(self, conn, path, content):
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            return
+        module = path_to_module(path)
+        symbols = []
+        for node in tree.body:
+            if isinstance(node, FUNCTION_NODES):
+                symbols.append((path, module, node.name, node.name, 'function', node.lineno, function_stub(node)))
+            elif isinstance(node, ast.ClassDef):
+                symbols.append((path, module, node.name, node.name, 'class', node.lineno, class_stub(node)))
+                for child in node.body:
+                    if isinstance(child, FUNCTION_NODES):
+                        qualname = f"{node.name}.{child.name}"
+                        symbols.append((path, module, child.name, qualname, 'method', child.lineno,
+                                        function_stub(child)))
+        conn.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)", symbols)
+
+        imports = set()
+        for node in iter_statements(tree.body):
+            if isinstance(node, ast.Import):
+                imports.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                imports.add(node.module)
+        conn.executemany("INSERT INTO imports VALUES (?, ?)", [(path, name) for name in imports])
+
+    def imported_modules(self, paths):
+        if not paths:
+            return set()
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT module FROM imports WHERE path IN ({placeholders(paths)})", list(paths)).fetchall()
+        return {row[0] for row in rows}
+
+    def find_symbols(self, names, exclude_paths=(), limit=30):
+        if not names:
+            return []
+        names = list(names)
+        exclude_paths = list(exclude_paths)
+        # Definitions in modules imported by the trace files are the likeliest targets of a call
+        imported = list(self.imported_modules(exclude_paths))
+        select = (
+            f"SELECT path, qualname, kind, lineno, stub FROM symbols "
+            f"WHERE name IN ({placeholders(names)}) AND path NOT IN ({placeholders(exclude_paths)}) "
+        )
+        with self._connect() as conn:
+            rows = conn.execute(
+                select + f"AND module IN ({placeholders(imported)}) ORDER BY kind, path, lineno LIMIT ?",
+                names + exclude_paths + imported + [limit]
+            ).fetchall()
+            if len(rows) < limit:
+                rows += conn.execute(
+                    select + f"AND module NOT IN ({placeholders(imported)}) ORDER BY name, kind, path, lineno LIMIT ?",
+                    names + exclude_paths + imported + [limit - len(rows)]
+                ).fetchall()
+        return [
+            {"path": path, "qualname": qualname, "kind": kind, "lineno": lineno, "stub": stub}
+            for path, qualname, kind, lineno, stub in rows
+        ]
+
+
+def iter_statements(body):
+    # Walks statements only, imports never appear inside expressions
+    for node in body:
+        yield node
+        for field in ('body', 'orelse', 'finalbody', 'handlers'):
+            children = getattr(node, field, None)
+            if isinstance(children, list):
+                yield from iter_statements(children)
+
+
+def placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+def path_to_module(path):
+    module = path[:-len('.py')] if path.endswith('.py') else path
+    if module.endswith('/__init__'):
+        module = module[:-len('/__init__')]
+    return module.replace('/', '.')
+
+
+def function_stub(node):
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}: ..."
+
+
+def class_stub(node):
+    bases = [ast.unparse(base) for base in node.bases] + [ast.unparse(keyword) for keyword in node.keywords]
+    header = f"class {node.name}({', '.join(bases)}):" if bases else f"class {node.name}:"
+    init = next((child for child in node.body if isinstance(child, FUNCTION_NODES) and child.name == '__init__'), None)
+    if init:
+        return f"{header}\n    {function_stub(init)}"
+    return f"{header} ..."
+
+
+def referenced_names(content, windows):
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        if not any(start <= node.lineno <= end for start, end in windows):
+            continue
+        if isinstance(node.func, ast.Name):
+            names.add(node.func.id)
+        elif isinstance(node.func, ast.Attribute):
+            names.add(node.func.attr)
+    return names
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from exception_handler import event_loop
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobStore:
+    # Shares job status between server worker processes, so any of them can answer GET /jobs/<id>
+    def __init__(self, path, max_jobs=1000):
+        self.path = path
+        self.max_jobs = max_jobs
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save(self, job):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, value, updated_at) VALUES (?, ?, ?)",
+                (job['id'], json.dumps(job), time.time())
+            )
+            if job['finished_at']:
+                conn.execute(
+                    "DELETE FROM jobs WHERE id NOT IN (SELECT id FROM jobs ORDER BY updated_at DESC LIMIT ?)",
+                    (self.max_jobs,)
+                )
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class JobQueue:
+    def __init__(self, handler_fn, max_size=100, num_workers=4, max_finished_jobs=1000, store=None):
+        self.handler_fn = handler_fn
+        self.max_finished_jobs = max_finished_jobs
+        self.store = store
+        self.queue = queue.Queue(maxsize=max_size)
+        self.jobs = {}
+        self.finished_job_ids = []
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.unfinished = 0
+        self.workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, *args):
+        job_id = self._create_job()
+        try:
+            self.queue.put_nowait((job_id, args))
+        except queue.Full:
+            self._discard_job(job_id)
+            raise QueueFullError("Job queue is full, try again later")
+        return job_id
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return dict(job)
+        # The job may have been queued by another server worker
+        return self.store.get(job_id) if self.store else None
+
+    def drain(self, timeout=None):
+        # Waits for every accepted job to finish, returns False if some are still unfinished after the timeout
+        with self.idle:
+            return self.idle.wait_for(lambda: self.unfinished == 0, timeout)
+
+    def _worker_loop(self):
+        while True:
+            job_id, args = self.queue.get()
+            self._start_job(job_id)
+            try:
+                result, status_code = self.handler_fn(*args)
+            except Exception as e:
+                result, status_code = {"error": f"An unexpected error occurred: {str(e)}"}, 500
+            self._finish_job(job_id, result, status_code)
+            self.queue.task_done()
+
+    def _create_job(self):
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            job = self.jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "result": None,
+                "status_code": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None
+            }
+            self.unfinished += 1
+            snapshot = dict(job)
+        self._save_job(snapshot)
+        return job_id
+
+    def _discard_job(self, job_id):
+        with self.lock:
+            del self.jobs[job_id]
+            self.unfinished -= 1
+            self.idle.notify_all()
+
+    def _start_job(self, job_id):
+        with self.lock:
+            job = self.jobs[job_id]
+            job['status'] = "running"
+            job['started_at'] = time.time()
+            snapshot = dict(job)
+        self._save_job(snapshot)
+
+    def _finish_job(self, job_id, result, status_code):
+        with self.lock:
+            job = self.jobs[job_id]
+            job['status'] = "finished" if status_code == 200 else "failed"
+            job['result'] = result
+            job['status_code'] = status_code
+            job['finished_at'] = time.time()
+            self._record_finished(job_id)
+            snapshot = dict(job)
+        self._save_job(snapshot)
+        with self.lock:
+            self.unfinished -= 1
+            self.idle.notify_all()
+
+    def _save_job(self, job):
+        if not self.store:
+            return
+        try:
+            self.store.save(job)
+        except Exception as e:
+            print(f"Error saving job {job['id']}: {str(e)}")
+
+    def _record_finished(self, job_id):
+        # Keep the job table bounded by forgetting the oldest finished jobs
+        self.finished_job_ids.append(job_id)
+        while len(self.finished_job_ids) > self.max_finished_jobs:
+            self.jobs.pop(self.finished_job_ids.pop(0), None)
+
+
+class AsyncJobQueue(JobQueue):
+    # Runs coroutine jobs on one event loop thread, so many analyses can wait on I/O at the same time
+    def __init__(self, handler_fn, max_size=100, num_workers=32, max_finished_jobs=1000, store=None):
+        self.handler_fn = handler_fn
+        self.max_size = max_size
+        self.max_finished_jobs = max_finished_jobs
+        self.store = store
+        self.jobs = {}
+        self.finished_job_ids = []
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.unfinished = 0
+        self.pending = 0
+        # The process's shared loop, the same one thread workers and batch runs hand their coroutines to
+        self.loop = event_loop.get_event_loop()
+        self.semaphore = asyncio.Semaphore(num_workers)
+
+    def submit(self, *args):
+        with self.lock:
+            if self.pending >= self.max_size:
+                raise QueueFullError("Job queue is full, try again later")
+            self.pending += 1
+        job_id = self._create_job()
+        asyncio.run_coroutine_threadsafe(self._run_job(job_id, args), self.loop)
+        return job_id
+
+    async def _run_job(self, job_id, args):
+        async with self.semaphore:
+            with self.lock:
+                self.pending -= 1
+            self._start_job(job_id)
+            try:
+                result, status_code = await self.handler_fn(*args)
+            except Exception as e:
+                result, status_code = {"error": f"An unexpected error occurred: {str(e)}"}, 500
+            self._finish_job(job_id, result, status_code)
+
+
+class CoalescingJobQueue(JobQueue):
+    # Items with the same key that arrive within the debounce window of the first one are handled together by a
+    # single handler_fn([item, ...]) call, and a batch only starts once the previous batch of its key has finished
+    def __init__(self, handler_fn, debounce=20, max_size=100, num_workers=2, max_finished_jobs=1000, store=None):
+        self.handler_fn = handler_fn
+        self.debounce = debounce
+        self.max_size = max_size
+        self.max_finished_jobs = max_finished_jobs
+        self.store = store
+        self.jobs = {}
+        self.finished_job_ids = []
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.unfinished = 0
+        self.pending = 0
+        self.batches = {}
+        self.in_flight = set()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='coalescing-job-worker')
+
+    def submit(self, key, item):
+        with self.lock:
+            if self.pending >= self.max_size:
+                raise QueueFullError("Job queue is full, try again later")
+            self.pending += 1
+        job_id = self._create_job()
+        with self.lock:
+            batch = self.batches.get(key)
+            if batch is None:
+                batch = self.batches[key] = {"jobs": [], "due": False}
+                timer = threading.Timer(self.debounce, self._close_window, (key,))
+                timer.daemon = True
+                timer.start()
+            # A batch waiting for the one in flight still takes new jobs, they are handled in the same call
+            batch['jobs'].append((job_id, item))
+        return job_id
+
+    def _close_window(self, key):
+        with self.lock:
+            self.batches[key]['due'] = True
+            if key in self.in_flight:
+                return
+            jobs = self._take_batch(key)
+        self.executor.submit(self._run_batch, key, jobs)
+
+    def _take_batch(self, key):
+        jobs = self.batches.pop(key)['jobs']
+        self.in_flight.add(key)
+        self.pending -= len(jobs)
+        return jobs
+
+    def _run_batch(self, key, jobs):
+        while jobs:
+            for job_id, _ in jobs:
+                self._start_job(job_id)
+            try:
+                result, status_code = self.handler_fn([item for _, item in jobs])
+            except Exception as e:
+                result, status_code = {"error": f"An unexpected error occurred: {str(e)}"}, 500
+            for job_id, _ in jobs:
+                self._finish_job(job_id, result, status_code)
+
+            # The next batch of the key starts right away if its window closed while this one was running
+            with self.lock:
+                self.in_flight.discard(key)
+                batch = self.batches.get(key)
+                jobs = self._take_batch(key) if batch and batch['due'] else None
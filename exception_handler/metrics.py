@@ -0,0 +1,185 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _format_labels(self, label_values, extra=()):
+        pairs = list(zip(self.label_names, label_values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in sorted(values.items()):
+            lines.extend(self._render_sample(label_values, value))
+        return lines
+
+    def _render_sample(self, label_values, value):
+        return [f"{self.name}{self._format_labels(label_values)} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class ElapsedGauge(Gauge):
+    # Set to a time.monotonic() timestamp, reports the seconds elapsed since then when scraped
+    def _render_sample(self, label_values, value):
+        return [f"{self.name}{self._format_labels(label_values)} {round(time.monotonic() - value, 3)}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *label_values, value):
+        # Only the matching bucket is incremented, the cumulative counts are computed when scraped
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            sample = self.values.get(label_values)
+            if sample is None:
+                sample = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def totals(self):
+        with self.lock:
+            return {label_values: (sample[2], sample[1]) for label_values, sample in self.values.items()}
+
+    def render(self):
+        with self.lock:
+            values = {label_values: [list(sample[0]), sample[1], sample[2]] for label_values, sample in self.values.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, (bucket_counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._format_labels(label_values, [('le', upper_bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(label_values)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(label_values)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get_or_create(self, metric_class, name, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, documentation, label_names=()):
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names=()):
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def elapsed_gauge(self, name, documentation, label_names=()):
+        return self._get_or_create(ElapsedGauge, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'exception_handler_stage_duration_seconds', 'Time spent in each stage of handling an event', ('stage',)
+)
+STAGE_IN_FLIGHT = REGISTRY.gauge('exception_handler_stage_in_flight', 'Stages currently running', ('stage',))
+STAGE_ERRORS = REGISTRY.counter('exception_handler_stage_errors_total', 'Stages that raised an exception', ('stage',))
+LLM_TOKENS = REGISTRY.counter(
+    'exception_handler_llm_tokens_total', 'Tokens sent to and received from the LLM', ('model', 'direction')
+)
+
+
+@contextmanager
+def span(stage):
+    STAGE_IN_FLIGHT.inc(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(stage, value=time.perf_counter() - start)
+        STAGE_IN_FLIGHT.dec(stage)
+
+
+def timed(stage):
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def record_llm_tokens(model_name, prompt_tokens, response_tokens):
+    LLM_TOKENS.inc(model_name, 'prompt', amount=prompt_tokens)
+    LLM_TOKENS.inc(model_name, 'response', amount=response_tokens)
@@ -1,9 +1,18 @@
+import json
 from abc import ABC, abstractmethod
 
 class BaseNotifier(ABC):
     def __init__(self, config):
         self.config = config
 
+    def streams(self, size):
+        # Whether a document of size bytes is scanned for the fields the notifier needs instead of parsed in full
+        return False
+
+    def load_event(self, data, span=None):
+        # data is the raw JSON document, span the (start, end) of the event in it when it is wrapped
+        return json.loads(data[span[0]:span[1]] if span else data[:])
+
     @abstractmethod
     def process_exception(self, payload):
         pass
\ No newline at end of file
@@ -0,0 +1,147 @@
+import json
+import mmap
+import os
+import re
+from contextlib import contextmanager
+
+# Finds where values start and end without decoding them, so only the parts of a large document that are
+# needed are turned into Python objects. Works on bytes and on memory-mapped files, which the OS pages in as
+# they are scanned instead of reading the whole file into memory. Skipped values are not validated.
+WHITESPACE = re.compile(rb'[ \t\n\r]*')
+STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+# Everything up to and including the next bracket outside a string, so skipping a container loops once per bracket
+NEXT_BRACKET = re.compile(rb'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*[\[\]{}]', re.S)
+SCALAR = re.compile(rb'[^,:\[\]{}\s]+')
+
+
+@contextmanager
+def map_file(json_file):
+    # Empty files can't be mapped, they fail to parse either way
+    if os.fstat(json_file.fileno()).st_size == 0:
+        yield b''
+        return
+    with mmap.mmap(json_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
+
+
+def decode(buf, span, default=None):
+    if span is None:
+        return default
+    return json.loads(buf[span[0]:span[1]])
+
+
+def object_spans(buf, pos=0, expand=()):
+    # Returns {key: (start, end)} for the members of the object starting at pos. Arrays under the keys in expand
+    # are split in the same pass into a list with the member spans of each object item, instead of being scanned
+    # again later
+    return _object_members(buf, pos, expand)[0]
+
+
+def array_spans(buf, pos=0):
+    # Returns [(start, end)] for the items of the array starting at pos
+    return _array_items(buf, pos, False)[0]
+
+
+def _object_members(buf, pos, expand=()):
+    pos = _skip_whitespace(buf, pos)
+    _expect(buf, pos, b'{')
+    spans = {}
+    pos = _skip_whitespace(buf, pos + 1)
+    if buf[pos:pos + 1] == b'}':
+        return spans, pos + 1
+    while True:
+        key_end = _skip_string(buf, pos)
+        key = json.loads(buf[pos:key_end])
+        pos = _skip_whitespace(buf, key_end)
+        _expect(buf, pos, b':')
+        start = _skip_whitespace(buf, pos + 1)
+        if key in expand and buf[start:start + 1] == b'[':
+            spans[key], end = _array_items(buf, start, True)
+        else:
+            end = skip_value(buf, start)
+            spans[key] = (start, end)
+        pos = _skip_whitespace(buf, end)
+        if buf[pos:pos + 1] == b'}':
+            return spans, pos + 1
+        _expect(buf, pos, b',')
+        pos = _skip_whitespace(buf, pos + 1)
+
+
+def _array_items(buf, pos, split_objects):
+    pos = _skip_whitespace(buf, pos)
+    _expect(buf, pos, b'[')
+    items = []
+    pos = _skip_whitespace(buf, pos + 1)
+    if buf[pos:pos + 1] == b']':
+        return items, pos + 1
+    while True:
+        if split_objects and buf[pos:pos + 1] == b'{':
+            item, end = _object_members(buf, pos)
+        else:
+            end = skip_value(buf, pos)
+            item = (pos, end)
+        items.append(item)
+        pos = _skip_whitespace(buf, end)
+        if buf[pos:pos + 1] == b']':
+            return items, pos + 1
+        _expect(buf, pos, b',')
+        pos = _skip_whitespace(buf, pos + 1)
+
+
+def find(buf, *keys, pos=0):
+    # Returns the span of the value at the path of object keys, or None if one of them is missing
+    span = None
+    for key in keys:
+        if span is not None:
+            pos = span[0]
+        pos = _skip_whitespace(buf, pos)
+        if buf[pos:pos + 1] != b'{':
+            return None
+        span = object_spans(buf, pos).get(key)
+        if span is None:
+            return None
+    return span
+
+
+def skip_value(buf, pos):
+    first = buf[pos:pos + 1]
+    if first == b'"':
+        return _skip_string(buf, pos)
+    if first in (b'{', b'['):
+        depth = 0
+        while True:
+            match = NEXT_BRACKET.match(buf, pos)
+            if not match:
+                raise _error("Unterminated container", pos)
+            pos = match.end()
+            if buf[pos - 1:pos] in (b'{', b'['):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+    match = SCALAR.match(buf, pos)
+    if not match:
+        raise _error("Expecting value", pos)
+    return match.end()
+
+
+def _skip_whitespace(buf, pos):
+    return WHITESPACE.match(buf, pos).end()
+
+
+def _skip_string(buf, pos):
+    match = STRING.match(buf, pos)
+    if not match:
+        raise _error("Expecting string", pos)
+    return match.end()
+
+
+def _expect(buf, pos, token):
+    if buf[pos:pos + 1] != token:
+        raise _error(f"Expecting '{token.decode()}'", pos)
+
+
+def _error(message, pos):
+    # The same error json.load raises, so callers handle both parse modes alike
+    return json.JSONDecodeError(message, '', pos)
@@ -1,8 +1,8 @@
-from exception_handler.notifiers.sentry_notifier import SentryNotifier
+from exception_handler.plugins import load
 
 def get_notifier(config):
     notifier_type = config.get('notifier', '').lower()
-    if notifier_type == 'sentry':
-        return SentryNotifier(config)
-    else:
-        raise ValueError(f"Unsupported notifier type: {notifier_type}")
\ No newline at end of file
+    notifier_class = load('notifier', notifier_type)
+    if notifier_class is None:
+        raise ValueError(f"Unsupported notifier type: {notifier_type}")
+    return notifier_class(config)
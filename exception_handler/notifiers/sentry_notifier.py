@@ -1,11 +1,79 @@
 import os
 import re
 from exception_handler.notifiers.base_notifier import BaseNotifier
+from exception_handler.notifiers.json_scanner import array_spans, decode, find, object_spans
+from exception_handler.index.path_index import get_path_index
+
+# The fields process_exception reads, everything else (breadcrumbs, debug meta, frame variables, ...) is skipped
+WEBHOOK_EVENT_FIELDS = (
+    'event_id', 'project', 'environment', 'platform', 'release', 'transaction', 'request', 'user', 'tags', 'extra',
+    'timestamp', 'url', 'issue_id', 'web_url'
+)
+API_EVENT_FIELDS = ('id', 'projectID', 'contexts', 'platform', 'release', 'transaction', 'user', 'tags', 'dateReceived', 'groupID')
+EXCEPTION_FIELDS = ('type', 'value', 'module')
+FRAME_FIELDS = ('filename', 'abs_path', 'module', 'function', 'lineno', 'colno', 'context_line', 'in_app')
 
 class SentryNotifier(BaseNotifier):
     def __init__(self, config):
         super().__init__(config)
         self.repo_path = config['local_repo_path']
+        # Events are loaded before they are routed to a project, which needs no repository
+        self.path_index = get_path_index(self.repo_path) if self.repo_path else None
+        # Parsing the whole event is fastest, only events large enough for its memory use to matter are streamed
+        self.parse_mode = os.getenv('EVENT_PARSE_MODE', 'full').lower()
+        self.stream_min_bytes = int(os.getenv('EVENT_STREAM_MIN_BYTES', 10 * 1024 * 1024))
+
+    def streams(self, size):
+        return self.parse_mode == 'stream' or size >= self.stream_min_bytes
+
+    def load_event(self, data, span=None):
+        if not self.streams(span[1] - span[0] if span else len(data)):
+            return super().load_event(data, span)
+        spans = object_spans(data, span[0] if span else 0, expand=('entries',))
+        if 'id' in spans and isinstance(spans.get('entries'), list):
+            return self._load_api_event(data, spans)
+        return self._load_webhook_event(data, spans)
+
+    def _load_webhook_event(self, data, spans):
+        event = {field: decode(data, spans[field]) for field in WEBHOOK_EVENT_FIELDS if field in spans}
+        if 'exception' in spans:
+            values_span = find(data, 'values', pos=spans['exception'][0])
+            event['exception'] = {'values': self._load_exception_values(data, values_span, True)} if values_span else {}
+        return event
+
+    def _load_api_event(self, data, spans):
+        event = {field: decode(data, spans[field]) for field in API_EVENT_FIELDS if field in spans}
+        event['entries'] = []
+        for entry_spans in spans['entries']:
+            if not isinstance(entry_spans, dict):
+                continue
+            entry_type = decode(data, entry_spans.get('type'))
+            if entry_type == 'exception':
+                values_span = find(data, 'values', pos=entry_spans['data'][0]) if 'data' in entry_spans else None
+                entry_data = {'values': self._load_exception_values(data, values_span, False)} if values_span else {}
+                event['entries'].append({'type': entry_type, 'data': entry_data})
+            elif entry_type == 'request':
+                event['entries'].append({'type': entry_type, 'data': decode(data, entry_spans.get('data'))})
+        return event
+
+    def _load_exception_values(self, data, values_span, in_app_only):
+        # Only the first exception is processed, and only the frame fields the handler uses are kept
+        value_spans = array_spans(data, values_span[0])
+        if not value_spans:
+            return []
+        exception_spans = object_spans(data, value_spans[0][0])
+        exception = {field: decode(data, exception_spans[field]) for field in EXCEPTION_FIELDS if field in exception_spans}
+        frames_span = find(data, 'frames', pos=exception_spans['stacktrace'][0]) if 'stacktrace' in exception_spans else None
+        if frames_span:
+            frames = []
+            for start, _ in array_spans(data, frames_span[0]):
+                frame_spans = object_spans(data, start)
+                frame = {field: decode(data, frame_spans[field]) for field in FRAME_FIELDS if field in frame_spans}
+                # The API format is filtered by path later, the webhook format by the in_app flag
+                if frame.get('in_app') or not in_app_only:
+                    frames.append(frame)
+            exception['stacktrace'] = {'frames': frames}
+        return [exception]
 
     def process_exception(self, payload):
         # Check if the payload is in the api format
@@ -45,6 +113,7 @@ class SentryNotifier(BaseNotifier):
 
     def process_api_format(self, payload):
         # New code for processing new format
+        self.path_index.refresh()
         exception_entry = next((entry for entry in payload.get('entries', []) if entry.get('type') == 'exception'), {})
         exception = exception_entry.get('data', {}).get('values', [{}])[0]
         return {
@@ -59,10 +128,7 @@ class SentryNotifier(BaseNotifier):
                 "value": exception.get('value'),
                 "module": exception.get('module'),
             },
-            "stacktrace": [
-                frame for frame in exception.get('stacktrace', {}).get('frames', [])
-                if self.is_app_file(frame.get('filename'))
-            ],
+            "stacktrace": self.get_app_frames(exception.get('stacktrace', {}).get('frames', [])),
             "context": {
                 "request": next((entry.get('data') for entry in payload.get('entries', []) if entry.get('type') == 'request'), {}),
                 "user": payload.get('user', {}),
@@ -75,14 +141,24 @@ class SentryNotifier(BaseNotifier):
             "web_url": None  # This field is not present in the new format
         }
 
+    def get_app_frames(self, frames):
+        app_frames = []
+        for frame in frames:
+            app_file = self.resolve_app_file(frame.get('filename'))
+            if app_file:
+                # Point the frame at the repository-relative path so its file can be read from the repository
+                app_frames.append({**frame, 'filename': app_file})
+        return app_frames
+
     def is_app_file(self, filename):
+        return self.resolve_app_file(filename) is not None
+
+    def resolve_app_file(self, filename):
         if not filename:
-            return False
+            return None
         # Extract the absolute path using regex
         match = re.search(r'(?:^|\s)([^\s()]+/[^\s()]+\.[\w]+)', filename)
         if not match:
-            return False
-        absolute_path = match.group(1)
-        # Check if the file exists in the repository
-        full_path = os.path.join(self.repo_path, absolute_path)
-        return os.path.isfile(full_path)
\ No newline at end of file
+            return None
+        # Look the path up in the repository's file index
+        return self.path_index.resolve(match.group(1))
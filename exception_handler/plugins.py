@@ -0,0 +1,57 @@
+import importlib
+import threading
+
+# Backends are registered by import path, so only the one a deployment selects is ever imported.
+# Packages can add their own through the `exception_handler.<kind>` entry point groups
+PLUGINS = {
+    'notifier': {
+        'sentry': 'exception_handler.notifiers.sentry_notifier:SentryNotifier'
+    },
+    'vcs': {
+        'github': 'exception_handler.vcs.github_service:GitHubService'
+    },
+    'llm': {
+        'gemini': 'exception_handler.ai.gemini_analysis_service:GeminiAnalysisService',
+        'openai': 'exception_handler.ai.openai_analysis_service:OpenAIAnalysisService',
+        'router': 'exception_handler.ai.router_service:RouterService'
+    }
+}
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def register(kind, name, target):
+    # target is a class or a 'module:attribute' string that is imported on first use
+    with _lock:
+        PLUGINS.setdefault(kind, {})[name.lower()] = target
+        _loaded.pop((kind, name.lower()), None)
+
+
+def load(kind, name):
+    key = (kind, name.lower())
+    with _lock:
+        if key in _loaded:
+            return _loaded[key]
+        target = PLUGINS.get(kind, {}).get(key[1])
+    if target is None:
+        target = _find_entry_point(kind, key[1])
+        if target is None:
+            return None
+
+    if isinstance(target, str):
+        module_name, _, attribute = target.partition(':')
+        target = getattr(importlib.import_module(module_name), attribute)
+    with _lock:
+        _loaded[key] = target
+    return target
+
+
+def _find_entry_point(kind, name):
+    # Reading the installed distributions is slow, so it is only done for names that aren't built in
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group=f'exception_handler.{kind}'):
+        if entry_point.name.lower() == name:
+            return entry_point.value
+    return None
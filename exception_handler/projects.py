@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from exception_handler.cache.single_flight import SingleFlight
+from exception_handler.handler import ExceptionHandler
+from exception_handler.metrics import REGISTRY
+
+PROJECT_HANDLERS = REGISTRY.gauge('exception_handler_project_handlers', 'Project handlers currently built')
+PROJECT_HANDLER_EVICTIONS = REGISTRY.counter(
+    'exception_handler_project_handler_evictions_total', 'Project handlers closed because they were idle or least recently used'
+)
+
+
+def load_projects(path):
+    # Returns (settings, projects): the top-level settings apply to every project and each project can override them
+    with open(path, 'r') as config_file:
+        settings = json.load(config_file)
+    projects = settings.pop('projects', [])
+    for project in projects:
+        if 'unique_identifier' not in project or not project.get('repo'):
+            raise ValueError(f"Projects in {path} need a unique_identifier and a repo")
+    return settings, projects
+
+
+def event_project_id(event):
+    # The webhook format carries the Sentry project ID in 'project', the API format in 'projectID'
+    project_id = event.get('project', event.get('projectID'))
+    return str(project_id) if project_id is not None else None
+
+
+def event_environment(event):
+    if event.get('environment'):
+        return event['environment']
+    # The API format only has it in the tags, as [key, value] pairs or {"key": ..., "value": ...} objects
+    for tag in event.get('tags') or []:
+        if isinstance(tag, dict):
+            key, value = tag.get('key'), tag.get('value')
+        elif isinstance(tag, (list, tuple)) and len(tag) == 2:
+            key, value = tag
+        else:
+            continue
+        if key == 'environment':
+            return value
+    return None
+
+
+class _Entry:
+    def __init__(self, handler):
+        self.handler = handler
+        self.leases = 1
+        self.last_used = time.monotonic()
+
+
+class ProjectRegistry:
+    def __init__(self, config, projects=None, max_handlers=8, idle_timeout=None):
+        # Without projects the settings from the environment are the only project, and it handles every event
+        self.projects = OrderedDict()
+        for project in projects or [{}]:
+            key = str(project['unique_identifier']) if 'unique_identifier' in project else None
+            self.projects[key] = {**config, **project}
+            # A symbol index path from the top-level settings or the environment would be shared by every project
+            if len(projects or []) > 1 and 'symbol_index_path' not in project:
+                self.projects[key]['symbol_index_shared'] = True
+        self.max_handlers = max_handlers
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.handlers = OrderedDict()
+        self.single_flight = SingleFlight()
+
+    def find_project(self, event):
+        if None in self.projects:
+            return None
+        project_id = event_project_id(event)
+        if project_id not in self.projects:
+            raise ValueError(f"No project configured for Sentry project {project_id}")
+        return project_id
+
+    def find_project_by_repo(self, repo_name):
+        if len(self.projects) == 1 and not repo_name:
+            return next(iter(self.projects))
+        if not repo_name:
+            raise ValueError("The repo is required when several projects are configured")
+        for key, project in self.projects.items():
+            if project.get('repo') == repo_name:
+                return key
+        raise ValueError(f"No project configured for repository {repo_name}")
+
+    def project_config(self, key):
+        return self.projects[key]
+
+    def handles_environment(self, key, event):
+        environments = self.projects[key].get('environments')
+        return not environments or event_environment(event) in environments
+
+    @contextmanager
+    def lease(self, key):
+        # A leased handler is never evicted, so its git processes stay open until the event is handled
+        handler = self._acquire(key)
+        try:
+            yield handler
+        finally:
+            self._release(key)
+
+    def get_handler(self, key=None):
+        # For callers keeping the handler of a single project, which is never evicted; events lease theirs instead
+        with self.lease(key) as handler:
+            return handler
+
+    def built_handler(self, key):
+        # Returns None instead of building the handler, for callers that only concern handlers already in use
+        with self.lock:
+            entry = self.handlers.get(key)
+            return entry.handler if entry else None
+
+    def close(self):
+        with self.lock:
+            evicted = [(key, entry.handler) for key, entry in self.handlers.items()]
+            self.handlers.clear()
+            PROJECT_HANDLERS.set(value=0)
+        self._close(evicted)
+
+    def _acquire(self, key):
+        while True:
+            with self.lock:
+                entry = self.handlers.get(key)
+                if entry:
+                    entry.leases += 1
+                    self.handlers.move_to_end(key)
+                    return entry.handler
+            # Building a handler opens the repository, so it happens outside the lock and once per project
+            handler, shared = self.single_flight.do(key, lambda: self._create(key))
+            if not shared:
+                return handler
+
+    def _create(self, key):
+        handler = ExceptionHandler(self.projects[key])
+        with self.lock:
+            self.handlers[key] = _Entry(handler)
+            evicted = self._evict()
+            PROJECT_HANDLERS.set(value=len(self.handlers))
+        self._close(evicted)
+        return handler
+
+    def _release(self, key):
+        with self.lock:
+            entry = self.handlers.get(key)
+            # The registry may have been closed while the handler was leased
+            if entry:
+                entry.leases -= 1
+                entry.last_used = time.monotonic()
+            evicted = self._evict()
+            PROJECT_HANDLERS.set(value=len(self.handlers))
+        self._close(evicted)
+
+    def _evict(self):
+        # Idle handlers go least recently used first while there are more than max_handlers, and once they have
+        # been idle for idle_timeout. Busy ones are kept, so the limit can be exceeded while they are in use
+        now = time.monotonic()
+        excess = len(self.handlers) - self.max_handlers
+        evicted = []
+        for key, entry in list(self.handlers.items()):
+            if entry.leases:
+                continue
+            if excess > 0 or (self.idle_timeout is not None and now - entry.last_used > self.idle_timeout):
+                del self.handlers[key]
+                evicted.append((key, entry.handler))
+                excess -= 1
+                PROJECT_HANDLER_EVICTIONS.inc()
+        return evicted
+
+    def _close(self, evicted):
+        # The path index imports GitPython, which the command line doesn't need before it handles an event
+        from exception_handler.index.path_index import release_path_index
+
+        for key, handler in evicted:
+            try:
+                handler.close()
+                release_path_index(self.projects[key].get('local_repo_path'))
+            except Exception as e:
+                print(f"Error closing the handler of project {key}: {str(e)}")
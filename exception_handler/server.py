@@ -0,0 +1,133 @@
+import os
+import signal
+import socket
+import threading
+import time
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+
+class RequestHandler(WSGIRequestHandler):
+    # Applied to every connection socket, so a stalled client can't hold a thread forever
+    timeout = 30
+
+
+class Server:
+    def __init__(self, app, host='0.0.0.0', port=5001, workers=1, request_timeout=30, drain_timeout=120,
+                 init_worker=None, drain_worker=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.request_timeout = request_timeout
+        self.drain_timeout = drain_timeout
+        self.init_worker = init_worker
+        self.drain_worker = drain_worker
+        self.ready = threading.Event()
+        self.draining = threading.Event()
+        self.worker_server = None
+        self.active_requests = 0
+        self.requests_done = threading.Condition()
+
+    def run(self):
+        listener = socket.create_server((self.host, self.port), backlog=128)
+        print(f"Listening on {self.host}:{self.port} with {self.workers} worker(s)")
+        try:
+            if self.workers <= 1:
+                self._run_worker(listener)
+            else:
+                self._run_master(listener)
+        finally:
+            listener.close()
+
+    def _run_master(self, listener):
+        # The master never accepts connections, it forks and supervises the workers.
+        # Each worker builds its own handler, so git processes and HTTP sessions are never shared across a fork
+        children = {}
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for pid in list(children):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        def spawn(index):
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 1
+                try:
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    signal.signal(signal.SIGINT, signal.SIG_DFL)
+                    self._run_worker(listener)
+                    exit_code = 0
+                finally:
+                    os._exit(exit_code)
+            children[pid] = index
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for index in range(self.workers):
+            spawn(index)
+
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = children.pop(pid, None)
+            if index is not None and not stopping:
+                print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+                time.sleep(1)
+                spawn(index)
+
+    def _run_worker(self, listener):
+        RequestHandler.timeout = self.request_timeout
+        self.worker_server = ThreadedWSGIServer(
+            self.host, self.port, self._count_requests, handler=RequestHandler, fd=listener.fileno()
+        )
+        signal.signal(signal.SIGTERM, self._stop_worker)
+        signal.signal(signal.SIGINT, self._stop_worker)
+
+        # The handler is built before the first request is accepted, so readiness means the worker can do real work
+        if self.init_worker:
+            self.init_worker()
+        self.ready.set()
+        self.worker_server.serve_forever()
+
+        # Stopped accepting connections: let in-flight requests and queued fixes finish
+        deadline = time.monotonic() + self.drain_timeout
+        with self.requests_done:
+            drained = self.requests_done.wait_for(lambda: self.active_requests == 0, self.drain_timeout)
+        if self.drain_worker:
+            drained = self.drain_worker(max(0, deadline - time.monotonic())) and drained
+        if not drained:
+            print(f"Worker {os.getpid()} stopped with unfinished work after {self.drain_timeout}s")
+        self.worker_server.server_close()
+
+    def _count_requests(self, environ, start_response):
+        self._track_request(1)
+        try:
+            response = self.app(environ, start_response)
+            try:
+                return [b''.join(response)]
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        finally:
+            self._track_request(-1)
+
+    def _track_request(self, delta):
+        with self.requests_done:
+            self.active_requests += delta
+            self.requests_done.notify_all()
+
+    def _stop_worker(self, signum, frame):
+        if self.draining.is_set():
+            return
+        print(f"Worker {os.getpid()} draining")
+        self.draining.set()
+        # shutdown() waits for serve_forever to return, so it can't run in the signal handler's thread
+        threading.Thread(target=self.worker_server.shutdown, daemon=True).start()
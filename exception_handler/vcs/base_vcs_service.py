@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
 
 class BaseVCSService(ABC):
     def __init__(self, config):
@@ -12,10 +13,27 @@ class BaseVCSService(ABC):
     def get_file_content(self, repo, file_path):
         pass
 
+    def get_file_contents(self, repo, file_paths, release=None):
+        contents = {}
+        for file_path in file_paths:
+            content = self.get_file_content(repo, file_path)
+            if content:
+                contents[file_path] = content
+        return contents
+
     @abstractmethod
     def create_pull_request(self, data, repo_name):
         pass
 
     @abstractmethod
     def pull_request_exists(self, repo_name, issue_id):
-        pass
\ No newline at end of file
+        pass
+
+    def track_api_calls(self):
+        return nullcontext({})
+
+    def notify_push(self, branch):
+        return False
+
+    def close(self):
+        pass
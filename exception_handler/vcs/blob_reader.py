@@ -0,0 +1,143 @@
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+
+# Requests are written before any response is read, so a round trip must fit in the pipe buffer
+MAX_REQUEST_BYTES = 32 * 1024
+
+# Tags, branches and SHAs, but not revision expressions such as ':/message' or 'HEAD@{1}'
+RELEASE_REF_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._/+-]*$')
+
+
+class BlobReader:
+    def __init__(self, repo_path, max_bytes=64 * 1024 * 1024):
+        self.repo_path = repo_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.process = None
+        self.blobs = OrderedDict()
+        self.cached_bytes = 0
+        self.releases = {}
+
+    def resolve_release(self, release):
+        # Sentry releases are usually a tag, a commit SHA or 'package@version', optionally tagged with a 'v' prefix
+        if not release:
+            return None
+        with self.lock:
+            if release in self.releases:
+                return self.releases[release]
+
+        version = release.rpartition('@')[2]
+        candidates = list(dict.fromkeys(
+            name for name in (release, version, f'v{version}') if RELEASE_REF_PATTERN.match(name) and '..' not in name
+        ))
+        objects = self._batch([f'{name}^{{commit}}' for name in candidates])
+        commit = next((sha for sha, _ in objects if sha), None)
+        if commit:
+            # A release always points to the same commit, a missing one may be fetched later
+            with self.lock:
+                self.releases[release] = commit
+        return commit
+
+    def read(self, commit, paths):
+        # Returns {path: bytes} for the paths that exist at the commit, reading all uncached blobs in one round trip
+        contents = {}
+        missing = []
+        with self.lock:
+            for path in paths:
+                key = (commit, path)
+                if key in self.blobs:
+                    self.blobs.move_to_end(key)
+                    if self.blobs[key] is not None:
+                        contents[path] = self.blobs[key]
+                elif '\n' not in path:
+                    missing.append(path)
+
+        missing = list(dict.fromkeys(missing))
+        for path, (_, content) in zip(missing, self._batch([f'{commit}:{path}' for path in missing])):
+            self._store((commit, path), content)
+            if content is not None:
+                contents[path] = content
+        return contents
+
+    def close(self):
+        with self.lock:
+            self._stop()
+
+    def _store(self, key, content):
+        # Files missing at a commit are cached too, a commit's tree never changes
+        # and max_bytes=0 turns the cache off
+        size = len(content) if content else 0
+        if size > self.max_bytes or not self.max_bytes:
+            return
+        with self.lock:
+            old = self.blobs.pop(key, None)
+            self.cached_bytes -= len(old) if old else 0
+            self.blobs[key] = content
+            self.cached_bytes += size
+            while self.cached_bytes > self.max_bytes:
+                _, evicted = self.blobs.popitem(last=False)
+                self.cached_bytes -= len(evicted) if evicted else 0
+
+    def _batch(self, names):
+        # Returns (sha, content) for each object name, (None, None) for the ones that don't exist
+        results = []
+        for chunk in self._chunks(names):
+            with self.lock:
+                try:
+                    results.extend(self._request(chunk))
+                except (OSError, ValueError):
+                    # The process died or its output got out of sync, start a new one and retry once
+                    self._stop()
+                    results.extend(self._request(chunk))
+        return results
+
+    def _chunks(self, names):
+        chunk, size = [], 0
+        for name in names:
+            if chunk and size + len(name) + 1 > MAX_REQUEST_BYTES:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(name)
+            size += len(name) + 1
+        if chunk:
+            yield chunk
+
+    def _request(self, names):
+        process = self._start()
+        process.stdin.write(''.join(f'{name}\n' for name in names).encode('utf-8'))
+        process.stdin.flush()
+
+        results = []
+        for _ in names:
+            header = process.stdout.readline().decode('utf-8', errors='replace').rstrip('\n')
+            if not header:
+                raise ValueError("git cat-file exited")
+            # Unknown names are echoed back, and may contain spaces
+            if header.endswith((' missing', ' ambiguous')):
+                results.append((None, None))
+                continue
+            sha, object_type, size = header.split()
+            content = process.stdout.read(int(size))
+            process.stdout.read(1)
+            results.append((sha, content if object_type == 'blob' else b''))
+        return results
+
+    def _start(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                ['git', 'cat-file', '--batch'], cwd=self.repo_path,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        return self.process
+
+    def _stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+        self.process = None
@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+class BranchIndex:
+    def __init__(self, repo, prefix, ttl=300):
+        self.repo = repo
+        self.prefix = prefix
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.branches = {}
+        self.pull_requests = {}
+        self.refreshed_at = None
+
+    def contains(self, branch_name):
+        with self.lock:
+            if self._is_stale():
+                self._refresh()
+            return branch_name in self.branches
+
+    def pull_request_url(self, branch_name):
+        with self.lock:
+            return self.pull_requests.get(branch_name)
+
+    def add_branch(self, branch_name, sha):
+        with self.lock:
+            self.branches[branch_name] = sha
+
+    def add_pull_request(self, branch_name, pr_url):
+        with self.lock:
+            self.pull_requests[branch_name] = pr_url
+
+    def invalidate(self):
+        with self.lock:
+            self.refreshed_at = None
+
+    def _is_stale(self):
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.ttl
+
+    def _refresh(self):
+        # A single ls-remote restricted to the bot's namespace, however many branches the remote has
+        output = self.repo.git.ls_remote('origin', f'refs/heads/{self.prefix}*')
+        branches = {}
+        for line in output.splitlines():
+            sha, _, ref = line.partition('\t')
+            if ref.startswith('refs/heads/'):
+                branches[ref[len('refs/heads/'):]] = sha
+        self.branches = branches
+        self.pull_requests = {name: url for name, url in self.pull_requests.items() if name in branches}
+        self.refreshed_at = time.monotonic()
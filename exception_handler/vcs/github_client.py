@@ -0,0 +1,136 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from github import Auth, Github
+from exception_handler.metrics import REGISTRY
+
+API_CALL_COUNTERS = ('requests', 'not_modified', 'memo_hits')
+
+API_CALLS = REGISTRY.counter('exception_handler_github_api_calls_total', 'GitHub API requests and avoided requests', ('kind',))
+
+# The counts of the event being handled, shared with the threads it starts through asyncio.to_thread
+_current_counts = contextvars.ContextVar('github_api_calls', default=None)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_github_client(token, **options):
+    # One client per token, so the handlers of all projects share its HTTP connections and memoized objects
+    with _clients_lock:
+        if token not in _clients:
+            _clients[token] = GitHubClient(token, **options)
+        return _clients[token]
+
+
+class ApiCallCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = dict.fromkeys(API_CALL_COUNTERS, 0)
+
+    def increment(self, counter):
+        API_CALLS.inc(counter)
+        counts = _current_counts.get()
+        with self.lock:
+            self.totals[counter] += 1
+            if counts is not None:
+                counts[counter] += 1
+
+    @contextmanager
+    def track(self):
+        counts = dict.fromkeys(API_CALL_COUNTERS, 0)
+        token = _current_counts.set(counts)
+        try:
+            yield counts
+        finally:
+            _current_counts.reset(token)
+
+
+class CountingAuth(Auth.Auth):
+    # PyGithub authenticates every request it sends, which makes this the one place that sees all of them
+    def __init__(self, token, counter):
+        self.inner = Auth.Token(token) if token else None
+        self.counter = counter
+
+    @property
+    def token_type(self):
+        return self.inner.token_type if self.inner else None
+
+    @property
+    def token(self):
+        return self.inner.token if self.inner else None
+
+    def authentication(self, headers):
+        self.counter.increment('requests')
+        if self.inner:
+            self.inner.authentication(headers)
+
+    def mask_authentication(self, headers):
+        if self.inner:
+            self.inner.mask_authentication(headers)
+
+
+class GitHubClient:
+    def __init__(self, token, ttl=60, max_entries=256, pool_size=10):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.api_calls = ApiCallCounter()
+        # PyGithub keeps one requests session per client, pool_size lets concurrent jobs share its connections
+        self.github = Github(auth=CountingAuth(token, self.api_calls), pool_size=pool_size)
+        self.lock = threading.Lock()
+        self.objects = OrderedDict()
+        self.pull_files = OrderedDict()
+
+    def get_repo(self, repo_name):
+        return self._get(('repo', repo_name), lambda: self.github.get_repo(repo_name))
+
+    def get_pull(self, repo_name, pr_number):
+        return self._get(('pull', repo_name, pr_number), lambda: self.get_repo(repo_name).get_pull(pr_number))
+
+    def get_pull_files(self, repo_name, pr_number):
+        pr = self.get_pull(repo_name, pr_number)
+        key = (repo_name, pr_number)
+        with self.lock:
+            cached = self.pull_files.get(key)
+        # The changed files only change with the head commit
+        if cached and cached[0] == pr.head.sha:
+            self.api_calls.increment('memo_hits')
+            return cached[1]
+
+        files = [file.filename for file in pr.get_files()]
+        with self.lock:
+            self._store(self.pull_files, key, (pr.head.sha, files))
+        return files
+
+    def invalidate(self, repo_name, pr_number=None):
+        with self.lock:
+            self.objects.pop(('pull', repo_name, pr_number) if pr_number else ('repo', repo_name), None)
+
+    def _get(self, key, fetch):
+        with self.lock:
+            cached = self.objects.get(key)
+            if cached:
+                self.objects.move_to_end(key)
+
+        if not cached:
+            obj = fetch()
+        elif time.monotonic() - cached[1] < self.ttl:
+            self.api_calls.increment('memo_hits')
+            return cached[0]
+        else:
+            obj = cached[0]
+            # Revalidate with If-None-Match, a 304 does not count against the rate limit
+            if not obj.update():
+                self.api_calls.increment('not_modified')
+
+        with self.lock:
+            self._store(self.objects, key, (obj, time.monotonic()))
+        return obj
+
+    def _store(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
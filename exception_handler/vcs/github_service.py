@@ -1,20 +1,61 @@
+import atexit
 import base64
+import hashlib
 import os
 import tempfile
+import threading
 import json
-from github import Github
+from github import UnknownObjectException
 from git import Repo
 from dotenv import load_dotenv
 from exception_handler.vcs.base_vcs_service import BaseVCSService
+from exception_handler.vcs.worktree_pool import WorktreePool
+from exception_handler.vcs.branch_index import BranchIndex
+from exception_handler.vcs.blob_reader import BlobReader
+from exception_handler.vcs.repo_sync import RepoSync
+from exception_handler.vcs.plumbing import commit_diff
+from exception_handler.vcs.github_client import get_github_client
+from exception_handler.index.symbol_index import SymbolIndex
+from exception_handler.metrics import span, timed
 import re
 
 load_dotenv()
 
+BOT_BRANCH_PREFIX = "fix/exception-bot/"
+COMMIT_MODES = ('plumbing', 'worktree')
+
+HUNK_HEADER = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+PR_CONTEXT_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      title
+      body
+      url
+      headRefName
+      headRefOid
+      baseRefName
+      files(first: 100) {
+        nodes { path }
+        pageInfo { hasNextPage }
+      }
+    }
+  }
+}
+"""
+
 class GitHubService(BaseVCSService):
     def __init__(self, config):
         super().__init__(config)
         self.github_token = os.getenv('GITHUB_ACCESS_TOKEN')
-        self.github = Github(self.github_token)
+        self.client = get_github_client(
+            self.github_token,
+            ttl=int(os.getenv('GITHUB_CACHE_TTL', 60)),
+            max_entries=int(os.getenv('GITHUB_CACHE_MAX_ENTRIES', 256)),
+            pool_size=int(os.getenv('GITHUB_POOL_SIZE', 10))
+        )
+        self.github = self.client.github
         
         self.local_repo_path = self.config['local_repo_path']
         
@@ -22,81 +63,244 @@ class GitHubService(BaseVCSService):
             raise ValueError("LOCAL_REPO_PATH environment variable not set")
         
         self.repo = Repo(self.local_repo_path)
+        # Object reads go through one persistent cat-file process per Repo, which concurrent jobs can't share
+        self.repo_lock = threading.Lock()
+        self.worktree_pool = WorktreePool(
+            self.repo,
+            base_path=os.getenv('WORKTREE_PATH'),
+            max_size=int(os.getenv('WORKTREE_POOL_SIZE', 4)),
+            idle_timeout=int(os.getenv('WORKTREE_IDLE_TIMEOUT', 600))
+        )
+        self.commit_mode = os.getenv('COMMIT_MODE', 'plumbing').lower()
+        if self.commit_mode not in COMMIT_MODES:
+            raise ValueError(f"Unsupported commit mode: {self.commit_mode}")
+        self.source_revision = os.getenv('SOURCE_REVISION', 'release').lower()
+        self.blob_reader = BlobReader(
+            self.local_repo_path, max_bytes=int(os.getenv('BLOB_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        )
+        # Fixes are based on origin's default branch as of the last background fetch, requests only fetch
+        # themselves when it is older than REPO_SYNC_MAX_STALENESS
+        self.repo_sync = RepoSync(
+            self.worktree_pool.fetch,
+            self.config.get('repo') or self.local_repo_path,
+            interval=float(os.getenv('REPO_SYNC_INTERVAL', 60)),
+            max_staleness=float(os.getenv('REPO_SYNC_MAX_STALENESS', 300)),
+            fetch_options=[f"--filter={os.getenv('REPO_SYNC_FILTER')}"] if os.getenv('REPO_SYNC_FILTER') else []
+        )
+        atexit.register(self.close)
+        self.branch_index = BranchIndex(self.repo, BOT_BRANCH_PREFIX, ttl=int(os.getenv('BRANCH_INDEX_TTL', 300)))
+        self.symbol_index = None
+        if os.getenv('SYMBOL_INDEX_ENABLED', 'true').lower() == 'true':
+            repo_key = hashlib.sha1(os.path.abspath(self.local_repo_path).encode('utf-8')).hexdigest()[:12]
+            symbol_index_path = self.config.get('symbol_index_path') or os.getenv('SYMBOL_INDEX_PATH')
+            if not symbol_index_path:
+                symbol_index_path = os.path.join(
+                    os.path.expanduser('~'), '.cache', 'exception-handler', f'symbols-{repo_key}.db'
+                )
+            elif self.config.get('symbol_index_shared'):
+                # Projects sharing one index would each rebuild it for their own repository on every event
+                root, extension = os.path.splitext(symbol_index_path)
+                symbol_index_path = f'{root}-{repo_key}{extension}'
+            self.symbol_index = SymbolIndex(self.repo, symbol_index_path)
+
+    def close(self):
+        # Called at exit, or when the project is evicted so its git processes and worktrees don't outlive it
+        atexit.unregister(self.close)
+        self.repo_sync.close()
+        self.blob_reader.close()
+        self.worktree_pool.close()
+        if self.symbol_index:
+            self.symbol_index.close()
+        with self.repo_lock:
+            self.repo.close()
 
     def get_repo(self, repo_name):
-        return self.github.get_repo(repo_name)
+        return self.client.get_repo(repo_name)
+
+    def notify_push(self, branch):
+        return self.repo_sync.notify(branch)
+
+    def track_api_calls(self):
+        return self.client.api_calls.track()
 
     def get_file_content(self, repo, file_path):
+        return self.get_file_contents(repo, [file_path]).get(file_path)
+
+    def get_file_contents(self, repo, file_paths, release=None):
+        if self.source_revision == 'worktree':
+            return self._read_working_tree(file_paths)
+
+        commit, revision = self.source_commit(repo, release)
+        if commit is None:
+            return self._read_working_tree(file_paths)
+
+        try:
+            return self._decode_blobs(self.blob_reader.read(commit, file_paths), file_paths, revision)
+        except Exception as e:
+            print(f"Error reading files at {revision}: {str(e)}")
+            return self._read_working_tree(file_paths)
+
+    def source_commit(self, repo, release=None):
+        # Files are read at the commit of the event's release, so their lines match the stacktrace, and otherwise at
+        # origin's default branch that fixes are based on. Returns the commit and a name for it, the commit is None
+        # when neither can be resolved
+        commit, revision = None, release
+        if release:
+            try:
+                commit = self.blob_reader.resolve_release(release)
+            except Exception as e:
+                print(f"Error resolving release {release}: {str(e)}")
+            if commit is None:
+                print(f"Release {release} not found in {self.local_repo_path}, reading origin/{repo.default_branch} instead")
+        if commit is None:
+            commit, revision = self.default_commit(repo.default_branch), f'origin/{repo.default_branch}'
+        return commit, revision
+
+    def default_commit(self, default_branch):
+        # The commit of origin's default branch as of the last sync. Nothing updates the working tree of
+        # LOCAL_REPO_PATH, so it is only read when the branch can't be fetched
         try:
-            full_path = os.path.join(self.local_repo_path, file_path)
-            with open(full_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            self.repo_sync.ensure_fresh(default_branch)
+            # rev-parse runs its own process, the Repo's persistent cat-file process is not safe to share across jobs
+            return self.repo.git.rev_parse('--verify', f'refs/remotes/origin/{default_branch}^{{commit}}')
         except Exception as e:
-            print(f"Error reading content for {file_path}: {str(e)}")
+            print(f"Error syncing origin/{default_branch}, reading the working tree instead: {str(e)}")
             return None
 
+    def _read_working_tree(self, file_paths):
+        file_contents = {}
+        for file_path in file_paths:
+            try:
+                with open(os.path.join(self.local_repo_path, file_path), 'r', encoding='utf-8') as file:
+                    file_contents[file_path] = file.read()
+            except Exception as e:
+                print(f"Error reading content for {file_path}: {str(e)}")
+        return file_contents
+
+    def _decode_blobs(self, blobs, file_paths, revision):
+        file_contents = {}
+        for file_path in file_paths:
+            if file_path not in blobs:
+                print(f"Error reading content for {file_path} at {revision}: not found")
+                continue
+            try:
+                file_contents[file_path] = blobs[file_path].decode('utf-8')
+            except UnicodeDecodeError as e:
+                print(f"Error reading content for {file_path} at {revision}: {str(e)}")
+        return file_contents
+
+    @timed('symbol_index')
+    def get_symbol_stubs(self, repo, names, exclude_paths=(), limit=30, release=None):
+        if not self.symbol_index:
+            return []
+        try:
+            # The index follows the commit the trace files were read at, only the files changed since the last
+            # indexed commit are parsed again. That happens in the background, so events get no signatures until
+            # the first build has finished, and may see an index a few commits behind after that
+            commit = None if self.source_revision == 'worktree' else self.source_commit(repo, release)[0]
+            commit = commit or self.repo.git.rev_parse('HEAD')
+            indexed_commit = self.symbol_index.indexed_commit()
+            if indexed_commit != commit:
+                self.symbol_index.update_in_background(commit)
+            if indexed_commit is None:
+                return []
+            return self.symbol_index.find_symbols(names, exclude_paths=exclude_paths, limit=limit)
+        except Exception as e:
+            print(f"Error querying symbol index: {str(e)}")
+            return []
+
+    def prefetch(self, repo_name):
+        # Brings the default branch within the staleness bound ahead of time, so applying a fix doesn't wait for it
+        try:
+            self.repo_sync.ensure_fresh(self.get_repo(repo_name).default_branch)
+        except Exception as e:
+            print(f"Error prefetching {repo_name}: {str(e)}")
+
     def create_pull_request(self, data, repo_name):
         try:
             github_repo = self.get_repo(repo_name)
-            branch_name = f"fix/exception-bot/{data['issue_id']}"
+            branch_name = f"{BOT_BRANCH_PREFIX}{data['issue_id']}"
             commit_message = f"Fix {data['exception_type']} exception"
             pr_title = f"[Exception Bot] Fix for {data['exception_type']} exception"
             pr_body = self._create_pr_body(data, github_repo.full_name)
 
-            self._apply_diff_and_create_pr(github_repo, data['proposed_fix'], branch_name, 
-                                           commit_message, pr_title, pr_body)
-            
-            return {"status": "success", "pr_url": f"https://github.com/{repo_name}/pulls"}
+            return self._apply_diff_and_create_pr(github_repo, data['proposed_fix'], branch_name,
+                                                  commit_message, pr_title, pr_body)
         except Exception as e:
+            # A failed push may mean the remote has branches the index doesn't know about
+            self.branch_index.invalidate()
             return {"status": "error", "message": str(e)}
 
+    @timed('pr_exists')
     def pull_request_exists(self, repo_name, issue_id):
+        branch_name = f"{BOT_BRANCH_PREFIX}{issue_id}"
+        if self.branch_index.pull_request_url(branch_name):
+            return True
         try:
-            repo = self.get_repo(repo_name)
-            branch_name = f"fix/exception-bot/{issue_id}"
-            branches = repo.get_branches()
-            return any(branch.name == branch_name for branch in branches)
+            return self.branch_index.contains(branch_name)
+        except Exception as e:
+            print(f"Error refreshing branch index: {str(e)}")
+
+        # Fall back to a single direct ref lookup through the API
+        try:
+            self.github.get_repo(repo_name, lazy=True).get_git_ref(f"heads/{branch_name}")
+            return True
+        except UnknownObjectException:
+            return False
         except Exception as e:
             print(f"Error checking branches: {str(e)}")
             return False
 
     def _apply_diff_and_create_pr(self, github_repo, diff_content, branch_name, commit_message, pr_title, pr_body):
         default_branch = github_repo.default_branch
-        self.repo.git.checkout(default_branch)
-        self.repo.git.pull('origin', default_branch)
-
-        try:
-            self.repo.git.checkout('-b', branch_name)
-        except Exception as e:
-            print(f"Error creating branch: {e}")
-            return
+        self.repo_sync.ensure_fresh(default_branch)
 
         diff_content = self._clean_diff_content(diff_content)
+        commit_sha = self._commit_diff(f'origin/{default_branch}', diff_content, commit_message)
+        if not commit_sha:
+            return {"status": "error", "message": f"The proposed fix does not apply to origin/{default_branch}"}
+        self._push_commit(commit_sha, branch_name)
 
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.diff', delete=False) as temp_file:
-            temp_file.write(diff_content)
-            temp_file_path = temp_file.name
+        try:
+            with span('create_pr'):
+                pr = github_repo.create_pull(title=pr_title, body=pr_body, head=branch_name, base=default_branch)
+        except Exception as e:
+            print(f"Error creating Pull Request: {e}")
+            return {"status": "error", "message": f"Error creating Pull Request: {e}", "branch": branch_name}
+        self.branch_index.add_pull_request(branch_name, pr.html_url)
+        print(f"Pull Request created: {pr.html_url}")
+        return {"status": "success", "pr_url": pr.html_url}
 
+    @timed('git_apply')
+    def _commit_diff(self, base_ref, diff_content, commit_message):
         try:
-            self.repo.git.apply(temp_file_path)
+            if self.commit_mode == 'worktree':
+                return self._commit_diff_in_worktree(base_ref, diff_content, commit_message)
+            return commit_diff(self.repo, base_ref, diff_content, commit_message, lock=self.repo_lock).hexsha
         except Exception as e:
             print(f"Error applying diff: {e}")
-            os.unlink(temp_file_path)
-            return
-        finally:
-            os.unlink(temp_file_path)
+            return None
 
-        self.repo.git.add(A=True)
-        self.repo.index.commit(commit_message)
+    def _commit_diff_in_worktree(self, base_ref, diff_content, commit_message):
+        with self.worktree_pool.lease() as worktree:
+            worktree.git.checkout('--detach', base_ref)
 
-        origin = self.repo.remote('origin')
-        origin.push(branch_name)
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.diff', delete=False) as temp_file:
+                temp_file.write(diff_content)
+                temp_file_path = temp_file.name
+            try:
+                worktree.git.apply(temp_file_path)
+            finally:
+                os.unlink(temp_file_path)
 
-        try:
-            pr = github_repo.create_pull(title=pr_title, body=pr_body, head=branch_name, base=default_branch)
-            print(f"Pull Request created: {pr.html_url}")
-        except Exception as e:
-            print(f"Error creating Pull Request: {e}")
+            worktree.git.add(A=True)
+            return worktree.index.commit(commit_message).hexsha
+
+    @timed('git_push')
+    def _push_commit(self, commit_sha, branch_name):
+        # The commit is pushed by its SHA, so no branch has to be checked out anywhere
+        self.repo.git.push('origin', f'{commit_sha}:refs/heads/{branch_name}')
+        self.branch_index.add_branch(branch_name, commit_sha)
 
     def _create_pr_body(self, data, repo_full_name):
         issue_link = f"https://github.com/{repo_full_name}/issues/{data['issue_id']}"
@@ -138,66 +342,104 @@ class GitHubService(BaseVCSService):
         return cleaned_diff
 
     def get_pull_request(self, repo_name, pr_number):
-        repo = self.get_repo(repo_name)
-        pr = repo.get_pull(pr_number)
+        pr = self.client.get_pull(repo_name, pr_number)
         return {
             "title": pr.title,
             "body": pr.body,
             "head_branch": pr.head.ref,
             "base_branch": pr.base.ref,
-            "files_changed": [file.filename for file in pr.get_files()]
+            "files_changed": self.client.get_pull_files(repo_name, pr_number)
+        }
+
+    @timed('pr_context')
+    def get_pull_request_context(self, repo_name, pr_number):
+        # Everything the comment flow needs about the PR, in one GraphQL query instead of several REST calls
+        owner, name = repo_name.split('/', 1)
+        _, response = self.github.requester.graphql_query(
+            PR_CONTEXT_QUERY, {"owner": owner, "name": name, "number": pr_number}
+        )
+        pr = response['data']['repository']['pullRequest']
+        if pr['files']['pageInfo']['hasNextPage']:
+            files_changed = self.client.get_pull_files(repo_name, pr_number)
+        else:
+            files_changed = [file['path'] for file in pr['files']['nodes']]
+
+        # The pull ref exists for branches of forks too, so the head commit can always be read locally. The base
+        # branch comes along, the lines the PR changed are found by diffing against it
+        self.worktree_pool.fetch(
+            'origin',
+            f'+refs/pull/{pr_number}/head:refs/remotes/origin/pull/{pr_number}',
+            f"+refs/heads/{pr['baseRefName']}:refs/remotes/origin/{pr['baseRefName']}"
+        )
+        return {
+            "title": pr['title'],
+            "body": pr['body'],
+            "url": pr['url'],
+            "head_branch": pr['headRefName'],
+            "head_sha": pr['headRefOid'],
+            "base_branch": pr['baseRefName'],
+            "files_changed": files_changed
         }
 
+    def get_files_at_revision(self, revision, file_paths):
+        return self._decode_blobs(self.blob_reader.read(revision, file_paths), file_paths, revision)
+
+    def get_changed_lines(self, base_rev, head_rev, file_paths):
+        # Returns {path: [line]} with the first line of every hunk between the merge base and head_rev
+        try:
+            output = self.repo.git.diff('--unified=0', '--no-color', f'{base_rev}...{head_rev}', '--', *file_paths)
+        except Exception as e:
+            print(f"Error diffing {base_rev}...{head_rev}: {str(e)}")
+            return {}
+
+        changed_lines = {}
+        file_path = None
+        for line in output.splitlines():
+            if line.startswith('+++ '):
+                file_path = line[len('+++ b/'):] if line.startswith('+++ b/') else None
+            elif file_path and line.startswith('@@'):
+                match = HUNK_HEADER.match(line)
+                if match:
+                    changed_lines.setdefault(file_path, []).append(max(1, int(match.group(1))))
+        return changed_lines
+
+    def get_diff(self, old_rev, new_rev, file_paths):
+        try:
+            return self.repo.git.diff('--no-color', old_rev, new_rev, '--', *file_paths)
+        except Exception as e:
+            # The old head is gone after a force push
+            print(f"Error diffing {old_rev}..{new_rev}: {str(e)}")
+            return ""
+
     def update_pull_request(self, repo_name, pr_number, updated_analysis):
-        repo = self.get_repo(repo_name)
-        pr = repo.get_pull(pr_number)
+        pr = self.client.get_pull(repo_name, pr_number)
         branch_name = pr.head.ref
 
         # Apply the new changes
-        self._apply_diff_and_update_branch(repo, updated_analysis['analysis']['diff'], branch_name)
+        self._apply_diff_and_update_branch(updated_analysis['analysis']['diff'], branch_name)
 
         # Update PR description
         pr.edit(body=self._create_updated_pr_body(pr.body, updated_analysis['analysis']['analysis']))
 
         return {"status": "success", "pr_url": pr.html_url}
 
-    def _apply_diff_and_update_branch(self, repo, diff_content, branch_name):
-        # Fetch the latest changes from the remote
-        self.repo.git.fetch('origin')
-
-        try:
-            # Try to check out the branch
-            self.repo.git.checkout(branch_name)
-        except Exception as e:
-            print(f"Error checking out branch {branch_name}: {e}")
-            # If the branch doesn't exist locally, create it
-            self.repo.git.checkout('-b', branch_name, f'origin/{branch_name}')
-
-        # Pull the latest changes
-        self.repo.git.pull('origin', branch_name)
+    def _apply_diff_and_update_branch(self, diff_content, branch_name, base_rev=None):
+        # The head commit of the PR context was fetched with it, otherwise the branch is fetched now
+        if not base_rev:
+            self.worktree_pool.fetch('origin', f'+refs/heads/{branch_name}:refs/remotes/origin/{branch_name}')
+            base_rev = f'origin/{branch_name}'
 
         diff_content = self._clean_diff_content(diff_content)
-
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.diff', delete=False) as temp_file:
-            temp_file.write(diff_content)
-            temp_file_path = temp_file.name
-
-        try:
-            self.repo.git.apply(temp_file_path)
-        except Exception as e:
-            print(f"Error applying diff: {e}")
-            os.unlink(temp_file_path)
-            return
-        finally:
-            os.unlink(temp_file_path)
-
-        self.repo.git.add(A=True)
-        self.repo.index.commit("Update fix based on PR comment")
-
-        origin = self.repo.remote('origin')
-        origin.push(branch_name)
+        commit_sha = self._commit_diff(base_rev, diff_content, "Update fix based on PR comment")
+        if not commit_sha:
+            return None
+        self._push_commit(commit_sha, branch_name)
+        return commit_sha
 
     def _create_updated_pr_body(self, original_body, new_analysis):
+        # Only the latest updated analysis is kept, so the body doesn't grow with every update
+        original_body = original_body.split("\n\n---\n\nUpdated Analysis:\n", 1)[0]
+
         # Preserve the GitHub Issue link if it exists in the original body
         issue_link_match = re.search(r'GitHub Issue: (https://github\.com/.*?/issues/\d+)', original_body)
         issue_link = issue_link_match.group(1) if issue_link_match else ""
@@ -209,19 +451,23 @@ class GitHubService(BaseVCSService):
 
         return updated_body
 
-    def add_pr_comment(self, repo_name, pr_number, comment_body, analysis):
+    def add_pr_comment(self, repo_name, pr_number, comment_body, analysis, pr_context=None):
         try:
-            repo = self.get_repo(repo_name)
-            pr = repo.get_pull(pr_number)
+            pr_context = pr_context or self.get_pull_request_context(repo_name, pr_number)
             # Apply the diff to the branch
-            self._apply_diff_and_update_branch(repo, analysis['diff'], pr.head.ref)
-            # Create the comment
-            comment = pr.create_issue_comment(comment_body)
+            head_sha = self._apply_diff_and_update_branch(
+                analysis['diff'], pr_context['head_branch'], base_rev=pr_context.get('head_sha')
+            )
+            # Create the comment, the lazy issue only needs its URL so nothing is fetched first
+            issue = self.github.get_repo(repo_name, lazy=True).get_issue(pr_number)
+            with span('post_comment'):
+                comment = issue.create_comment(comment_body)
             
             return {
                 "status": "success",
                 "comment_url": comment.html_url,
-                "pr_url": pr.html_url
+                "pr_url": pr_context['url'],
+                "head_sha": head_sha
             }
         except Exception as e:
             return {"status": "error", "message": str(e)}
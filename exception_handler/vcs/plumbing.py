@@ -0,0 +1,31 @@
+import os
+import tempfile
+from contextlib import nullcontext
+from git import Commit, Tree
+from gitdb.util import hex_to_bin
+
+
+def commit_diff(repo, base_rev, diff_content, commit_message, lock=None):
+    # Builds the commit in a throwaway index, so neither the working tree nor the repository's index is touched.
+    # Reading and writing objects goes through the Repo's persistent cat-file process, callers sharing the Repo
+    # between threads pass the lock that guards it. read-tree, apply and write-tree run in their own processes
+    lock = lock or nullcontext()
+    with lock:
+        base_commit = repo.commit(base_rev)
+        base_tree_sha = base_commit.tree.hexsha
+    with tempfile.TemporaryDirectory(prefix='exception-bot-') as temp_dir:
+        env = {'GIT_INDEX_FILE': os.path.join(temp_dir, 'index')}
+        diff_path = os.path.join(temp_dir, 'fix.diff')
+        with open(diff_path, 'w') as diff_file:
+            diff_file.write(diff_content)
+
+        repo.git.read_tree(base_commit.hexsha, env=env)
+        # Only the blobs touched by the diff are read and written
+        repo.git.apply('--cached', diff_path, env=env)
+        tree_sha = repo.git.write_tree(env=env)
+
+    if tree_sha == base_tree_sha:
+        raise ValueError("The diff does not change any file")
+    with lock:
+        tree = Tree(repo, hex_to_bin(tree_sha))
+        return Commit.create_from_tree(repo, tree, commit_message, parent_commits=[base_commit], head=False)
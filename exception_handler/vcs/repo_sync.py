@@ -0,0 +1,99 @@
+import threading
+import time
+from exception_handler.cache.single_flight import SingleFlight
+from exception_handler.metrics import REGISTRY
+
+REPO_LAST_SYNC = REGISTRY.gauge(
+    'exception_handler_repo_last_sync_timestamp_seconds', 'Unix time a branch was last fetched from origin', ('repo', 'branch')
+)
+REPO_SYNC_LAG = REGISTRY.elapsed_gauge(
+    'exception_handler_repo_sync_lag_seconds', 'Seconds since a branch was last fetched', ('repo', 'branch')
+)
+REPO_SYNC_ERRORS = REGISTRY.counter('exception_handler_repo_sync_errors_total', 'Background fetches that failed', ('repo',))
+REPO_SYNC_BLOCKING = REGISTRY.counter(
+    'exception_handler_repo_sync_blocking_total', 'Requests that fetched because their branch was older than the staleness bound',
+    ('repo',)
+)
+
+
+class RepoSync:
+    def __init__(self, fetch, name, interval=60, max_staleness=300, fetch_options=()):
+        # Keeps origin/<branch> of the branches requests asked for fresh in the background. fetch is called with
+        # the git fetch arguments, and requests only wait for it when their branch is older than max_staleness
+        self.fetch = fetch
+        self.name = name
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.fetch_options = tuple(fetch_options)
+        self.lock = threading.Lock()
+        self.synced = {}
+        self.single_flight = SingleFlight()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def synced_at(self, branch):
+        # Unix time of the last fetch of the branch, None if it was never fetched
+        with self.lock:
+            synced = self.synced.get(branch)
+        return synced[1] if synced else None
+
+    def ensure_fresh(self, branch):
+        with self.lock:
+            synced = self.synced.setdefault(branch, None)
+        self._start()
+        if synced and time.monotonic() - synced[0] <= self.max_staleness:
+            return
+        REPO_SYNC_BLOCKING.inc(self.name)
+        # Requests waiting for the same branch share one fetch
+        self.single_flight.do(branch, lambda: self._sync([branch]))
+
+    def notify(self, branch):
+        # Called on a push to origin, the next background fetch starts right away instead of after the interval.
+        # Only branches requests have asked for are fetched, pushes to other branches are ignored
+        with self.lock:
+            if branch not in self.synced:
+                return False
+        self.wakeup.set()
+        return True
+
+    def close(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+
+    def _start(self):
+        # Started by the first request, so a forking server starts one per worker
+        with self.lock:
+            if self.thread or self.interval <= 0 or self.stopped.is_set():
+                return
+            self.thread = threading.Thread(target=self._run, name=f'repo-sync-{self.name}', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                return
+            with self.lock:
+                branches = list(self.synced)
+            if not branches:
+                continue
+            try:
+                self._sync(branches)
+            except Exception as e:
+                REPO_SYNC_ERRORS.inc(self.name)
+                print(f"Error syncing {self.name}: {str(e)}")
+
+    def _sync(self, branches):
+        # One fetch for all the branches, it only downloads the objects that aren't local yet
+        self.fetch(*self.fetch_options, 'origin', *(f'+refs/heads/{branch}:refs/remotes/origin/{branch}' for branch in branches))
+        synced = (time.monotonic(), time.time())
+        with self.lock:
+            for branch in branches:
+                self.synced[branch] = synced
+        for branch in branches:
+            REPO_LAST_SYNC.set(self.name, branch, value=synced[1])
+            REPO_SYNC_LAG.set(self.name, branch, value=synced[0])
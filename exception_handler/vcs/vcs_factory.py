@@ -1,8 +1,8 @@
-from exception_handler.vcs.github_service import GitHubService
+from exception_handler.plugins import load
 
 def get_vcs_service(config):
     vcs_type = config.get('vcs_type', 'github').lower()
-    if vcs_type == 'github':
-        return GitHubService(config)
-    else:
-        raise ValueError(f"Unsupported VCS type: {vcs_type}")
\ No newline at end of file
+    vcs_class = load('vcs', vcs_type)
+    if vcs_class is None:
+        raise ValueError(f"Unsupported VCS type: {vcs_type}")
+    return vcs_class(config)
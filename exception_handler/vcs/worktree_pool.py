@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from git import Repo
+from exception_handler.metrics import timed
+
+
+class WorktreePool:
+    def __init__(self, repo, base_path=None, max_size=4, idle_timeout=600):
+        self.repo = repo
+        self.base_path = base_path or tempfile.mkdtemp(prefix='exception-bot-worktrees-')
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.semaphore = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.git_lock = threading.Lock()
+        self.idle_worktrees = []
+        os.makedirs(self.base_path, exist_ok=True)
+        self.repo.git.worktree('prune')
+
+    @contextmanager
+    def lease(self):
+        self.semaphore.acquire()
+        try:
+            path = self._acquire_worktree()
+            try:
+                yield Repo(path)
+            finally:
+                self._release_worktree(path)
+        finally:
+            self.semaphore.release()
+
+    @timed('git_fetch')
+    def fetch(self, *args):
+        # Fetching and adding/removing worktrees write to the shared .git directory, so they are serialized
+        with self.git_lock:
+            self.repo.git.fetch(*args)
+
+    def close(self):
+        with self.lock:
+            idle_worktrees, self.idle_worktrees = self.idle_worktrees, []
+        for path, _ in idle_worktrees:
+            self._remove_worktree(path)
+
+    def _acquire_worktree(self):
+        self._evict_idle_worktrees()
+        with self.lock:
+            if self.idle_worktrees:
+                path, _ = self.idle_worktrees.pop()
+                return path
+        path = os.path.join(self.base_path, uuid.uuid4().hex)
+        with self.git_lock:
+            self.repo.git.worktree('add', '--detach', path)
+        return path
+
+    def _release_worktree(self, path):
+        try:
+            worktree = Repo(path)
+            worktree.git.reset('--hard')
+            worktree.git.clean('-fdx')
+        except Exception as e:
+            print(f"Error resetting worktree {path}: {e}")
+            self._remove_worktree(path)
+            return
+        with self.lock:
+            self.idle_worktrees.append((path, time.monotonic()))
+        self._evict_idle_worktrees()
+
+    def _evict_idle_worktrees(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [path for path, last_used in self.idle_worktrees if now - last_used > self.idle_timeout]
+            self.idle_worktrees = [(path, last_used) for path, last_used in self.idle_worktrees if path not in expired]
+        for path in expired:
+            self._remove_worktree(path)
+
+    def _remove_worktree(self, path):
+        try:
+            with self.git_lock:
+                self.repo.git.worktree('remove', '--force', path)
+        except Exception as e:
+            print(f"Error removing worktree {path}: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            self.repo.git.worktree('prune')
@@ -0,0 +1,91 @@
+import os
+import threading
+from types import SimpleNamespace
+import pytest
+from git import Repo
+
+DEFAULT_BRANCH = 'main'
+
+CACHE_MODULE = '''class Cache:
+    def __init__(self, client):
+        self.client = client
+
+    def fetch(self, key, default=None):
+        return self.client.get(key, default)
+'''
+
+
+class FakeGitHubRepo:
+    full_name = 'test/repo'
+    default_branch = DEFAULT_BRANCH
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pulls = []
+
+    def create_pull(self, title, body, head, base):
+        with self.lock:
+            self.pulls.append({"title": title, "head": head, "base": base})
+            return SimpleNamespace(html_url=f"https://github.com/{self.full_name}/pull/{len(self.pulls)}")
+
+
+def commit_file(repo, path, content, message):
+    full_path = os.path.join(repo.working_tree_dir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w') as file:
+        file.write(content)
+    repo.git.add(path)
+    repo.git.commit('-m', message, '--no-verify')
+    return repo.head.commit.hexsha
+
+
+def push_to_origin(origin, work_dir, path, content, message='Change on origin'):
+    # Another developer pushes to the default branch, LOCAL_REPO_PATH doesn't see it until it fetches
+    clone_path = os.path.join(work_dir, f'developer-{len(os.listdir(work_dir))}')
+    developer = Repo.clone_from(origin.git_dir, clone_path, branch=DEFAULT_BRANCH)
+    sha = commit_file(developer, path, content, message)
+    developer.git.push('origin', f'HEAD:refs/heads/{DEFAULT_BRANCH}')
+    developer.close()
+    return sha
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    for variable, value in (('NAME', 'Test'), ('EMAIL', 'test@example.com')):
+        monkeypatch.setenv(f'GIT_AUTHOR_{variable}', value)
+        monkeypatch.setenv(f'GIT_COMMITTER_{variable}', value)
+
+
+@pytest.fixture
+def origin(tmp_path):
+    # A bare repository stands in for GitHub, LOCAL_REPO_PATH is a clone of it
+    seed = Repo.init(tmp_path / 'seed', initial_branch=DEFAULT_BRANCH)
+    commit_file(seed, 'app/cache.py', CACHE_MODULE, 'Add the cache')
+    origin = Repo.init(tmp_path / 'origin.git', bare=True, initial_branch=DEFAULT_BRANCH)
+    seed.git.push(str(tmp_path / 'origin.git'), f'{DEFAULT_BRANCH}:refs/heads/{DEFAULT_BRANCH}')
+    seed.close()
+    yield origin
+    origin.close()
+
+
+@pytest.fixture
+def local_repo(origin, tmp_path):
+    repo = Repo.clone_from(origin.git_dir, tmp_path / 'local', branch=DEFAULT_BRANCH)
+    yield repo
+    repo.close()
+
+
+@pytest.fixture
+def github_service(local_repo, tmp_path, monkeypatch):
+    monkeypatch.setenv('SYMBOL_INDEX_PATH', str(tmp_path / 'symbols.db'))
+    monkeypatch.setenv('WORKTREE_PATH', str(tmp_path / 'worktrees'))
+    # Every read fetches, so the tests don't depend on the background sync
+    monkeypatch.setenv('REPO_SYNC_INTERVAL', '0')
+    monkeypatch.setenv('REPO_SYNC_MAX_STALENESS', '0')
+    from exception_handler.vcs.github_service import GitHubService
+
+    service = GitHubService({'repo': FakeGitHubRepo.full_name, 'local_repo_path': local_repo.working_tree_dir})
+    github_repo = FakeGitHubRepo()
+    service.get_repo = lambda repo_name: github_repo
+    yield service
+    service.close()
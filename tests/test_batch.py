@@ -0,0 +1,47 @@
+import json
+from exception_handler.batch import run_batch
+
+
+def process_event(event, github_issue_id):
+    return {"status": "success", "issue": github_issue_id}, 200
+
+
+def read_results(output_path):
+    with open(output_path) as output_file:
+        return [json.loads(line) for line in output_file]
+
+
+def test_invalid_lines_are_reported_and_the_batch_continues(tmp_path):
+    source = tmp_path / 'events.jsonl'
+    source.write_text(
+        json.dumps({"event_id": "a", "issue_id": 1}) + "\n"
+        '{"event_id": "b", \n'
+        '["not", "an", "event"]\n'
+        + json.dumps({"github_issue_id": 4, "event": {"event_id": "d"}}) + "\n"
+    )
+    output_path = tmp_path / 'results.jsonl'
+    checkpoint_path = tmp_path / 'checkpoint'
+
+    counts = run_batch(process_event, str(source), str(output_path), checkpoint_path=str(checkpoint_path))
+
+    assert counts == {"processed": 2, "failed": 2, "skipped": 0}
+    results = {result['key']: result for result in read_results(output_path)}
+    assert results['a']['status_code'] == 200 and results['d']['result']['issue'] == 4
+    assert results['line-2']['status_code'] == 400 and 'Invalid record line-2' in results['line-2']['result']['error']
+    assert results['line-3']['status_code'] == 400
+    # Only processed events are checkpointed, a fixed record is picked up by the next run
+    assert sorted(checkpoint_path.read_text().split()) == ['a', 'd']
+
+
+def test_invalid_files_are_reported_and_the_batch_continues(tmp_path):
+    source = tmp_path / 'events'
+    source.mkdir()
+    (source / '1.json').write_text(json.dumps({"event_id": "a", "issue_id": 1}))
+    (source / '2.json').write_text('{"event_id": ')
+    (source / '3.json').write_bytes(b'\xff\xfe')
+    output_path = tmp_path / 'results.jsonl'
+
+    counts = run_batch(process_event, str(source), str(output_path))
+
+    assert counts == {"processed": 1, "failed": 2, "skipped": 0}
+    assert sorted(result['key'] for result in read_results(output_path)) == ['2.json', '3.json', 'a']
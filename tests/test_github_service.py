@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from git import Repo
+from conftest import CACHE_MODULE, DEFAULT_BRANCH, push_to_origin
+
+
+def new_file_diff(path, line):
+    return (
+        f"diff --git a/{path} b/{path}\n"
+        "new file mode 100644\n"
+        "--- /dev/null\n"
+        f"+++ b/{path}\n"
+        "@@ -0,0 +1 @@\n"
+        f"+{line}\n"
+    )
+
+
+def fix_data(issue_id, diff):
+    return {
+        'proposed_fix': diff, 'exception_type': 'KeyError', 'exception_value': "'item'", 'event_id': f'event-{issue_id}',
+        'issue_id': issue_id, 'sentry_url': 'N/A', 'analysis': 'Simulated analysis', 'affected_files': ['app/cache.py']
+    }
+
+
+@pytest.mark.parametrize('commit_mode', ['plumbing', 'worktree'])
+def test_pull_requests_are_created_in_parallel(github_service, origin, commit_mode):
+    github_service.commit_mode = commit_mode
+    base = origin.git.rev_parse(DEFAULT_BRANCH)
+    issue_ids = list(range(1, 9))
+
+    with ThreadPoolExecutor(max_workers=len(issue_ids)) as executor:
+        results = list(executor.map(
+            lambda issue_id: github_service.create_pull_request(
+                fix_data(issue_id, new_file_diff(f'fixes/fix_{issue_id}.py', f'FIX = {issue_id}')), 'test/repo'
+            ),
+            issue_ids
+        ))
+
+    assert [result['status'] for result in results] == ['success'] * len(issue_ids)
+    assert sorted(result['pr_url'] for result in results) == sorted(
+        f'https://github.com/test/repo/pull/{number}' for number in issue_ids
+    )
+    for issue_id in issue_ids:
+        branch = f'fix/exception-bot/{issue_id}'
+        # Each branch holds only its own fix, on top of origin's default branch
+        assert origin.git.show(f'{branch}:fixes/fix_{issue_id}.py') == f'FIX = {issue_id}'
+        assert origin.git.rev_parse(f'{branch}^') == base
+        assert origin.git.diff('--name-only', base, branch) == f'fixes/fix_{issue_id}.py'
+    assert sorted(pull['head'] for pull in github_service.get_repo('test/repo').pulls) == sorted(
+        f'fix/exception-bot/{issue_id}' for issue_id in issue_ids
+    )
+
+
+def test_files_are_read_at_origin_default_branch(github_service, origin, local_repo, tmp_path):
+    updated = CACHE_MODULE + '\n    def clear(self):\n        self.client.clear()\n'
+    push_to_origin(origin, tmp_path, 'app/cache.py', updated)
+    github_repo = github_service.get_repo('test/repo')
+
+    # The working tree of LOCAL_REPO_PATH is never updated, the files come from the fetched default branch
+    assert github_service.get_file_contents(github_repo, ['app/cache.py']) == {'app/cache.py': updated}
+    assert github_service.get_file_content(github_repo, 'app/cache.py') == updated
+    with open(f'{local_repo.working_tree_dir}/app/cache.py') as working_tree_file:
+        assert working_tree_file.read() == CACHE_MODULE
+
+
+def test_fixes_are_based_on_origin_default_branch(github_service, origin, tmp_path):
+    head = push_to_origin(origin, tmp_path, 'app/settings.py', 'TIMEOUT = 5\n')
+
+    result = github_service.create_pull_request(fix_data(1, new_file_diff('fixes/fix_1.py', 'FIX = 1')), 'test/repo')
+
+    assert result['status'] == 'success'
+    assert origin.git.rev_parse('fix/exception-bot/1^') == head
+
+
+def test_diff_that_does_not_apply_is_an_error(github_service, origin):
+    diff = (
+        "diff --git a/app/cache.py b/app/cache.py\n"
+        "--- a/app/cache.py\n"
+        "+++ b/app/cache.py\n"
+        "@@ -1,2 +1,2 @@\n"
+        "-class Store:\n"
+        "+class Cache:\n"
+        "     def __init__(self, client):\n"
+    )
+
+    result = github_service.create_pull_request(fix_data(1, diff), 'test/repo')
+
+    assert result['status'] == 'error'
+    assert 'pr_url' not in result
+    assert github_service.get_repo('test/repo').pulls == []
+    assert 'fix/exception-bot/1' not in origin.git.branch('--list')
+
+
+def test_failed_pull_request_is_an_error(github_service):
+    github_repo = github_service.get_repo('test/repo')
+
+    def create_pull(title, body, head, base):
+        raise RuntimeError('Validation Failed')
+    github_repo.create_pull = create_pull
+
+    result = github_service.create_pull_request(fix_data(1, new_file_diff('fixes/fix_1.py', 'FIX = 1')), 'test/repo')
+
+    assert result['status'] == 'error'
+    assert 'Validation Failed' in result['message']
+    assert 'pr_url' not in result
+
+
+def test_symbol_index_follows_origin_default_branch(github_service, origin, tmp_path):
+    github_repo = github_service.get_repo('test/repo')
+    # The index is built in the background, there are no signatures until the first build has finished
+    assert github_service.get_symbol_stubs(github_repo, {'Cache'}) == []
+    assert github_service.symbol_index.wait(timeout=10)
+    assert github_service.get_symbol_stubs(github_repo, {'Cache'}) != []
+    assert github_service.get_symbol_stubs(github_repo, {'retry'}) == []
+
+    push_to_origin(origin, tmp_path, 'app/retry.py', 'def retry(call, attempts=3):\n    return call()\n')
+
+    github_service.get_symbol_stubs(github_repo, {'retry'})
+    assert github_service.symbol_index.wait(timeout=10)
+    assert github_service.get_symbol_stubs(github_repo, {'retry'}) == [{
+        'path': 'app/retry.py', 'qualname': 'retry', 'kind': 'function', 'lineno': 1,
+        'stub': 'def retry(call, attempts=3): ...'
+    }]
+
+
+def test_pull_request_context_comes_from_one_graphql_query(github_service, origin, local_repo, monkeypatch, tmp_path):
+    head = push_to_origin(origin, tmp_path, 'app/cache.py', CACHE_MODULE + '\nTTL = 60\n')
+    # The change only stays on the pull ref GitHub keeps for every PR, the default branch is moved back
+    origin.git.update_ref('refs/pull/7/head', head)
+    origin.git.update_ref(f'refs/heads/{DEFAULT_BRANCH}', f'{head}^')
+    queries = []
+
+    def graphql_query(query, variables):
+        queries.append(variables)
+        return {}, {"data": {"repository": {"pullRequest": {
+            "title": "Cache entries expire", "body": "Adds a TTL", "url": "https://github.com/test/repo/pull/7",
+            "headRefName": "feature/ttl", "headRefOid": head, "baseRefName": DEFAULT_BRANCH,
+            "files": {"pageInfo": {"hasNextPage": False}, "nodes": [{"path": "app/cache.py"}]}
+        }}}}
+    monkeypatch.setattr(github_service.github.requester, 'graphql_query', graphql_query)
+
+    context = github_service.get_pull_request_context('test/repo', 7)
+
+    assert queries == [{"owner": "test", "name": "repo", "number": 7}]
+    assert context == {
+        "title": "Cache entries expire", "body": "Adds a TTL", "url": "https://github.com/test/repo/pull/7",
+        "head_branch": "feature/ttl", "head_sha": head, "base_branch": DEFAULT_BRANCH, "files_changed": ["app/cache.py"]
+    }
+    # The head commit is fetched through the pull ref, so it can be read without checking the branch out
+    assert local_repo.git.rev_parse('refs/remotes/origin/pull/7') == head
+    assert github_service.get_files_at_revision(head, ['app/cache.py'])['app/cache.py'].endswith('TTL = 60\n')
+
+
+def test_unknown_commit_mode_is_rejected(local_repo, monkeypatch):
+    monkeypatch.setenv('COMMIT_MODE', 'checkout')
+    from exception_handler.vcs.github_service import GitHubService
+
+    with pytest.raises(ValueError, match='Unsupported commit mode: checkout'):
+        GitHubService({'repo': 'test/repo', 'local_repo_path': local_repo.working_tree_dir})
+
+
+def test_projects_get_their_own_symbol_index(origin, local_repo, tmp_path, monkeypatch):
+    monkeypatch.setenv('SYMBOL_INDEX_PATH', str(tmp_path / 'symbols.db'))
+    monkeypatch.setenv('WORKTREE_PATH', str(tmp_path / 'worktrees'))
+    other_repo = Repo.clone_from(origin.git_dir, tmp_path / 'other', branch=DEFAULT_BRANCH)
+    from exception_handler.projects import ProjectRegistry
+    from exception_handler.vcs.github_service import GitHubService
+
+    registry = ProjectRegistry({'repo': 'test/repo'}, [
+        {'unique_identifier': 1, 'local_repo_path': local_repo.working_tree_dir},
+        {'unique_identifier': 2, 'local_repo_path': other_repo.working_tree_dir},
+        {
+            'unique_identifier': 3, 'local_repo_path': other_repo.working_tree_dir,
+            'symbol_index_path': str(tmp_path / 'own.db')
+        }
+    ])
+    services = [GitHubService(registry.project_config(key)) for key in ('1', '2', '3')]
+    try:
+        paths = [service.symbol_index.path for service in services]
+        assert paths[0] != paths[1]
+        assert all(path.startswith(str(tmp_path / 'symbols-')) for path in paths[:2])
+        assert paths[2] == str(tmp_path / 'own.db')
+    finally:
+        for service in services:
+            service.close()
+        other_repo.close()
@@ -0,0 +1,72 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from langchain_core.messages import AIMessage
+from conftest import FakeGitHubRepo
+from exception_handler.ai.base_llm_service import BaseLLMService
+
+
+class LoopBoundChatModel:
+    # Like the HTTP pool of the provider clients, the connections belong to the loop of the first call
+    def __init__(self):
+        self.loop = None
+        self.calls = 0
+
+    def invoke(self, prompt_text):
+        raise AssertionError("Events are analyzed with the async client")
+
+    async def ainvoke(self, prompt_text):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        elif self.loop is not loop or self.loop.is_closed():
+            raise RuntimeError('Event loop is closed')
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        path = f"fixes/fix_{self.calls}.py"
+        diff = f"diff --git a/{path} b/{path}\nnew file mode 100644\n--- /dev/null\n+++ b/{path}\n@@ -0,0 +1 @@\n+FIXED = True\n"
+        return AIMessage(content=json.dumps({"diff": diff, "analysis": "Use get"}))
+
+
+class LoopBoundLLMService(BaseLLMService):
+    model_name = "loop-bound"
+
+    def _initialize_llm(self):
+        self.llm = LoopBoundChatModel()
+
+    async def _generate_fix_async(self, prompt):
+        return self._parse_response(*await self._ainvoke_llm(prompt.to_string()))
+
+
+def processed_event(issue_id):
+    return {
+        'event_id': f'event-{issue_id}', 'release': None,
+        'exception': {'type': f'Error{issue_id}', 'value': "'item'", 'module': 'app.cache'},
+        'stacktrace': [{'filename': 'app/cache.py', 'lineno': 6, 'function': 'fetch',
+                        'context_line': 'return self.client.get(key, default)', 'in_app': True}],
+        'context': {'request': {}, 'user': {}}
+    }
+
+
+@pytest.fixture
+def handler(local_repo, tmp_path, monkeypatch):
+    for variable in ('SYMBOL_INDEX_PATH', 'RESULT_STORE_PATH', 'CONVERSATION_STORE_PATH', 'WORKTREE_PATH'):
+        monkeypatch.setenv(variable, str(tmp_path / variable.lower()))
+    from exception_handler.handler import ExceptionHandler
+
+    handler = ExceptionHandler({'repo': FakeGitHubRepo.full_name, 'local_repo_path': local_repo.working_tree_dir})
+    github_repo = FakeGitHubRepo()
+    handler.vcs_service.get_repo = lambda repo_name: github_repo
+    handler.ai_service = LoopBoundLLMService({})
+    yield handler
+    handler.close()
+
+
+def test_concurrent_events_share_one_event_loop(handler):
+    # Thread workers of the job queue and batch runs call the synchronous entry point at the same time
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda issue_id: handler.handle_exception(processed_event(issue_id), issue_id), range(1, 9)))
+
+    assert [result['vcs_response']['status'] for result in results] == ['success'] * 8
+    assert handler.ai_service.llm.calls == 8
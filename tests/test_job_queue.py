@@ -0,0 +1,62 @@
+import threading
+import time
+from exception_handler.job_queue import CoalescingJobQueue
+
+DEBOUNCE = 0.05
+
+
+def recording_handler(calls):
+    def handle(items):
+        calls.append(items)
+        return {"handled": len(items)}, 200
+    return handle
+
+
+def test_comments_within_one_window_are_handled_together():
+    calls = []
+    job_queue = CoalescingJobQueue(recording_handler(calls), debounce=DEBOUNCE)
+
+    job_ids = [job_queue.submit('test/repo#7', f'comment {i}') for i in range(3)]
+
+    assert job_queue.drain(timeout=5)
+    assert calls == [['comment 0', 'comment 1', 'comment 2']]
+    assert [job_queue.get_job(job_id)['result'] for job_id in job_ids] == [{"handled": 3}] * 3
+
+
+def test_batch_due_while_previous_one_runs_waits_and_absorbs_late_comments():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def handle(items):
+        calls.append(items)
+        started.set()
+        release.wait(5)
+        return {"handled": len(items)}, 200
+
+    job_queue = CoalescingJobQueue(handle, debounce=DEBOUNCE)
+    job_queue.submit('test/repo#7', 'first')
+    assert started.wait(5)
+
+    job_queue.submit('test/repo#7', 'second')
+    # The second window closes while the first batch is still running
+    time.sleep(DEBOUNCE * 4)
+    assert calls == [['first']]
+    job_queue.submit('test/repo#7', 'late')
+
+    release.set()
+    assert job_queue.drain(timeout=5)
+    assert calls == [['first'], ['second', 'late']]
+
+
+def test_drain_waits_for_open_windows():
+    calls = []
+    job_queue = CoalescingJobQueue(recording_handler(calls), debounce=DEBOUNCE * 4)
+
+    job_id = job_queue.submit('test/repo#7', 'comment')
+
+    assert not job_queue.drain(timeout=DEBOUNCE)
+    assert job_queue.get_job(job_id)['status'] == 'queued'
+    assert job_queue.drain(timeout=5)
+    assert calls == [['comment']]
+    assert job_queue.get_job(job_id)['status'] == 'finished'
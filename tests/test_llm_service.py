@@ -0,0 +1,55 @@
+import asyncio
+import json
+import pytest
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage
+from exception_handler.ai.gemini_analysis_service import GeminiAnalysisService
+
+EXCEPTION_DATA = {
+    'exception': {'type': 'KeyError', 'value': "'item'", 'module': 'app.cache'},
+    'stacktrace': [{'filename': 'app/cache.py', 'lineno': 6, 'function': 'fetch', 'context_line': 'return self.client[key]'}],
+    'context': {'request': {}, 'user': {}}
+}
+TRACE_FILES = {'app/cache.py': 'class Cache:\n    def fetch(self, key):\n        return self.client[key]\n'}
+FIX = json.dumps({"diff": "diff --git a/app/cache.py b/app/cache.py\n", "analysis": "Use get"})
+
+
+class ScriptedChatModel:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def invoke(self, prompt_text):
+        self.calls += 1
+        return AIMessage(content=self.responses.pop(0))
+
+    async def ainvoke(self, prompt_text):
+        return self.invoke(prompt_text)
+
+
+@pytest.fixture
+def llm_service(tmp_path, monkeypatch):
+    monkeypatch.setenv('LLM_CACHE_MODE', 'cache')
+    monkeypatch.setenv('LLM_CACHE_DIR', str(tmp_path / 'responses'))
+    service = GeminiAnalysisService({})
+    service.llm = ScriptedChatModel(['I think the fix is to use get', FIX])
+    return service
+
+
+def test_malformed_response_is_not_cached(llm_service):
+    with pytest.raises(OutputParserException):
+        llm_service.analyze_exception(EXCEPTION_DATA, TRACE_FILES)
+
+    # The retry asks the LLM again, and only its parsed response is replayed afterwards
+    assert llm_service.analyze_exception(EXCEPTION_DATA, TRACE_FILES)['analysis']['analysis'] == 'Use get'
+    assert llm_service.analyze_exception(EXCEPTION_DATA, TRACE_FILES)['analysis']['analysis'] == 'Use get'
+    assert llm_service.llm.calls == 2
+
+
+def test_malformed_async_response_is_not_cached(llm_service):
+    with pytest.raises(OutputParserException):
+        asyncio.run(llm_service.analyze_exception_async(EXCEPTION_DATA, TRACE_FILES))
+
+    assert asyncio.run(llm_service.analyze_exception_async(EXCEPTION_DATA, TRACE_FILES))['analysis']['analysis'] == 'Use get'
+    assert asyncio.run(llm_service.analyze_exception_async(EXCEPTION_DATA, TRACE_FILES))['analysis']['analysis'] == 'Use get'
+    assert llm_service.llm.calls == 2
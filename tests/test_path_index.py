@@ -0,0 +1,18 @@
+from conftest import DEFAULT_BRANCH, push_to_origin
+from exception_handler.index.path_index import PathIndex
+
+
+def test_paths_follow_origin_default_branch(origin, local_repo, tmp_path):
+    path_index = PathIndex(local_repo.working_tree_dir)
+    path_index.refresh()
+    assert path_index.resolve('/srv/app/cache.py') == 'app/cache.py'
+    assert path_index.resolve('/srv/app/retry.py') is None
+
+    push_to_origin(origin, tmp_path, 'app/retry.py', 'def retry(call):\n    return call()\n')
+    local_repo.git.fetch('origin', f'+refs/heads/{DEFAULT_BRANCH}:refs/remotes/origin/{DEFAULT_BRANCH}')
+    path_index.refresh()
+
+    # The file is only on origin's default branch, HEAD and the working tree of the clone don't have it
+    assert path_index.resolve('/srv/app/retry.py') == 'app/retry.py'
+    assert path_index.rev == origin.git.rev_parse(DEFAULT_BRANCH)
+    path_index.repo.close()
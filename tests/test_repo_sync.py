@@ -0,0 +1,20 @@
+import time
+from exception_handler.metrics import REGISTRY
+from exception_handler.vcs.repo_sync import RepoSync
+
+
+def sync_lag(name, branch):
+    prefix = f'exception_handler_repo_sync_lag_seconds{{repo="{name}",branch="{branch}"}} '
+    return next(float(line[len(prefix):]) for line in REGISTRY.render().splitlines() if line.startswith(prefix))
+
+
+def test_sync_lag_grows_between_fetches():
+    fetches = []
+    repo_sync = RepoSync(lambda *args: fetches.append(args), 'lag-test', interval=0, max_staleness=60)
+
+    repo_sync.ensure_fresh('main')
+    time.sleep(0.2)
+
+    # The lag is computed when scraped, not only when a fetch happens
+    assert len(fetches) == 1
+    assert sync_lag('lag-test', 'main') >= 0.2
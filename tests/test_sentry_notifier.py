@@ -0,0 +1,86 @@
+import json
+import pytest
+from benchmarks.event_parsing import make_event
+from exception_handler.notifiers import sentry_notifier
+from exception_handler.notifiers.sentry_notifier import SentryNotifier
+
+
+@pytest.fixture
+def streamed(monkeypatch):
+    calls = []
+    object_spans = sentry_notifier.object_spans
+
+    def counting_object_spans(*args, **kwargs):
+        calls.append(args)
+        return object_spans(*args, **kwargs)
+    monkeypatch.setattr(sentry_notifier, 'object_spans', counting_object_spans)
+    return calls
+
+
+@pytest.mark.parametrize('api_format', [False, True])
+def test_only_events_over_the_threshold_are_streamed(monkeypatch, streamed, api_format):
+    monkeypatch.delenv('EVENT_PARSE_MODE', raising=False)
+    monkeypatch.setenv('EVENT_STREAM_MIN_BYTES', '100000')
+    notifier = SentryNotifier({'local_repo_path': None})
+    small = json.dumps(make_event(api_format, 20000, 10, seed=1)).encode('utf-8')
+    large = json.dumps(make_event(api_format, 500000, 10, seed=2)).encode('utf-8')
+
+    assert notifier.load_event(small) == json.loads(small)
+    assert streamed == []
+
+    event = notifier.load_event(large)
+    assert streamed
+    # Streaming keeps the fields the handler reads and skips the breadcrumbs
+    assert event.get('event_id', event.get('id')) == 'event-2'
+    assert 'breadcrumbs' not in event
+
+
+def test_stream_mode_streams_every_event(monkeypatch, streamed):
+    monkeypatch.setenv('EVENT_PARSE_MODE', 'stream')
+    notifier = SentryNotifier({'local_repo_path': None})
+    body = json.dumps({"github_issue_id": 1, "event": make_event(False, 2000, 10, seed=1)}).encode('utf-8')
+    start = body.index(b'"event": ') + len(b'"event": ')
+
+    assert notifier.load_event(body, (start, len(body) - 1))['event_id'] == 'event-1'
+    assert streamed
+
+
+@pytest.fixture
+def scanned(monkeypatch):
+    import exception_handler.__main__ as app_module
+
+    calls = []
+    object_spans = app_module.object_spans
+
+    def counting_object_spans(*args, **kwargs):
+        calls.append(args)
+        return object_spans(*args, **kwargs)
+    monkeypatch.setattr(app_module, 'object_spans', counting_object_spans)
+    return app_module, calls
+
+
+def test_small_webhook_bodies_are_parsed_without_scanning(monkeypatch, scanned):
+    app_module, calls = scanned
+    monkeypatch.delenv('EVENT_PARSE_MODE', raising=False)
+    monkeypatch.setenv('EVENT_STREAM_MIN_BYTES', '100000')
+    event = make_event(False, 20000, 10, seed=1)
+    body = json.dumps({"github_issue_id": 12, "data": {"event": event}}).encode('utf-8')
+
+    assert app_module.load_webhook_payload(body) == (event, 12)
+    assert calls == []
+    assert app_module.load_webhook_payload(b'{"github_issue_id": 12, "data": {}}') == (None, 12)
+    with pytest.raises(ValueError):
+        app_module.load_webhook_payload(b'[1, 2]')
+
+
+def test_large_webhook_bodies_are_scanned(monkeypatch, scanned):
+    app_module, calls = scanned
+    monkeypatch.delenv('EVENT_PARSE_MODE', raising=False)
+    monkeypatch.setenv('EVENT_STREAM_MIN_BYTES', '100000')
+    body = json.dumps({"github_issue_id": 12, "data": {"event": make_event(False, 500000, 10, seed=2)}}).encode('utf-8')
+
+    event, github_issue_id = app_module.load_webhook_payload(body)
+
+    assert calls
+    assert (event['event_id'], github_issue_id) == ('event-2', 12)
+    assert 'breadcrumbs' not in event
@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+READINESS = """
+import exception_handler.__main__ as m
+client = m.get_app().test_client()
+before = client.get('/readyz').status_code
+m.init_worker()
+print(before, client.get('/readyz').status_code, m.project_registry.built_handler('1'))
+m.drain_worker(5)
+"""
+
+
+def test_worker_with_projects_config_becomes_ready(tmp_path, local_repo):
+    projects_config = tmp_path / 'projects.json'
+    projects_config.write_text(json.dumps({"projects": [
+        {"unique_identifier": "1", "repo": "test/repo", "local_repo_path": local_repo.working_tree_dir}
+    ]}))
+    env = {
+        **os.environ, 'PROJECTS_CONFIG': str(projects_config), 'JOB_STORE_PATH': '',
+        'PYTHONPATH': os.path.dirname(os.path.dirname(__file__))
+    }
+
+    # The app module reads its configuration on import, so the worker runs in a fresh interpreter
+    process = subprocess.run([sys.executable, '-c', READINESS], env=env, capture_output=True, text=True, cwd=tmp_path)
+
+    assert process.returncode == 0, process.stderr
+    # Ready without building the handler of a project that hasn't received an event yet
+    assert process.stdout.split()[-3:] == ['503', '200', 'None']
@@ -0,0 +1,17 @@
+import os
+import statistics
+from benchmarks.startup import FORBIDDEN, SCENARIOS, run_scenario
+
+# Same default as `python -m benchmarks.startup --budget`
+BUDGET = float(os.getenv('STARTUP_BUDGET', 1.0))
+
+
+def test_cli_startup_is_within_budget_and_skips_llm_sdks():
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1', 'PYTHONPATH': os.path.dirname(os.path.dirname(__file__))}
+    runs = [run_scenario(SCENARIOS['cli'], env) for _ in range(3)]
+
+    imported = {module['name'].split('.')[0] for module in runs[-1][1]}
+    assert not imported.intersection(FORBIDDEN['cli'])
+    # Neither LangChain nor the Google SDKs are needed before an event has to be analyzed
+    assert not [name for name in imported if name.startswith(('langchain', 'google'))]
+    assert statistics.median(elapsed for elapsed, _ in runs) <= BUDGET